@@ -0,0 +1,357 @@
+"""
+Headless batch runner of the research graph.
+
+Reads research topics from a JSONL file and runs a full research session for each of them without the frontend: many
+sessions run concurrently on one event loop, optionally in several worker processes. The review_proposal interrupt is
+answered by a review policy, and each finished report is written to the output directory as soon as it completes.
+Completed topics are recorded in a manifest, so an interrupted batch resumes where it stopped when it is run again.
+
+Each line of the topics file is a JSON object:
+    {"topic": "The state of solid state batteries", "id": "batteries", "sections": ["Market"], "max_sections": 5,
+     "remarks": "Focus on Europe"}
+Only "topic" is required. "sections" lists the section titles to approve, "max_sections" caps the number of approved
+sections and "remarks" is passed to the agent as review feedback.
+
+Usage (from the agent directory):
+    python -m batch topics.jsonl --output-dir reports --concurrency 8 --processes 2
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+
+MANIFEST_FILE = "manifest.jsonl"
+SUMMARY_FILE = "summary.json"
+FOLLOW_UP = "Write all the approved sections of the report that are not written yet."
+
+
+def job_id(topic: str) -> str:
+    """
+    Stable id of a topic, used as its report file name and thread id.
+    """
+    slug = re.sub(r"[^a-z0-9]+", "-", topic.lower()).strip("-")[:40]
+    return f"{slug}-{hashlib.blake2b(topic.encode('utf-8'), digest_size=4).hexdigest()}"
+
+
+def read_jobs(path: str) -> Iterator[dict]:
+    """
+    Jobs of a topics file, read lazily.
+    """
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if not job.get("topic"):
+                print(f"Skipping line {line_no} of {path}: no topic")
+                continue
+            job["id"] = str(job.get("id") or job_id(job["topic"]))
+            yield job
+
+
+def read_manifest(path: str) -> Dict[str, dict]:
+    """
+    Latest manifest record of every job.
+    """
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["id"]] = record
+    return records
+
+
+def review(proposal: dict, job: dict, policy: str, max_sections: int = 0) -> dict:
+    """
+    Answer the review_proposal interrupt. With the "proposed" policy the sections the outline writer approved are
+    approved, with "all" every section is. A job's own "sections" list overrides the policy.
+    """
+    wanted = job.get("sections")
+    max_sections = job.get("max_sections", max_sections)
+    sections, n_approved = {}, 0
+    for key, section in (proposal.get("sections") or {}).items():
+        if not isinstance(section, dict):
+            continue
+        if wanted is not None:
+            approved = section.get("title") in wanted
+        else:
+            approved = policy == "all" or bool(section.get("approved"))
+        approved = approved and not (max_sections and n_approved >= max_sections)
+        n_approved += approved
+        sections[key] = {**section, "approved": approved}
+
+    remarks = job.get("remarks", "")
+    if not n_approved:
+        remarks = remarks or "None of the proposed sections fit the topic, please propose a new outline."
+    return {**proposal, "sections": sections, "approved": bool(n_approved), "remarks": remarks}
+
+
+def render_report(job: dict, state: dict) -> str:
+    """
+    Markdown of a finished report: its sections in order followed by the sources.
+    """
+    parts = [f"# {state.get('title') or job['topic']}\n"]
+    for section in sorted(state.get("sections", []), key=lambda sec: sec["idx"]):
+        parts.append(f"## {section['title']}\n\n{section['content'].strip()}\n")
+        if section.get("footer"):
+            parts.append(f"{section['footer'].strip()}\n")
+    sources = state.get("sources", {})
+    if sources:
+        parts.append("## Sources\n")
+        parts.extend(f"- [{source.get('title') or url}]({url})" for url, source in sources.items())
+    return "\n".join(parts) + "\n"
+
+
+def _write_report(path: str, report: str) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(report)
+    os.replace(tmp_path, path)
+
+
+def _pending_sections(state: dict) -> bool:
+    return len(state.get("sections", [])) < len(state.get("outline") or {})
+
+
+async def run_job(graph, checkpointer, job: dict, args) -> dict:
+    """
+    Run one research session to completion and write its report. Returns the manifest record of the job.
+    """
+    from langchain_core.messages import HumanMessage
+    from langgraph.types import Command
+
+    thread_id = f"batch-{job['id']}"
+    config = {"configurable": {"thread_id": thread_id}, "recursion_limit": args.recursion_limit}
+    inputs = {"messages": [HumanMessage(content=job["topic"])], "sources": {}, "sections": [], "logs": [],
+              "outline": {}, "proposal": {}, "title": ""}
+    record = {"id": job["id"], "topic": job["topic"], "status": "failed", "reviews": 0, "follow_ups": 0}
+    start = time.perf_counter()
+    try:
+        while True:
+            await graph.ainvoke(inputs, config)
+            snapshot = await graph.aget_state(config)
+            state = snapshot.values
+            if snapshot.next:  # interrupted for the proposal review
+                record["reviews"] += 1
+                if record["reviews"] > args.max_reviews:
+                    raise RuntimeError(f"No outline was approved after {args.max_reviews} reviews")
+                record.setdefault("outline_s", time.perf_counter() - start)
+                inputs = Command(resume=review(state.get("proposal", {}), job, args.policy, args.max_sections))
+            elif _pending_sections(state) and record["follow_ups"] < args.max_follow_ups:
+                # The model stopped to ask for next steps before the approved outline was fully written
+                record["follow_ups"] += 1
+                inputs = {"messages": [HumanMessage(content=FOLLOW_UP)]}
+            else:
+                break
+
+        if not state.get("sections"):
+            raise RuntimeError("The session ended without writing any section")
+        path = os.path.join(args.output_dir, f"{job['id']}.md")
+        await asyncio.to_thread(_write_report, path, render_report(job, state))
+        record.update(status="done", report=path, sections=len(state["sections"]),
+                      sources=len(state.get("sources", {})))
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        record["latency_s"] = time.perf_counter() - start
+        record["finished_at"] = datetime.now().isoformat()
+        checkpointer.delete_thread(thread_id)  # the report is on disk, keep the process memory flat
+    return record
+
+
+async def serve(jobs: AsyncIterator[Optional[dict]], on_result: Callable[[dict], None], args) -> None:
+    """
+    Run the jobs with at most args.concurrency sessions in flight. Jobs are pulled from the iterator only when a
+    session slot is free, so a large topics file or a slow upstream never queues more work than can run.
+    """
+    from langgraph.checkpoint.memory import MemorySaver
+
+    if args.offline:
+        _use_fakes(args)
+    from graph import ResearchAgent
+    from telemetry import configure_from_env
+
+    configure_from_env()
+
+    checkpointer = MemorySaver()
+    graph = ResearchAgent(checkpointer=checkpointer).graph
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency)
+
+    async def feed():
+        async for job in jobs:
+            await queue.put(job)
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def work():
+        while (job := await queue.get()) is not None:
+            try:
+                record = await asyncio.wait_for(run_job(graph, checkpointer, job, args), args.job_timeout or None)
+            except asyncio.TimeoutError:
+                record = {"id": job["id"], "topic": job["topic"], "status": "failed",
+                          "error": f"Timed out after {args.job_timeout}s"}
+            on_result(record)
+
+    await asyncio.gather(feed(), *(work() for _ in range(args.concurrency)))
+
+
+def _use_fakes(args) -> None:
+    """
+    Run against the offline fakes of the benchmarks instead of OpenAI and Tavily.
+    """
+    import clients
+    from benchmarks.fakes import FakeChatModel, FakeTavilyClient
+
+    clients.register_tavily_client(FakeTavilyClient())
+
+    def fake_llm(model, **kwargs):
+        response_format = (kwargs.get("model_kwargs") or {}).get("response_format")
+        return FakeChatModel(n_sections=args.max_sections or 3, json_mode=bool(response_format))
+
+    clients.set_llm_factory(fake_llm)
+
+
+async def _iterate(items) -> AsyncIterator[dict]:
+    for item in items:
+        yield item
+
+
+async def _from_queue(jobs) -> AsyncIterator[dict]:
+    while (job := await asyncio.to_thread(jobs.get)) is not None:
+        yield job
+
+
+def _worker_process(jobs, results, args) -> None:
+    """
+    Entry point of a worker process: run the jobs of the shared queue and report their records.
+    """
+    try:
+        asyncio.run(serve(_from_queue(jobs), results.put, args))
+    finally:
+        results.put(None)
+
+
+class Manifest:
+    """
+    Append-only record of the finished jobs of a batch, with the throughput and latency summary of the run.
+    """
+
+    def __init__(self, output_dir: str):
+        self.path = os.path.join(output_dir, MANIFEST_FILE)
+        self.previous = read_manifest(self.path)
+        self.records: List[dict] = []
+        self.skipped = 0
+        self.started_at = time.perf_counter()
+
+    def completed(self) -> Set[str]:
+        return {job_id for job_id, record in self.previous.items()
+                if record["status"] == "done" and os.path.exists(record.get("report", ""))}
+
+    def add(self, record: dict) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.records.append(record)
+        if record["status"] == "done":
+            print(f"[{len(self.records)}] done   {record['id']} in {record['latency_s']:.1f}s: "
+                  f"{record['sections']} sections, {record['sources']} sources", flush=True)
+        else:
+            print(f"[{len(self.records)}] failed {record['id']}: {record.get('error')}", flush=True)
+
+    def summary(self) -> dict:
+        wall_time = time.perf_counter() - self.started_at
+        done = [record for record in self.records if record["status"] == "done"]
+        latencies = sorted(record["latency_s"] for record in done) or [0.0]
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, math.ceil(len(latencies) * q) - 1)]
+
+        return {
+            "jobs": len(self.records),
+            "done": len(done),
+            "failed": len(self.records) - len(done),
+            "skipped": self.skipped,
+            "wall_time_s": wall_time,
+            "jobs_per_minute": len(done) / wall_time * 60 if wall_time else 0.0,
+            "latency_s": {"p50": percentile(0.5), "p95": percentile(0.95), "max": latencies[-1],
+                          "mean": sum(latencies) / len(latencies)},
+            "outline_s": {"mean": sum(record.get("outline_s", 0.0) for record in done) / max(len(done), 1)},
+            "reviews": sum(record.get("reviews", 0) for record in self.records),
+            "follow_ups": sum(record.get("follow_ups", 0) for record in self.records),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("topics", help="JSONL file of topics")
+    parser.add_argument("--output-dir", default="reports", help="where to write the reports, manifest and summary")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions in flight per process")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes, each with its own event loop")
+    parser.add_argument("--policy", choices=("proposed", "all"), default="proposed",
+                        help="sections to approve: the ones the outline writer approved, or all of them")
+    parser.add_argument("--max-sections", type=int, default=0, help="approve at most this many sections, 0 for no limit")
+    parser.add_argument("--max-reviews", type=int, default=3, help="proposal reviews before a job is given up")
+    parser.add_argument("--max-follow-ups", type=int, default=2,
+                        help="messages sent to finish the approved outline when the model stops early")
+    parser.add_argument("--job-timeout", type=float, default=1800, help="seconds before a job is given up, 0 for none")
+    parser.add_argument("--recursion-limit", type=int, default=100, help="graph recursion limit of each run")
+    parser.add_argument("--offline", action="store_true", help="use the offline fakes of the benchmarks")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest = Manifest(args.output_dir)
+    completed = manifest.completed()
+
+    def pending() -> Iterator[dict]:
+        for job in read_jobs(args.topics):
+            if job["id"] in completed:
+                manifest.skipped += 1
+                continue
+            yield job
+
+    if args.processes <= 1:
+        asyncio.run(serve(_iterate(pending()), manifest.add, args))
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        jobs, results = ctx.Queue(maxsize=args.processes * args.concurrency), ctx.Queue()
+        workers = [ctx.Process(target=_worker_process, args=(jobs, results, args)) for _ in range(args.processes)]
+        for worker in workers:
+            worker.start()
+
+        def feed():
+            for job in pending():
+                jobs.put(job)  # blocks while every worker has a full queue of jobs
+            for _ in workers:
+                jobs.put(None)
+
+        threading.Thread(target=feed, daemon=True).start()
+        running = len(workers)
+        while running:
+            record = results.get()
+            if record is None:
+                running -= 1
+            else:
+                manifest.add(record)
+        for worker in workers:
+            worker.join()
+
+    summary = manifest.summary()
+    with open(os.path.join(args.output_dir, SUMMARY_FILE), "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"{summary['done']} done, {summary['failed']} failed, {summary['skipped']} already done in "
+          f"{summary['wall_time_s']:.1f}s ({summary['jobs_per_minute']:.1f} jobs/min), latency "
+          f"p50={summary['latency_s']['p50']:.1f}s p95={summary['latency_s']['p95']:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
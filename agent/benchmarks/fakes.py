@@ -0,0 +1,208 @@
+import asyncio
+import json
+import random
+import zlib
+from typing import Any, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from tokens import count_tokens
+
+# Description: Deterministic offline stand-ins for AsyncTavilyClient and ChatOpenAI, with configurable latency and
+# payload sizes. The fake agent model scripts the tool calls of a full research session:
+# search -> extract -> outline -> review -> sections -> (next run) edit.
+
+# Token usage of every fake model call in the process
+USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "calls": 0}
+
+WORDS = ("research", "market", "analysis", "growth", "policy", "energy", "battery", "network", "model", "data",
+         "climate", "supply", "demand", "regulation", "technology", "investment", "risk", "adoption", "cost", "trend")
+
+
+def lorem(n_bytes: int, seed: int) -> str:
+    """
+    Deterministic pseudo text of roughly n_bytes, split into paragraphs.
+    """
+    rng = random.Random(seed)
+    words, size = [], 0
+    while size < n_bytes:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+        if len(words) % 60 == 0:
+            words.append("\n\n")
+    return " ".join(words)
+
+
+# Navigation, banners and footer around the text of every extracted page, like the pages Tavily returns
+PAGE_HEADER = "\n".join(["Skip to content", "Home", "News", "Markets", "Technology", "Opinion", "About us",
+                         "![logo](https://example.com/logo.png)", "We use cookies to improve your experience. Accept all",
+                         "Sign in", ""])
+PAGE_FOOTER = "\n".join(["", "Share on Twitter", "Share on LinkedIn", "Related articles",
+                         *[f"* [Story {i}](https://example.com/story/{i})" for i in range(20)],
+                         "Subscribe to our newsletter", "Privacy Policy", "Terms of Service",
+                         "© 2025 Example Media. All rights reserved."])
+
+
+class FakeTavilyClient:
+    """
+    Offline AsyncTavilyClient with the same search/extract signatures.
+    """
+
+    def __init__(self, latency: float = 0.05, results_per_query: int = 10, content_bytes: int = 600,
+                 raw_content_bytes: int = 20000):
+        self.latency = latency
+        self.results_per_query = results_per_query
+        self.content_bytes = content_bytes
+        self.raw_content_bytes = raw_content_bytes
+        self.calls = {"search": 0, "extract": 0}
+
+    async def search(self, query: str, max_results: int = 10, **kwargs) -> Dict[str, Any]:
+        self.calls["search"] += 1
+        await asyncio.sleep(self.latency)
+        seed = zlib.crc32(query.encode()) % 10_000
+        return {"query": query, "results": [
+            {
+                "url": f"https://example.com/{seed}/{i}",
+                "title": f"Result {i} for {query}",
+                "content": lorem(self.content_bytes, seed * 100 + i),
+                "score": 0.9 - i * 0.01,
+                "published_date": "2025-01-01",
+            }
+            for i in range(min(max_results, self.results_per_query))
+        ]}
+
+    async def extract(self, urls: List[str], **kwargs) -> Dict[str, Any]:
+        self.calls["extract"] += 1
+        await asyncio.sleep(self.latency)
+        return {"results": [{"url": url, "raw_content": PAGE_HEADER + lorem(self.raw_content_bytes, zlib.crc32(url.encode())) + PAGE_FOOTER}
+                            for url in urls],
+                "failed_results": []}
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline chat model. Depending on how it is bound it plays the agent (routing tool calls), the outline writer
+    (JSON proposal) or the section writer (WriteSection tool call).
+    """
+
+    latency: float = 0.05
+    n_sections: int = 3
+    n_sub_queries: int = 1
+    section_bytes: int = 3000
+    stream_chunk_chars: int = 40
+    json_mode: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-research-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        tool_names = {tool["function"]["name"] for tool in tools or []}
+        if "WriteSection" in tool_names:
+            return self._write_section(messages)
+        if "PatchSection" in tool_names:
+            return self._patch_section(messages)
+        if self.json_mode:
+            return AIMessage(content=self._proposal())
+        return self._route(messages)
+
+    def _route(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, HumanMessage):
+            if "**Report**" in messages[0].content:
+                return _tool_call("section_writer", {"research_query": "benchmark", "section_title": "Section 0", "idx": 0})
+            return _tool_call("tavily_search", {"sub_queries": [
+                {"query": f"benchmark topic {i}", "topic": "general", "days": 30} for i in range(self.n_sub_queries)
+            ]})
+        if isinstance(last, SystemMessage):
+            return _tool_call("approved_sections_writer", {"research_query": "benchmark"})
+        if isinstance(last, ToolMessage):
+            if last.name == "tavily_search":
+                return _tool_call("tavily_extract", {"urls": _first_urls(last.content, 3)})
+            if last.name == "tavily_extract":
+                return _tool_call("outline_writer", {"research_query": "benchmark"})
+            if last.name == "outline_writer":
+                return _tool_call("review_proposal", {"proposal": "proposal"})
+        return AIMessage(content="I have completed the report. Would you like me to edit a section?")
+
+    def _proposal(self) -> str:
+        return json.dumps({"sections": {
+            f"section{i}": {"title": f"Section {i}", "description": f"Covers {WORDS[i % len(WORDS)]} and related trends",
+                            "approved": True}
+            for i in range(self.n_sections)
+        }})
+
+    def _write_section(self, messages: List[BaseMessage]) -> AIMessage:
+        seed = len(messages[-1].content)
+        return AIMessage(content="", tool_calls=[{
+            "name": "WriteSection",
+            "id": f"call_section_{seed}",
+            "args": {"title": "Section", "content": lorem(self.section_bytes, seed), "footer": "[^1]: https://example.com",
+                     "section_number": 0},
+        }])
+
+    def _patch_section(self, messages: List[BaseMessage]) -> AIMessage:
+        # Shorten the first block of the numbered section in the system prompt
+        block = messages[0].content.split("[block 0]\n", 1)[-1].split("\n\n", 1)[0]
+        return AIMessage(content="", tool_calls=[{
+            "name": "PatchSection",
+            "id": "call_patch_section",
+            "args": {"edits": [{"op": "replace", "block": 0, "anchor": " ".join(block.split()[:6]),
+                                "text": " ".join(block.split()[:20])}]},
+        }])
+
+    def _record(self, messages: List[BaseMessage], message: AIMessage) -> AIMessage:
+        prompt_tokens = sum(count_tokens(m.content if isinstance(m.content, str) else json.dumps(m.content)) for m in messages)
+        completion_tokens = count_tokens(message.content) + count_tokens(json.dumps([c["args"] for c in message.tool_calls]))
+        USAGE["prompt_tokens"] += prompt_tokens
+        USAGE["completion_tokens"] += completion_tokens
+        USAGE["calls"] += 1
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        return message
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._record(messages, self._respond(messages, kwargs.get("tools")))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._generate(messages, stop=stop, **kwargs)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        message = self._record(messages, self._respond(messages, kwargs.get("tools")))
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata, tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": 0} for c in message.tool_calls
+            ]))
+            return
+        for i in range(0, len(message.content), self.stream_chunk_chars):
+            await asyncio.sleep(0)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=message.content[i:i + self.stream_chunk_chars]))
+            if i + self.stream_chunk_chars >= len(message.content):
+                # Like OpenAI with stream_usage, the usage arrives with the last chunk
+                chunk.message.usage_metadata = message.usage_metadata
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def _tool_call(name: str, args: dict) -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{name}"}])
+
+
+def _first_urls(tool_msg: str, n: int) -> List[str]:
+    urls = []
+    for part in tool_msg.split('"url": "')[1:]:
+        urls.append(part.split('"', 1)[0])
+        if len(urls) == n:
+            break
+    return urls
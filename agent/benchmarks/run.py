@@ -0,0 +1,292 @@
+"""
+Offline end to end benchmark of the research graph.
+
+Drives the compiled graph of graph.py through a full session (search -> extract -> outline -> interrupt/resume
+feedback -> sections -> edit) against the fakes in benchmarks/fakes.py, for a grid of report sizes and source counts.
+Every scenario runs in a fresh subprocess so caches and peak RSS do not leak between scenarios.
+
+Usage (from the agent directory):
+    python -m benchmarks.run --sections 3 10 30 --sources 10 100 500 --output bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+NODES = ("call_model_node", "tool_node", "process_feedback_node")
+EMIT_EVENT = "copilotkit_manually_emit_intermediate_state"
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag as the delay of a periodic sleep beyond its expected wake-up time.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(loop.time() - start - self.interval, 0.0))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def summary(self) -> Dict[str, float]:
+        lags = sorted(self.lags) or [0.0]
+        return {
+            "max_ms": lags[-1] * 1000,
+            "p99_ms": lags[min(len(lags) - 1, math.ceil(len(lags) * 0.99) - 1)] * 1000,
+            "mean_ms": sum(lags) / len(lags) * 1000,
+        }
+
+
+async def _drive(graph, inputs, config, metrics, starts):
+    """
+    Run the graph once, recording node/tool wall times and emitted state sizes from its event stream.
+    """
+    async for event in graph.astream_events(inputs, config, version="v2"):
+        kind, name, run_id = event["event"], event.get("name"), event["run_id"]
+        if kind in ("on_chain_start", "on_tool_start") and (name in NODES or kind == "on_tool_start"):
+            starts[run_id] = time.perf_counter()
+        elif kind in ("on_chain_end", "on_tool_end") and run_id in starts:
+            group = "nodes" if kind == "on_chain_end" else "tools"
+            elapsed = time.perf_counter() - starts.pop(run_id)
+            stats = metrics[group][name]
+            stats["count"] += 1
+            stats["total_s"] += elapsed
+            stats["max_s"] = max(stats["max_s"], elapsed)
+        elif kind == "on_custom_event" and name == EMIT_EVENT:
+            metrics["emitted_state_events"] += 1
+            metrics["emitted_state_bytes"] += len(json.dumps(event["data"], default=str))
+
+
+async def run_session(n_sections: int, n_sources: int, args) -> dict:
+    """
+    Run one full research session and return its metrics.
+    """
+    from langchain_core.messages import HumanMessage
+    from langgraph.checkpoint.memory import MemorySaver
+    from langgraph.types import Command
+
+    import clients
+    from benchmarks.fakes import FakeChatModel, FakeTavilyClient, USAGE
+    from graph import ResearchAgent
+    from llm_cache import llm_cache_stats
+    from state_budget import session_stats
+    from telemetry import configure_from_env
+
+    configure_from_env()
+
+    tavily = FakeTavilyClient(latency=args.tavily_latency, content_bytes=args.content_bytes,
+                              raw_content_bytes=args.raw_content_bytes)
+    clients.register_tavily_client(tavily)
+    n_sub_queries = max(1, math.ceil(n_sources / tavily.results_per_query))
+
+    def fake_llm(model, **kwargs):
+        response_format = (kwargs.get("model_kwargs") or {}).get("response_format")
+        return FakeChatModel(latency=args.llm_latency, n_sections=n_sections, n_sub_queries=n_sub_queries,
+                             section_bytes=args.section_bytes, json_mode=bool(response_format))
+
+    clients.set_llm_factory(fake_llm)
+
+    checkpointer = MemorySaver()
+    graph = ResearchAgent(checkpointer=checkpointer).graph
+    config = {"configurable": {"thread_id": f"bench-{n_sections}-{n_sources}"}, "recursion_limit": 100}
+    metrics = {
+        "nodes": defaultdict(lambda: {"count": 0, "total_s": 0.0, "max_s": 0.0}),
+        "tools": defaultdict(lambda: {"count": 0, "total_s": 0.0, "max_s": 0.0}),
+        "emitted_state_events": 0,
+        "emitted_state_bytes": 0,
+    }
+    starts = {}
+    initial_state = {"messages": [HumanMessage(content="Research the benchmark topic")], "sources": {}, "sections": [],
+                     "logs": [], "outline": {}, "proposal": {}, "title": ""}
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    phases = {}
+    session_start = time.perf_counter()
+
+    # Search, extract and outline until the graph is interrupted for the proposal review
+    start = time.perf_counter()
+    await _drive(graph, initial_state, config, metrics, starts)
+    phases["research_and_outline_s"] = time.perf_counter() - start
+
+    # Approve every proposed section and resume, which writes the report
+    snapshot = await graph.aget_state(config)
+    proposal = snapshot.values.get("proposal", {})
+    reviewed = {**proposal, "approved": True, "remarks": "",
+                "sections": {k: {**v, "approved": True} for k, v in proposal.get("sections", {}).items()}}
+    await asyncio.sleep(args.review_seconds)
+    start = time.perf_counter()
+    await _drive(graph, Command(resume=reviewed), config, metrics, starts)
+    phases["sections_s"] = time.perf_counter() - start
+
+    # Edit a section in a follow up run
+    start = time.perf_counter()
+    await _drive(graph, {"messages": [HumanMessage(content="Please make Section 0 more concise")]}, config, metrics, starts)
+    phases["edit_s"] = time.perf_counter() - start
+
+    wall_time = time.perf_counter() - session_start - args.review_seconds
+    await monitor.stop()
+    start = time.perf_counter()
+    final_state = (await graph.aget_state(config)).values
+    checkpoint_load_s = time.perf_counter() - start
+
+    return {
+        "sections": n_sections,
+        "sources": n_sources,
+        "failed_checks": _check_report(final_state, n_sections),
+        "sources_in_state": len(final_state.get("sources", {})),
+        "sections_in_state": len(final_state.get("sections", [])),
+        "wall_time_s": wall_time,
+        "phases": phases,
+        "nodes": dict(metrics["nodes"]),
+        "tools": dict(metrics["tools"]),
+        "event_loop_lag": monitor.summary(),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "emitted_state_events": metrics["emitted_state_events"],
+        "emitted_state_bytes": metrics["emitted_state_bytes"],
+        "checkpoint_bytes": _checkpoint_bytes(checkpointer),
+        "checkpoint_load_s": checkpoint_load_s,
+        "prompt_tokens": USAGE["prompt_tokens"],
+        "completion_tokens": USAGE["completion_tokens"],
+        "llm_calls": USAGE["calls"],
+        "llm_cache": llm_cache_stats(),
+        "state_size": session_stats()["by_session"].get(config["configurable"]["thread_id"]),
+        "tavily_calls": dict(tavily.calls),
+    }
+
+
+def _check_report(state: dict, n_sections: int) -> List[str]:
+    """
+    Correctness checks of the final state of a session, the names of the failed ones.
+    """
+    sections = state.get("sections") or []
+    checks = {
+        "every section written": [section.get("idx") for section in sections] == list(range(n_sections)),
+        "sections have content": all((section.get("content") or "").strip() for section in sections),
+        "edited section 0": bool(sections) and sections[0].get("version", 1) > 1,
+        "sources kept": bool(state.get("sources")),
+        "outline approved": len(state.get("outline") or {}) == n_sections,
+    }
+    return [name for name, ok in checks.items() if not ok]
+
+
+def _checkpoint_bytes(checkpointer) -> int:
+    """
+    Bytes stored by the in-memory checkpointer.
+    """
+    size = sum(len(data) for _, data in checkpointer.blobs.values())
+    for namespaces in checkpointer.storage.values():
+        for checkpoints in namespaces.values():
+            size += sum(len(checkpoint[1]) + len(metadata[1]) for checkpoint, metadata, _ in checkpoints.values())
+    for writes in checkpointer.writes.values():
+        size += sum(len(write[2][1]) for write in writes.values())
+    return size
+
+
+def _run_scenario(n_sections: int, n_sources: int, args, queue):
+    # Keep caches and blobs of a scenario private to it
+    workdir = tempfile.mkdtemp(prefix="research-bench-")
+    os.environ["TAVILY_CACHE_PATH"] = ""
+    os.environ["BLOB_STORE_PATH"] = os.path.join(workdir, "blobs")
+    os.environ["KNOWLEDGE_STORE_PATH"] = os.path.join(workdir, "knowledge.sqlite3")
+    # Model responses are only kept across runs when recording or replaying them. The fake models answer by the size
+    # of the scenario rather than by the prompt, so every scenario has its own recordings.
+    base, ext = os.path.splitext(args.llm_cache_path)
+    os.environ["LLM_CACHE_MODE"] = args.llm_cache
+    os.environ["LLM_CACHE_PATH"] = f"{base}-{n_sections}x{n_sources}{ext}" if args.llm_cache != "off" else ""
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ.setdefault("TAVILY_API_KEY", "offline")
+    try:
+        queue.put(asyncio.run(run_session(n_sections, n_sources, args)))
+    except Exception as e:
+        queue.put({"sections": n_sections, "sources": n_sources, "error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", type=int, nargs="+", default=[3, 10, 30], help="report sizes to run")
+    parser.add_argument("--sources", type=int, nargs="+", default=[10, 100, 500], help="source counts to run")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds per fake model call")
+    parser.add_argument("--tavily-latency", type=float, default=0.05, help="seconds per fake Tavily call")
+    parser.add_argument("--content-bytes", type=int, default=600, help="bytes of each search result's content")
+    parser.add_argument("--raw-content-bytes", type=int, default=20000, help="bytes of each extracted page")
+    parser.add_argument("--section-bytes", type=int, default=3000, help="bytes of each written section")
+    parser.add_argument("--review-seconds", type=float, default=0.0, help="seconds the user takes to review the proposal")
+    parser.add_argument("--llm-cache", choices=("off", "record", "replay"), default="off",
+                        help="record the model responses, or replay them without calling the models")
+    parser.add_argument("--llm-cache-path", default="bench_llm_cache.sqlite3", help="recordings of --llm-cache")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    args = parser.parse_args(argv)
+
+    ctx = multiprocessing.get_context("spawn")
+    scenarios = []
+    for n_sections in args.sections:
+        for n_sources in args.sources:
+            queue = ctx.Queue()
+            process = ctx.Process(target=_run_scenario, args=(n_sections, n_sources, args, queue))
+            process.start()
+            result = queue.get()
+            process.join()
+            scenarios.append(result)
+            if "error" in result:
+                print(f"sections={n_sections:>3} sources={n_sources:>4} failed: {result['error']}", flush=True)
+                continue
+            if result["failed_checks"]:
+                print(f"sections={n_sections:>3} sources={n_sources:>4} failed checks: "
+                      f"{', '.join(result['failed_checks'])}", flush=True)
+            print(f"sections={n_sections:>3} sources={n_sources:>4} wall={result['wall_time_s']:.2f}s "
+                  f"rss={result['peak_rss_mb']:.0f}MB emitted={result['emitted_state_bytes'] / 1024:.0f}KB "
+                  f"checkpoints={result['checkpoint_bytes'] / 1024:.0f}KB "
+                  f"prompt_tokens={result['prompt_tokens']} loop_lag_max={result['event_loop_lag']['max_ms']:.1f}ms",
+                  flush=True)
+
+    results = {
+        "revision": _git_revision(),
+        "timestamp": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.output}")
+    if any("error" in result or result["failed_checks"] for result in scenarios):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
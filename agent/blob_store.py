@@ -0,0 +1,125 @@
+import hashlib
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, zlib is used when it is not installed
+    zstandard = None
+
+# Description: Content-addressed blob store for large page content (raw_content) that should not live in state.
+# State only keeps a {"hash", "bytes"} reference, the compressed content is written once per distinct page under
+# BLOB_STORE_PATH and shared by every session of the worker. Recently read blobs are kept in a small LRU.
+
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", ".cache/blobs")
+BLOB_CACHE_ENTRIES = int(os.getenv("BLOB_CACHE_ENTRIES", "64"))
+MMAP_THRESHOLD_BYTES = 1 << 20  # compressed blobs larger than this are read through mmap
+
+REF_KEY = "raw_content_ref"
+
+
+class BlobStore:
+    """
+    Filesystem blob store. Blobs are addressed by the sha256 of their utf-8 content and compressed with zstd when
+    the zstandard package is installed, zlib otherwise.
+    """
+
+    def __init__(self, root: str = BLOB_STORE_PATH, cache_entries: int = BLOB_CACHE_ENTRIES):
+        self.root = root
+        self.cache_entries = cache_entries
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str) -> str:
+        suffix = ".zst" if zstandard is not None else ".z"
+        return os.path.join(self.root, digest[:2], digest[2:] + suffix)
+
+    def _find(self, digest: str) -> Optional[str]:
+        for suffix in (".zst", ".z"):
+            path = os.path.join(self.root, digest[:2], digest[2:] + suffix)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def put(self, text: str) -> dict:
+        """
+        Store text and return its reference. Content that is already stored is not written again.
+        """
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        if self._find(digest) is None:
+            path = self._path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zstandard.ZstdCompressor(level=3).compress(data) if zstandard is not None else zlib.compress(data, 6)
+            # Write to a temporary file and rename, so concurrent writers of the same blob never expose a partial file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+        return {"hash": digest, "bytes": len(data)}
+
+    def get(self, digest: str) -> str:
+        """
+        Return the text stored under digest. Raises KeyError when the blob does not exist.
+        """
+        with self._lock:
+            text = self._cache.get(digest)
+            if text is not None:
+                self._cache.move_to_end(digest)
+                return text
+
+        path = self._find(digest)
+        if path is None:
+            raise KeyError(digest)
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD_BYTES:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    data = self._decompress(path, mapped)
+            else:
+                data = self._decompress(path, f.read())
+        text = data.decode("utf-8")
+
+        with self._lock:
+            self._cache[digest] = text
+            while len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        return text
+
+    @staticmethod
+    def _decompress(path: str, data) -> bytes:
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to read {path}")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        return zlib.decompress(data)
+
+
+blob_store = BlobStore()
+
+
+def store_raw_content(source: dict, raw_content: str) -> dict:
+    """
+    Move raw_content out of a source into the blob store, keeping only the reference in the source.
+    """
+    source.pop("raw_content", None)
+    source[REF_KEY] = blob_store.put(raw_content)
+    return source
+
+
+def resolve_raw_content(source: dict) -> str:
+    """
+    Return the raw_content of a source, loading it from the blob store when the source only holds a reference.
+    """
+    if source.get("raw_content"):
+        return source["raw_content"]
+    ref = source.get(REF_KEY)
+    if not ref:
+        return ""
+    try:
+        return blob_store.get(ref["hash"])
+    except KeyError:
+        return ""
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+from telemetry import add_attribute
+
+# Description: Two tier TTL cache (in-memory LRU + on-disk SQLite) with single-flight coalescing of concurrent
+# identical requests. Used to avoid re-issuing identical Tavily searches and extracts across turns and sessions.
+# Expired rows are deleted from the disk tier when it is opened and every CACHE_PRUNE_INTERVAL writes, which also
+# caps the disk tier to its max_disk_entries entries that expire last.
+
+CACHE_PATH = os.getenv("TAVILY_CACHE_PATH", ".cache/tavily.sqlite3")  # empty string disables the disk tier
+CACHE_MEMORY_ENTRIES = int(os.getenv("TAVILY_CACHE_MEMORY_ENTRIES", "2048"))
+CACHE_DISK_ENTRIES = int(os.getenv("TAVILY_CACHE_DISK_ENTRIES", "100000"))  # 0 disables the cap
+CACHE_PRUNE_INTERVAL = int(os.getenv("CACHE_PRUNE_INTERVAL", "256"))
+
+# Time to live in seconds. News results go stale quickly, general results and extracted pages do not.
+SEARCH_TTLS = {
+    "news": float(os.getenv("TAVILY_CACHE_TTL_NEWS", str(15 * 60))),
+    "general": float(os.getenv("TAVILY_CACHE_TTL_GENERAL", str(3 * 24 * 60 * 60))),
+}
+EXTRACT_TTL = float(os.getenv("TAVILY_CACHE_TTL_EXTRACT", str(7 * 24 * 60 * 60)))
+
+MISSING = object()
+
+
+class TieredCache:
+    """
+    A TTL cache with an in-memory LRU tier in front of an optional SQLite tier. Concurrent misses for the same key
+    share a single upstream fetch. Values must be JSON serializable.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = CACHE_PATH, max_entries: int = CACHE_MEMORY_ENTRIES,
+                 max_disk_entries: int = CACHE_DISK_ENTRIES):
+        self.name = name
+        self.path = path
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "pruned": 0}
+
+    @staticmethod
+    def make_key(*parts: Hashable) -> str:
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    def _connect(self):
+        """
+        Open the SQLite database on first use, so importing the cache does no IO.
+        """
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS cache_{self.name} (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS cache_{self.name}_expires_at ON cache_{self.name} (expires_at)"
+            )
+            self._prune()
+        return self._db
+
+    def _prune(self) -> int:
+        """
+        Delete the expired rows of the disk tier, then the rows that expire first over max_disk_entries. Returns the
+        number of rows deleted. Called with the database open and locked.
+        """
+        table = f"cache_{self.name}"
+        deleted = self._db.execute(f"DELETE FROM {table} WHERE expires_at < ?", (time.time(),)).rowcount
+        if self.max_disk_entries:
+            excess = self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] - self.max_disk_entries
+            if excess > 0:
+                deleted += self._db.execute(
+                    f"DELETE FROM {table} WHERE key IN (SELECT key FROM {table} ORDER BY expires_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        self.stats["pruned"] += deleted
+        return deleted
+
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            row = self._connect().execute(
+                f"SELECT value, expires_at FROM cache_{self.name} WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING, 0.0
+        return json.loads(row[0]), row[1]
+
+    def _disk_set(self, key: str, value: Any, expires_at: float):
+        with self._db_lock:
+            self._connect().execute(
+                f"INSERT OR REPLACE INTO cache_{self.name} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            self._writes += 1
+            if self._writes % CACHE_PRUNE_INTERVAL == 0:
+                self._prune()
+
+    def _memory_set(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str):
+        """
+        Return the cached value for key, or MISSING.
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] >= time.time():
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[1]
+            del self._memory[key]
+
+        if self.path:
+            value, expires_at = await asyncio.to_thread(self._disk_get, key)
+            if value is not MISSING:
+                self._memory_set(key, value, expires_at)
+                self.stats["disk_hits"] += 1
+                return value
+        return MISSING
+
+    async def set(self, key: str, value: Any, ttl: float):
+        expires_at = time.time() + ttl
+        self._memory_set(key, value, expires_at)
+        if self.path:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]], ttl: float):
+        """
+        Return the cached value for key, or fetch it. Concurrent callers missing the same key wait for one fetch.
+        """
+        values = await self.get_many_or_fetch([key], lambda keys: _fetch_one(keys[0], fetch), ttl)
+        return values[key]
+
+    async def get_many_or_fetch(self, keys: List[str], fetch_many: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+                                ttl: float) -> Dict[str, Any]:
+        """
+        Batch version of get_or_fetch. fetch_many is called once with the keys that are neither cached nor already
+        being fetched, and returns a dict of the values it could fetch. Keys it did not return are not cached and
+        map to None. When the caller fetching a key is cancelled, the callers waiting for it fetch it again.
+        """
+        values, waiting, to_fetch = {}, {}, []
+        for key in dict.fromkeys(keys):
+            value = await self.get(key)
+            if value is not MISSING:
+                values[key] = value
+                add_attribute("cache_hits", 1)
+            elif key in self._inflight:
+                self.stats["coalesced"] += 1
+                waiting[key] = self._inflight[key]
+                add_attribute("cache_hits", 1)
+            else:
+                self.stats["misses"] += 1
+                to_fetch.append(key)
+                add_attribute("cache_misses", 1)
+
+        if to_fetch:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in to_fetch}
+            self._inflight.update(futures)
+            try:
+                fetched = await fetch_many(to_fetch)
+                for key in to_fetch:
+                    value = fetched.get(key)
+                    if value is not None:
+                        await self.set(key, value, ttl)
+                    values[key] = value
+                    futures[key].set_result(value)
+            except Exception as e:
+                for future in futures.values():
+                    if not future.done():
+                        future.set_exception(e)
+                        # The exception is re-raised to the fetching caller, silence "never retrieved" warnings
+                        future.exception()
+                raise
+            except asyncio.CancelledError:
+                # The fetching caller was cancelled, its waiters fetch the keys themselves
+                for future in futures.values():
+                    future.cancel()
+                raise
+            finally:
+                for key in to_fetch:
+                    self._inflight.pop(key, None)
+
+        for key, future in waiting.items():
+            try:
+                # Shielded, a cancelled waiter must not cancel the fetch the other callers wait for
+                values[key] = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                values.update(await self.get_many_or_fetch([key], fetch_many, ttl))
+        return values
+
+
+async def _fetch_one(key, fetch):
+    return {key: await fetch()}
+
+
+search_cache = TieredCache("search")
+extract_cache = TieredCache("extract")
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Hit and miss counters of the Tavily caches.
+    """
+    return {"search": dict(search_cache.stats), "extract": dict(extract_cache.stats)}
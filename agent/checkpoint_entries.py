@@ -0,0 +1,360 @@
+import hashlib
+import os
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+import ormsgpack
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata,
+                                       CheckpointTuple)
+from langgraph.graph.state import CompiledStateGraph
+
+from blob_store import REF_KEY
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, zlib is used when it is not installed
+    zstandard = None
+
+# Description: ResearchState aware checkpointing. LangGraph stores every channel that changed in a super-step again,
+# so the sources and sections of a long session were written in full at nearly every step. EntryCheckpointSaver wraps
+# the checkpointer the graph runs with and stores each source and section once, as a content-addressed entry: the
+# sources and sections channels only hold the hashes of their entries, and the entries that are new in a checkpoint
+# are written with it, in a segment channel of their own. A checkpoint lists the segments holding its entries, which
+# the checkpointer writes once and reads back with the checkpoint. Pending writes of sources and sections carry the
+# hashes and their entries, as they can be stored and read before the checkpoint holding the entries.
+#
+# Entries are kept by the checkpointer itself, with the checkpoints of their thread: every worker that reads the
+# checkpoints reads the entries, and deleting a thread deletes its entries. There is no separate read, entries come
+# in the same read as their checkpoint and are only unpacked for the checkpoints that are loaded. Other large channel
+# values are zstd compressed. Page content (raw_content) is already out of state, in the blob store.
+#
+# ResearchGraph wraps every checkpointer assigned to it, including the one the LangGraph server sets on a copy of the
+# served graph.
+
+CHECKPOINT_COMPRESS_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_BYTES", "1024"))
+CHECKPOINT_TRACKED_THREADS = int(os.getenv("CHECKPOINT_TRACKED_THREADS", "1024"))
+
+ENTRY_CHANNELS = ("sources", "sections")
+SEGMENT_PREFIX = "__entries__:"
+REFS_KEY = "__entry_refs__"
+COMPRESSED_KEY = "__compressed__"
+SOURCE_KEYS = ("url", "content", REF_KEY)
+
+# First byte of a packed entry
+_RAW, _ZSTD, _ZLIB = b"\x00", b"\x01", b"\x02"
+
+
+def _compress(data: bytes) -> Tuple[bytes, bytes]:
+    if zstandard is not None:
+        return _ZSTD, zstandard.ZstdCompressor(level=3).compress(data)
+    return _ZLIB, zlib.compress(data, 6)
+
+
+def _decompress(kind: bytes, data: bytes) -> bytes:
+    if kind == _ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this checkpoint")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if kind == _ZLIB:
+        return zlib.decompress(data)
+    return data
+
+
+def _is_sources(value: Any) -> bool:
+    return (isinstance(value, dict) and bool(value)
+            and all(isinstance(v, dict) and any(k in v for k in SOURCE_KEYS) for v in value.values()))
+
+
+def _is_sections(value: Any) -> bool:
+    return (isinstance(value, list) and bool(value)
+            and all(isinstance(v, dict) and "idx" in v and "content" in v for v in value))
+
+
+def pack_entry(value: Any) -> Tuple[str, bytes]:
+    """
+    Serialize an entry. Returns its content hash and its bytes, compressed when they are large.
+    """
+    data = ormsgpack.packb(value, option=ormsgpack.OPT_NON_STR_KEYS)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    if len(data) >= CHECKPOINT_COMPRESS_BYTES:
+        return digest, b"".join(_compress(data))
+    return digest, _RAW + data
+
+
+def unpack_entry(data: bytes) -> Any:
+    return ormsgpack.unpackb(_decompress(data[:1], data[1:]))
+
+
+def split_entries(channel: str, value: Any) -> Optional[Tuple[dict, Dict[str, bytes]]]:
+    """
+    The refs that replace the value of an entry channel in a checkpoint, and its entries by hash. None when the value
+    is not made of sources or sections.
+    """
+    if channel == "sources" and _is_sources(value):
+        keys, items = list(value), value.values()
+    elif channel == "sections" and _is_sections(value):
+        keys, items = None, value
+    else:
+        return None
+    try:
+        packed = [pack_entry(item) for item in items]
+    except TypeError:  # not plain msgpack data, the value is checkpointed as is
+        return None
+    refs = {REFS_KEY: channel, "keys": keys, "refs": [digest for digest, _ in packed]}
+    return refs, dict(packed)
+
+
+def join_entries(refs: dict, entries: Dict[str, bytes]) -> Any:
+    """
+    Rebuild the value of an entry channel from its refs and the entries by hash.
+    """
+    entries = {**entries, **(refs.get("entries") or {})}
+    missing = [digest for digest in refs["refs"] if digest not in entries]
+    if missing:
+        raise KeyError(f"Checkpoint entries of {refs[REFS_KEY]} missing: {missing[:3]}")
+    values = [unpack_entry(entries[digest]) for digest in refs["refs"]]
+    return dict(zip(refs["keys"], values)) if refs["keys"] is not None else values
+
+
+class EntryCheckpointSaver(BaseCheckpointSaver):
+    """
+    Wraps a checkpointer so that sources and sections are checkpointed as content-addressed entries, stored by the
+    wrapped checkpointer in segment channels, and large channel values are compressed. Checkpoints written by the
+    wrapped checkpointer alone are read unchanged.
+
+    Entries are only written once by checkpointers that store channel values by (channel, version) and load the
+    versions a checkpoint lists, such as MemorySaver and PostgresSaver. Checkpointers that store the channel values
+    inline with each checkpoint are supported as well, they store the entries of every checkpoint with it.
+    """
+
+    def __init__(self, inner: BaseCheckpointSaver, tracked_threads: int = CHECKPOINT_TRACKED_THREADS):
+        super().__init__(serde=inner.serde)
+        self.inner = inner
+        self.tracked_threads = tracked_threads
+        # Segments are never modified, they are all written under the first version of the wrapped checkpointer's
+        # version type
+        version = inner.get_next_version(None, None)
+        self._segment_version = version if isinstance(version, (int, float)) else "1"
+        # Per thread and namespace: the segment of every entry written or read, and the last split value by channel
+        self._threads: "OrderedDict[tuple, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str):
+        return getattr(self.inner, name)
+
+    @property
+    def config_specs(self) -> list:
+        return self.inner.config_specs
+
+    def get_next_version(self, current, channel):
+        return self.inner.get_next_version(current, channel)
+
+    def _thread(self, config: RunnableConfig) -> dict:
+        configurable = config["configurable"]
+        key = (configurable["thread_id"], configurable.get("checkpoint_ns", ""))
+        with self._lock:
+            thread = self._threads.get(key)
+            if thread is None:
+                thread = self._threads[key] = {"segments": {}, "split": {}}
+                while len(self._threads) > self.tracked_threads:
+                    self._threads.popitem(last=False)
+            self._threads.move_to_end(key)
+        return thread
+
+    def _split(self, thread: dict, channel: str, value: Any) -> Optional[Tuple[dict, Dict[str, bytes]]]:
+        # A channel that did not change since it was last split holds the same object, it is not packed again
+        last = thread["split"].get(channel)
+        if last is not None and last[0] is value:
+            return last[1]
+        split = split_entries(channel, value)
+        thread["split"][channel] = (value, split)
+        return split
+
+    def _compress_value(self, value: Any) -> Any:
+        type_, data = self.serde.dumps_typed(value)
+        if len(data) < CHECKPOINT_COMPRESS_BYTES:
+            return value
+        kind, compressed = _compress(data)
+        return {COMPRESSED_KEY: type_, "kind": kind, "data": compressed}
+
+    def _decompress_value(self, value: Any) -> Any:
+        return self.serde.loads_typed((value[COMPRESSED_KEY], _decompress(value["kind"], value["data"])))
+
+    def _encode(self, config: RunnableConfig, checkpoint: Checkpoint,
+                new_versions: ChannelVersions) -> Tuple[Checkpoint, ChannelVersions, Dict[str, str]]:
+        """
+        The checkpoint to hand to the wrapped checkpointer with its new versions, and the segment of every entry it
+        writes.
+        """
+        thread = self._thread(config)
+        values = dict(checkpoint["channel_values"])
+        versions = dict(checkpoint["channel_versions"])
+        new_versions = dict(new_versions)
+        for channel in new_versions:
+            if channel not in ENTRY_CHANNELS and channel in values:
+                values[channel] = self._compress_value(values[channel])
+
+        listed, fresh = {}, {}
+        for channel in ENTRY_CHANNELS:
+            split = self._split(thread, channel, values.get(channel))
+            if split is None:
+                continue
+            refs, entries = split
+            values[channel] = refs
+            for digest, data in entries.items():
+                segment = thread["segments"].get(digest)
+                if segment is None:
+                    fresh[digest] = data
+                else:
+                    listed.setdefault(segment, {})[digest] = data
+        written = {}
+        if fresh:
+            segment = SEGMENT_PREFIX + hashlib.blake2b("".join(sorted(fresh)).encode(), digest_size=10).hexdigest()
+            listed[segment] = fresh
+            new_versions[segment] = self._segment_version
+            written = dict.fromkeys(fresh, segment)
+        # Every listed segment is in the values, with the entries the checkpoint references. A checkpointer that
+        # stores values by (channel, version) only writes the new one, a checkpointer that stores the values inline
+        # with each checkpoint stores them all.
+        for segment, entries in listed.items():
+            values[segment] = entries
+            versions[segment] = self._segment_version
+        return {**checkpoint, "channel_values": values, "channel_versions": versions}, new_versions, written
+
+    def _decode(self, saved: Optional[CheckpointTuple]) -> Optional[CheckpointTuple]:
+        """
+        The checkpoint of the wrapped checkpointer as the graph wrote it, without the segments.
+        """
+        if saved is None:
+            return None
+        checkpoint = saved.checkpoint
+        values, entries, segments = {}, {}, {}
+        for channel, value in checkpoint["channel_values"].items():
+            if channel.startswith(SEGMENT_PREFIX):
+                entries.update(value)
+                segments.update(dict.fromkeys(value, channel))
+            else:
+                values[channel] = value
+        if segments:
+            self._thread(saved.config)["segments"].update(segments)
+
+        def decode(value):
+            if isinstance(value, dict) and REFS_KEY in value:
+                return join_entries(value, entries)
+            if isinstance(value, dict) and COMPRESSED_KEY in value:
+                return self._decompress_value(value)
+            return value
+
+        values = {channel: decode(value) for channel, value in values.items()}
+        versions = {k: v for k, v in checkpoint["channel_versions"].items() if not k.startswith(SEGMENT_PREFIX)}
+        pending_writes = saved.pending_writes
+        if pending_writes:
+            pending_writes = [(task_id, channel, decode(value)) for task_id, channel, value in pending_writes]
+        return saved._replace(checkpoint={**checkpoint, "channel_values": values, "channel_versions": versions},
+                              pending_writes=pending_writes)
+
+    def _encode_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]]) -> list:
+        """
+        Writes of sources and sections as refs, with their entries.
+        """
+        thread = self._thread(config)
+        encoded = []
+        for channel, value in writes:
+            split = self._split(thread, channel, value) if channel in ENTRY_CHANNELS else None
+            if split is not None:
+                refs, entries = split
+                value = {**refs, "entries": dict(entries)}
+            elif isinstance(channel, str) and not channel.startswith("__"):
+                value = self._compress_value(value)
+            encoded.append((channel, value))
+        return encoded
+
+    def _written(self, config: RunnableConfig, written: Dict[str, str]) -> None:
+        self._thread(config)["segments"].update(written)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._decode(self.inner.get_tuple(config))
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._decode(await self.inner.aget_tuple(config))
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        for saved in self.inner.list(config, filter=filter, before=before, limit=limit):
+            yield self._decode(saved)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        async for saved in self.inner.alist(config, filter=filter, before=before, limit=limit):
+            yield self._decode(saved)
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        checkpoint, new_versions, written = self._encode(config, checkpoint, new_versions)
+        saved = self.inner.put(config, checkpoint, metadata, new_versions)
+        self._written(config, written)
+        return saved
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        checkpoint, new_versions, written = self._encode(config, checkpoint, new_versions)
+        saved = await self.inner.aput(config, checkpoint, metadata, new_versions)
+        self._written(config, written)
+        return saved
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        self.inner.put_writes(config, self._encode_writes(config, writes), task_id, task_path)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await self.inner.aput_writes(config, self._encode_writes(config, writes), task_id, task_path)
+
+    def _forget(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._threads if key[0] == thread_id]:
+                del self._threads[key]
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.inner.delete_thread(thread_id)
+        self._forget(thread_id)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await self.inner.adelete_thread(thread_id)
+        self._forget(thread_id)
+
+
+# Savers by the id of the checkpointer they wrap, a saver keeps its checkpointer (and so its id) alive
+_savers: "weakref.WeakValueDictionary[int, EntryCheckpointSaver]" = weakref.WeakValueDictionary()
+_savers_lock = threading.Lock()
+
+
+def wrap_checkpointer(checkpointer: BaseCheckpointSaver) -> EntryCheckpointSaver:
+    """
+    The EntryCheckpointSaver of a checkpointer. A checkpointer has one, shared by the copies of the graph that use it,
+    so that the entries it wrote are known to all of them.
+    """
+    if isinstance(checkpointer, EntryCheckpointSaver):
+        return checkpointer
+    with _savers_lock:
+        saver = _savers.get(id(checkpointer))
+        if saver is None:
+            saver = _savers[id(checkpointer)] = EntryCheckpointSaver(checkpointer)
+        return saver
+
+
+class ResearchGraph(CompiledStateGraph):
+    """
+    Compiled graph that wraps every checkpointer assigned to it in an EntryCheckpointSaver, the one it is compiled
+    with as well as the one the LangGraph server sets on a copy of the served graph.
+    """
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name == "checkpointer" and isinstance(value, BaseCheckpointSaver):
+            value = wrap_checkpointer(value)
+        super().__setattr__(name, value)
@@ -0,0 +1,125 @@
+import os
+import threading
+from typing import Dict, Optional
+
+import httpx
+
+from llm_cache import CachedChatModel, get_llm_cache
+from telemetry import LLMTelemetryHandler, TracedTavilyClient
+
+# Description: Process wide registry of network clients. Clients are created lazily on first use and reused by every
+# tool and node, so importing the graph does no client construction and tool calls share warm connection pools
+# (no new TLS handshake per call). Pool sizes and keep-alive are configurable through the environment.
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+
+_lock = threading.Lock()
+_http_clients: Dict[tuple, object] = {}
+_llms: Dict[tuple, object] = {}
+_tavily_client = None
+_llm_factory = None
+_llm_telemetry = LLMTelemetryHandler()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client(endpoint: Optional[str] = None, is_async: bool = True):
+    """
+    Return the pooled httpx client of an endpoint. Clients are shared by every model served from the same endpoint.
+    """
+    key = (endpoint, is_async)
+    with _lock:
+        client = _http_clients.get(key)
+        if client is None:
+            client_cls = httpx.AsyncClient if is_async else httpx.Client
+            client = _http_clients[key] = client_cls(limits=_limits(), timeout=HTTP_TIMEOUT)
+        return client
+
+
+def get_llm(model: str = "gpt-4o-mini", **kwargs):
+    """
+    Return the shared chat model for a model name and set of parameters, creating it on first use. Unless
+    LLM_CACHE_MODE is off, the model is wrapped in the LLM cache.
+    """
+    endpoint = kwargs.get("base_url") or os.getenv("OPENAI_BASE_URL")
+    key = (model, repr(sorted(kwargs.items())))
+    with _lock:
+        llm = _llms.get(key)
+    if llm is not None:
+        return llm
+
+    if _llm_factory is not None:
+        llm = _llm_factory(model, **kwargs)
+    else:
+        from langchain_openai import ChatOpenAI
+
+        llm = ChatOpenAI(
+            model=model,
+            http_async_client=get_http_client(endpoint),
+            http_client=get_http_client(endpoint, is_async=False),
+            **{"stream_usage": True, **kwargs},  # report token usage of streamed calls as well
+        )
+    llm.callbacks = [*(llm.callbacks or []), _llm_telemetry]
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        llm = CachedChatModel(llm, {"model": model, **kwargs}, llm_cache)
+    with _lock:
+        return _llms.setdefault(key, llm)
+
+
+def get_tavily_client():
+    """
+    Return the shared Tavily client, creating it on first use.
+    """
+    global _tavily_client
+    if _tavily_client is None:
+        from tavily import AsyncTavilyClient
+
+        try:
+            client = AsyncTavilyClient(client=httpx.AsyncClient(limits=_limits(), timeout=HTTP_TIMEOUT))
+        except TypeError:  # older tavily-python releases do not accept an external httpx client
+            client = AsyncTavilyClient()
+        with _lock:
+            if _tavily_client is None:
+                _tavily_client = TracedTavilyClient(client)
+    return _tavily_client
+
+
+def set_llm_factory(factory) -> None:
+    """
+    Create chat models with factory(model, **kwargs) instead of ChatOpenAI, e.g. fake models in benchmarks.
+    """
+    global _llm_factory
+    with _lock:
+        _llm_factory = factory
+        _llms.clear()
+
+
+def register_tavily_client(client) -> None:
+    """
+    Register the Tavily client instance to use, e.g. a fake client in benchmarks.
+    """
+    global _tavily_client
+    with _lock:
+        _tavily_client = TracedTavilyClient(client)
+
+
+def reset() -> None:
+    """
+    Forget every registered client, the next call to a getter creates a new one.
+    """
+    global _tavily_client, _llm_factory
+    with _lock:
+        _http_clients.clear()
+        _llms.clear()
+        _tavily_client = None
+        _llm_factory = None
@@ -1,11 +1,13 @@
-from langchain_openai import ChatOpenAI
+import os
 
 # Description: Configuration file
 class Config:
     def __init__(self):
         """
-        Initializes the configuration for the agent
+        Initializes the configuration for the agent. Models are not configured here, they are picked per task by the
+        model router (router.py).
         """
-        self.BASE_LLM = ChatOpenAI(model="gpt-4", temperature=0.2)
-        self.FACTUAL_LLM = ChatOpenAI(model="gpt-4o-mini", temperature=0.0)
-        self.DEBUG = False
\ No newline at end of file
+        self.DEBUG = False
+        self.SYSTEM_PROMPT_TOKEN_BUDGET = int(os.getenv("SYSTEM_PROMPT_TOKEN_BUDGET", "6000"))
+        self.HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+        self.HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "2"))
@@ -0,0 +1,165 @@
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from retrieval import tokenize
+from urls import canonicalize_url
+
+# Description: Collapses duplicate sources before they are merged into state["sources"]. Sources are duplicates when
+# their canonical URLs match (tracking parameters, http/https, www/m./AMP variants) or when their content is nearly
+# identical (syndicated copies of one article), detected with 64 bit SimHash signatures. Duplicates are folded into
+# the first source seen, which lists their URLs under "alternate_urls".
+
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", "3"))  # max differing bits out of 64
+SHINGLE_WORDS = 3
+MIN_SIMHASH_WORDS = 30  # shorter texts are too small for a meaningful signature
+
+SIMHASH_KEY = "simhash"
+ALTERNATE_URLS_KEY = "alternate_urls"
+
+# Set bits of every byte value, for numpy < 2 which has no bitwise_count
+_POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    """
+    Number of set bits of each uint64 value.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def simhash(text: str) -> Optional[int]:
+    """
+    64 bit SimHash of the word shingles of a text, or None when the text is too short.
+    """
+    words = tokenize(text or "")
+    if len(words) < MIN_SIMHASH_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(-1, 64)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return int(np.packbits(votes > 0).view(">u8")[0])
+
+
+class SimHashIndex:
+    """
+    Array backed index of SimHash signatures, searched by Hamming distance.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self._signatures = np.zeros(capacity, dtype=np.uint64)
+        self.keys: List[str] = []
+
+    def add(self, key: str, signature: int) -> None:
+        if len(self.keys) == len(self._signatures):
+            self._signatures = np.concatenate([self._signatures, np.zeros(len(self._signatures), dtype=np.uint64)])
+        self._signatures[len(self.keys)] = signature
+        self.keys.append(key)
+
+    def find(self, signature: int, max_distance: int = NEAR_DUPLICATE_DISTANCE) -> Optional[str]:
+        """
+        Key of the closest signature within max_distance bits, or None.
+        """
+        if not self.keys:
+            return None
+        distances = _popcount(self._signatures[:len(self.keys)] ^ np.uint64(signature))
+        best = int(np.argmin(distances))
+        return self.keys[best] if distances[best] <= max_distance else None
+
+
+def _signature(source: dict) -> Optional[int]:
+    """
+    The signature of a source: the stored one, computed from its content when it has none.
+    """
+    if SIMHASH_KEY in source:
+        return None if source[SIMHASH_KEY] is None else int(source[SIMHASH_KEY], 16)
+    return simhash(source.get("content", ""))
+
+
+def _with_signature(source: dict, signature: Optional[int]) -> dict:
+    """
+    A copy of a source that stores its signature, the source itself is left untouched.
+    """
+    if SIMHASH_KEY in source:
+        return source
+    return {**source, SIMHASH_KEY: None if signature is None else f"{signature:016x}"}
+
+
+class SourceDeduper:
+    """
+    Finds the source already in state that a new source duplicates, and folds duplicates into it. The sources mapping
+    is updated in place and must be owned by the caller, the source dicts in it are never modified: a source that gets
+    its signature or an alternate URL is replaced by a copy.
+    """
+
+    def __init__(self, sources: Dict[str, dict]):
+        self.sources = sources
+        self._canonical: Dict[str, str] = {}
+        self._index = SimHashIndex(max(64, len(sources)))
+        for url, source in list(sources.items()):
+            self._register(url, source)
+
+    def _register(self, url: str, source: dict) -> None:
+        for alias in (url, *source.get(ALTERNATE_URLS_KEY, [])):
+            self._canonical.setdefault(canonicalize_url(alias), url)
+        signature = _signature(source)
+        self.sources[url] = _with_signature(source, signature)
+        if signature is not None:
+            self._index.add(url, signature)
+
+    def find(self, url: str, source: Optional[dict] = None) -> Optional[str]:
+        """
+        Key of the source in state that url (with the given content) duplicates, or None.
+        """
+        if url in self.sources:
+            return url
+        match = self._canonical.get(canonicalize_url(url))
+        if match is None and source is not None:
+            signature = _signature(source)
+            if signature is not None:
+                match = self._index.find(signature)
+        return match
+
+    def add(self, url: str, source: dict) -> Optional[str]:
+        """
+        Merge a new source into the sources. Returns the key it was stored under, or None when it duplicates a source
+        already in state, in which case its URL is recorded as an alternate URL of that source.
+        """
+        source = _with_signature(source, _signature(source))
+        match = self.find(url, source)
+        if match is None:
+            self._register(url, source)
+            return url
+        if match != url:
+            self.alias(match, url)
+        return None
+
+    def alias(self, key: str, url: str) -> None:
+        """
+        Record url as an alternate URL of the source stored under key. The source is replaced rather than modified, it
+        may be shared with the graph state.
+        """
+        source = self.sources[key]
+        alternates = source.get(ALTERNATE_URLS_KEY, [])
+        if url != key and url not in alternates:
+            self.sources[key] = {**source, ALTERNATE_URLS_KEY: [*alternates, url]}
+        self._canonical.setdefault(canonicalize_url(url), key)
+
+    def update_signature(self, key: str, signature: Optional[int]) -> Optional[str]:
+        """
+        Replace the signature of a source by the one of its extracted page. Returns the key of another source whose
+        page is a near duplicate, or None.
+        """
+        if signature is None:
+            return None
+        match = self._index.find(signature)
+        self.sources[key] = {**self.sources[key], SIMHASH_KEY: f"{signature:016x}"}
+        if match is None or match == key:
+            self._index.add(key, signature)
+            return None
+        return match
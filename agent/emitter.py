@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from copilotkit.langchain import copilotkit_emit_state
+from langchain_core.runnables import RunnableConfig, ensure_config
+
+from blob_store import REF_KEY, resolve_raw_content
+from dedup import ALTERNATE_URLS_KEY, SIMHASH_KEY
+from extraction import STATS_KEY
+from report_digest import content_hash
+from sections import HASH_KEY, VERSION_KEY
+from telemetry import add_attribute, is_enabled
+
+# Description: Deduplicated and coalesced replacement for calling copilotkit_emit_state on every log tick.
+# Emissions are compared with the last emitted snapshot of the session and skipped when nothing changed, bursts
+# within EMIT_WINDOW_SECONDS are coalesced into a single trailing emission, and raw_content is kept off the wire
+# unless the frontend sets the emit_raw_content state key.
+#
+# This is not delta emission: CopilotKit replaces the frontend state with every emitted snapshot, so every emission
+# that is sent is a full (but slimmed) state. The per-key fingerprints only decide whether anything is sent at all.
+
+EMIT_WINDOW_SECONDS = float(os.getenv("EMIT_WINDOW_SECONDS", "0.1"))
+MAX_TRACKED_SESSIONS = 1024
+
+# Keys that are never emitted as intermediate state, CopilotKit syncs messages at the end of the run itself
+SKIPPED_KEYS = frozenset({"messages"})
+
+
+def _fingerprint(key: str, value: Any) -> str:
+    """
+    Cheap fingerprint of a state value. Sources are fingerprinted by url and content length, and sections by their
+    content hash and version, instead of serializing their (potentially large) content.
+    """
+    if key == "sources" and isinstance(value, dict):
+        parts = [
+            (url, len(source), len(source.get("content") or ""), len(source.get("raw_content") or ""),
+             (source.get(REF_KEY) or {}).get("hash"), source.get("title"), len(source.get(ALTERNATE_URLS_KEY) or ()))
+            for url, source in value.items() if isinstance(source, dict)
+        ]
+        payload = repr(parts)
+    elif key == "sections" and isinstance(value, list):
+        # Sections carry their content hash and version, the text does not need to be serialized
+        payload = repr([(sec.get("idx"), sec.get(VERSION_KEY), sec.get(HASH_KEY) or content_hash(sec), sec.get("id"))
+                        for sec in value if isinstance(sec, dict)])
+    else:
+        payload = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def slim_sources(sources: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Return the sources without their raw_content, which the frontend does not render, their dedup signature and their
+    extraction statistics.
+    """
+    return {
+        url: {k: v for k, v in source.items() if k not in ("raw_content", SIMHASH_KEY, STATS_KEY)} if isinstance(source, dict) else source
+        for url, source in sources.items()
+    }
+
+
+def with_raw_content(sources: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Return the sources with their raw_content resolved from the blob store.
+    """
+    return {
+        url: {**source, "raw_content": resolve_raw_content(source)} if isinstance(source, dict) and source.get(REF_KEY) else source
+        for url, source in sources.items()
+    }
+
+
+def wire_state(state: dict) -> dict:
+    """
+    Build the payload that is sent to the frontend for a state.
+    """
+    payload = {k: v for k, v in state.items() if k not in SKIPPED_KEYS}
+    if isinstance(payload.get("sources"), dict):
+        if state.get("emit_raw_content"):
+            payload["sources"] = with_raw_content(payload["sources"])
+        else:
+            payload["sources"] = slim_sources(payload["sources"])
+    if isinstance(payload.get("sections"), list):
+        # The hash and version are change tracking of the agent, the frontend keeps its section format
+        payload["sections"] = [{k: v for k, v in sec.items() if k not in (HASH_KEY, VERSION_KEY)} if isinstance(sec, dict) else sec
+                               for sec in payload["sections"]]
+    return payload
+
+
+class StateEmitter:
+    """
+    Per-session emitter that keeps the fingerprints of the last emitted snapshot, to skip emissions of an unchanged
+    state, and coalesces bursts of emissions.
+    """
+
+    def __init__(self, window: float = EMIT_WINDOW_SECONDS):
+        self.window = window
+        self.last_fingerprints: Dict[str, str] = {}
+        self.last_changed_keys: List[str] = []
+        self.last_emit_at = 0.0
+        self.skipped = 0
+        self._pending_state: Optional[dict] = None
+        self._pending_task: Optional[asyncio.Task] = None
+
+    def diff(self, state: dict) -> Dict[str, str]:
+        """
+        Return the fingerprints of the keys that changed since the last emitted snapshot.
+        """
+        changed = {}
+        for key, value in state.items():
+            if key in SKIPPED_KEYS:
+                continue
+            fingerprint = _fingerprint(key, value)
+            if self.last_fingerprints.get(key) != fingerprint:
+                changed[key] = fingerprint
+        return changed
+
+    async def emit(self, config: RunnableConfig, state: dict, force: bool = False):
+        """
+        Emit the state if it changed. Emissions closer than the coalescing window to the previous one are deferred and
+        merged into a single trailing emission of the latest state. force emits immediately and drops pending ones.
+        """
+        if force:
+            self._cancel_pending()
+            await self._send(config, state)
+            return
+
+        elapsed = time.monotonic() - self.last_emit_at
+        if elapsed >= self.window and self._pending_task is None:
+            await self._send(config, state)
+            return
+
+        # Within the window, remember the latest state and emit it once the window is over
+        self._pending_state = state
+        if self._pending_task is None:
+            self._pending_task = asyncio.create_task(self._flush_later(config, max(self.window - elapsed, 0)))
+
+    async def flush(self, config: RunnableConfig):
+        """
+        Emit the pending state, if any, right away.
+        """
+        state = self._pending_state
+        self._cancel_pending()
+        if state is not None:
+            await self._send(config, state)
+
+    def _cancel_pending(self):
+        if self._pending_task is not None and self._pending_task is not asyncio.current_task():
+            self._pending_task.cancel()
+        self._pending_task = None
+        self._pending_state = None
+
+    async def _flush_later(self, config: RunnableConfig, delay: float):
+        await asyncio.sleep(delay)
+        state = self._pending_state
+        self._pending_task = None
+        self._pending_state = None
+        if state is not None:
+            await self._send(config, state)
+
+    async def _send(self, config: RunnableConfig, state: dict):
+        changed = self.diff(state)
+        self.last_emit_at = time.monotonic()
+        if not changed:
+            self.skipped += 1
+            return
+        self.last_fingerprints.update(changed)
+        self.last_changed_keys = list(changed)
+        payload = wire_state(state)
+        if is_enabled():
+            add_attribute("emitted_bytes", len(json.dumps(payload, default=str)))
+        await copilotkit_emit_state(config, payload)
+
+
+_emitters: "OrderedDict[str, StateEmitter]" = OrderedDict()
+_detached: ContextVar[bool] = ContextVar("emitter_detached", default=False)
+
+
+@contextmanager
+def detached():
+    """
+    Drop every emission made in the enclosed block, for work that runs outside of a graph run (e.g. speculative
+    drafts written while the graph is interrupted) and has no frontend to emit to.
+    """
+    token = _detached.set(True)
+    try:
+        yield
+    finally:
+        _detached.reset(token)
+
+
+def get_emitter(config: Optional[RunnableConfig] = None) -> StateEmitter:
+    """
+    Return the emitter of the current session, identified by the thread id of the running graph.
+    """
+    configurable = ensure_config(config).get("configurable", {})
+    session = str(configurable.get("thread_id", "default"))
+    emitter = _emitters.get(session)
+    if emitter is None:
+        emitter = _emitters[session] = StateEmitter()
+        while len(_emitters) > MAX_TRACKED_SESSIONS:
+            _emitters.popitem(last=False)
+    _emitters.move_to_end(session)
+    return emitter
+
+
+async def emit_state(config: RunnableConfig, state: dict, force: bool = False):
+    """
+    Drop-in replacement for copilotkit_emit_state that skips unchanged states, coalesces bursts and slims the
+    emitted state.
+    """
+    if _detached.get():
+        return False
+    await get_emitter(config).emit(config, state, force=force)
+    return True
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from tokens import count_tokens, truncate_to_tokens
+
+# Description: Post-processing of extracted pages before they are stored. Tavily returns whole pages, with navigation,
+# cookie banners, share buttons and footers around the article, and every prompt and emission downstream used to pay
+# for that text. clean_page strips the boilerplate, normalizes whitespace, splits the text into paragraph chunks with
+# their token counts and caps the page to EXTRACT_SOURCE_TOKENS. It is CPU bound and runs in a worker pool, the pages of
+# an extract batch concurrently, so the event loop stays free.
+#
+# The cleaned text is the chunks joined by blank lines, the chunk boundaries are recovered with split_chunks.
+
+EXTRACT_SOURCE_TOKENS = int(os.getenv("EXTRACT_SOURCE_TOKENS", "6000"))  # cap of the cleaned text of a page
+EXTRACT_CHUNK_TOKENS = int(os.getenv("EXTRACT_CHUNK_TOKENS", "400"))  # longer paragraphs are split on sentences
+EXTRACT_POOL = os.getenv("EXTRACT_POOL", "process")  # "process", "thread" or "inline"
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+MIN_TRUNCATED_TOKENS = 32  # a truncated chunk shorter than this is dropped instead
+
+STATS_KEY = "extract_stats"
+
+logger = logging.getLogger(__name__)
+
+_BOILERPLATE_RE = re.compile(
+    r"cookie (policy|settings|preferences|consent)|(we|this site) uses? cookies|accept (all|cookies)|"
+    r"privacy policy|terms of (use|service)|all rights reserved|^\W*(sign in|log in|sign up|register|subscribe)\b|"
+    r"(subscribe to|sign up for) (our|the) newsletter|skip to (main )?content|share (on|this|via)|follow us|^\W*advertisement\W*$|"
+    r"^\W*(related|recommended) (articles|stories|posts)|^\W*read more\W*$|^\W*back to top\W*$",
+    re.IGNORECASE,
+)
+_LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)|https?://\S+")
+_IMAGE_RE = re.compile(r"^\s*!\[[^\]]*\]\([^)]*\)\s*$")
+_INVISIBLE_RE = re.compile("[\u200b-\u200f\u2060\ufeff]")
+_SPACES_RE = re.compile(r"[ \t\f\v]+")
+_CONTENT_LINE_RE = re.compile(r"^(#|[-*+] |\d+[.)] |\|)")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+BOILERPLATE_LINE_CHARS = 160  # only lines shorter than this are matched against the boilerplate patterns
+REPEATED_LINE_CHARS = 80  # short lines repeated REPEATED_LINE_COUNT times in a page are menus or footers
+REPEATED_LINE_COUNT = 3
+MENU_RUN_LINES = 3  # runs of this many short lines without punctuation are navigation
+
+
+def normalize_whitespace(text: str) -> str:
+    """
+    Normalize unicode and whitespace: invisible characters are removed, runs of spaces are collapsed, lines are
+    stripped and runs of blank lines are collapsed into one blank line.
+    """
+    text = unicodedata.normalize("NFKC", text or "").replace("\r\n", "\n").replace("\r", "\n")
+    text = _INVISIBLE_RE.sub("", text)
+    lines = [_SPACES_RE.sub(" ", line).strip() for line in text.split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _is_menu_line(line: str) -> bool:
+    # Headings, list items and table rows are content
+    return 0 < len(line.split()) <= 3 and not _CONTENT_LINE_RE.match(line) and line[-1] not in ".!?:;\""
+
+
+def _is_link_line(line: str) -> bool:
+    """
+    A line made of links, with at most a couple of words outside of them.
+    """
+    if not _LINK_RE.search(line):
+        return False
+    text = _LINK_RE.sub("", line)
+    return len(re.findall(r"\w+", text)) <= 2
+
+
+def strip_boilerplate(text: str) -> Tuple[str, int]:
+    """
+    Remove boilerplate lines from normalized text. Returns the text and the number of lines removed.
+    """
+    lines = text.split("\n")
+    counts = Counter(line for line in lines if line and len(line) < REPEATED_LINE_CHARS)
+    drop = [
+        bool(line) and (
+            _IMAGE_RE.match(line) is not None
+            or _is_link_line(line)
+            or counts[line] >= REPEATED_LINE_COUNT
+            or (len(line) < BOILERPLATE_LINE_CHARS and _BOILERPLATE_RE.search(line) is not None)
+        )
+        for line in lines
+    ]
+    # Navigation: runs of short lines without punctuation, e.g. the entries of a menu
+    run: List[int] = []
+    for i, line in enumerate(lines + ["."]):
+        if i < len(lines) and _is_menu_line(line):
+            run.append(i)
+        elif line and (i == len(lines) or not drop[i]):  # blank and dropped lines do not end a run
+            if len(run) >= MENU_RUN_LINES:
+                for j in run:
+                    drop[j] = True
+            run = []
+
+    kept = [line for line, dropped in zip(lines, drop) if not dropped]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip(), sum(1 for line, dropped in zip(lines, drop) if dropped and line)
+
+
+def _split_paragraph(paragraph: str, max_tokens: int) -> List[str]:
+    """
+    Split a paragraph longer than max_tokens on sentence boundaries, and sentences longer than max_tokens on words.
+    """
+    pieces, current = [], ""
+    for sentence in _SENTENCE_RE.split(paragraph):
+        candidate = f"{current} {sentence}".strip()
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            candidate = sentence
+        while count_tokens(candidate) > max_tokens:
+            head = truncate_to_tokens(candidate, max_tokens)
+            head = head.rsplit(" ", 1)[0] if " " in head.strip() else head
+            pieces.append(head.strip())
+            candidate = candidate[len(head):].strip()
+        current = candidate
+    if current:
+        pieces.append(current)
+    return [piece for piece in pieces if piece]
+
+
+def split_chunks(content: str) -> List[str]:
+    """
+    The chunks of a cleaned page.
+    """
+    return [chunk for chunk in (content or "").split("\n\n") if chunk.strip()]
+
+
+def clean_page(raw_content: str, max_tokens: int = EXTRACT_SOURCE_TOKENS,
+               chunk_tokens: int = EXTRACT_CHUNK_TOKENS) -> Tuple[str, dict]:
+    """
+    Clean an extracted page: strip boilerplate, normalize whitespace, split it into paragraph chunks of at most
+    chunk_tokens and keep chunks up to max_tokens. Returns the cleaned text and its size statistics.
+    """
+    text, dropped_lines = strip_boilerplate(normalize_whitespace(raw_content))
+    chunks, sizes, used, truncated = [], [], 0, False
+    for paragraph in split_chunks(text):
+        tokens = count_tokens(paragraph)
+        pieces = [(paragraph, tokens)] if tokens <= chunk_tokens else \
+            [(piece, count_tokens(piece)) for piece in _split_paragraph(paragraph, chunk_tokens)]
+        for piece, piece_tokens in pieces:
+            if used + piece_tokens > max_tokens:
+                truncated = True
+                if max_tokens - used >= MIN_TRUNCATED_TOKENS:
+                    piece = truncate_to_tokens(piece, max_tokens - used).strip()
+                    chunks.append(piece)
+                    sizes.append(count_tokens(piece))
+                break
+            chunks.append(piece)
+            sizes.append(piece_tokens)
+            used += piece_tokens
+        if truncated:
+            break
+
+    content = "\n\n".join(chunks)
+    return content, {
+        "raw_chars": len(raw_content or ""),
+        "chars": len(content),
+        "tokens": sum(sizes),
+        "chunks": len(chunks),
+        "chunk_tokens": sizes,
+        "dropped_lines": dropped_lines,
+        "truncated": truncated,
+    }
+
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> Optional[Executor]:
+    """
+    The worker pool of the cleaning stage, created on first use. None when pages are cleaned inline.
+    """
+    global _executor
+    if EXTRACT_POOL == "inline":
+        return None
+    with _executor_lock:
+        if _executor is None:
+            if EXTRACT_POOL == "process":
+                # spawn rather than fork, the server process runs threads and an event loop
+                _executor = ProcessPoolExecutor(EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+                # Shut the pool down before multiprocessing joins the children of the process at exit, which would
+                # otherwise wait forever on the idle workers when this process is itself a worker (batch runs). It runs
+                # before the finalizers of the pool's queues (priority 10), which stop the threads feeding the workers.
+                multiprocessing.util.Finalize(None, _executor.shutdown, exitpriority=100)
+            else:
+                _executor = ThreadPoolExecutor(EXTRACT_WORKERS, thread_name_prefix="extract")
+        return _executor
+
+
+def _use_threads(error: Exception) -> None:
+    global _executor
+    logger.warning("Extraction process pool unavailable, cleaning pages in threads: %s", error)
+    with _executor_lock:
+        _executor = ThreadPoolExecutor(EXTRACT_WORKERS, thread_name_prefix="extract")
+
+
+async def clean_pages(pages: List[str]) -> List[Tuple[str, dict]]:
+    """
+    Clean the pages of an extract batch concurrently in the worker pool.
+    """
+    executor = _get_executor()
+    if executor is None:
+        return [clean_page(page) for page in pages]
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.gather(*(loop.run_in_executor(executor, clean_page, page) for page in pages))
+    except (OSError, RuntimeError) as e:  # BrokenProcessPool is a RuntimeError, e.g. no process support
+        if isinstance(executor, ThreadPoolExecutor):
+            raise
+        _use_threads(e)
+        return await clean_pages(pages)
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import logging
 from datetime import datetime
 from typing import Literal, cast
 from dotenv import load_dotenv
@@ -7,19 +9,36 @@ from langchain_core.messages import AIMessage, SystemMessage, HumanMessage, Tool
 from langgraph.graph import StateGraph
 from langgraph.types import Command, interrupt
 from langchain_core.runnables import RunnableConfig
-from copilotkit.langchain import copilotkit_emit_state, copilotkit_customize_config
+from copilotkit.langchain import copilotkit_customize_config
+from emitter import emit_state
 from langchain_core.tools import tool
 
 from state import ResearchState
+from tool_state import ToolState
 from config import Config
+from report_digest import sync_digest, find_editing_section, format_digest
+from tokens import count_tokens, truncate_to_tokens
+from history import compact_history, message_tokens
+from router import model_router
+from telemetry import span, traced
+from speculation import speculator
+from dedup import SourceDeduper
+from checkpoint_entries import ResearchGraph
+from state_budget import apply_budget
 from tools.tavily_search import tavily_search
+from tools.knowledge_search import knowledge_search
 from tools.tavily_extract import tavily_extract
 from tools.outline_writer import outline_writer
-from tools.section_writer import section_writer
+from tools.section_writer import section_writer, merge_sections
+from tools.approved_sections_writer import approved_sections_writer
 
 load_dotenv('.env')
 
 cfg = Config()
+logger = logging.getLogger(__name__)
+
+# State keys a tool can change, other keys it sets (e.g. section_stream.*) are only emitted
+STATE_KEYS = frozenset(ResearchState.__annotations__) - {"messages"}
 
 @tool
 def review_proposal(proposal: str) -> str:
@@ -29,21 +48,22 @@ def review_proposal(proposal: str) -> str:
     pass
 
 class ResearchAgent:
-    def __init__(self):
+    def __init__(self, checkpointer=None):
         """
-        Initialize the ResearchAgent.
+        Initialize the ResearchAgent. A checkpointer is only needed when the graph is run outside of the LangGraph
+        server, which provides its own.
         """
         self._initialize_tools()
-        self._build_workflow()
+        self._build_workflow(checkpointer)
 
     def _initialize_tools(self):
         """
         Initialize the available tools and create a name-to-tool mapping.
         """
-        self.tools = [tavily_search, tavily_extract, outline_writer, section_writer, review_proposal]
+        self.tools = [knowledge_search, tavily_search, tavily_extract, outline_writer, section_writer, approved_sections_writer, review_proposal]
         self.tools_by_name = {tool.name: tool for tool in self.tools} # for easy lookup
 
-    def _build_workflow(self):
+    def _build_workflow(self, checkpointer=None):
         """
         Build the workflow graph with nodes and edges.
         """
@@ -57,10 +77,11 @@ class ResearchAgent:
         # Define graph structure
         workflow.set_entry_point("call_model_node")
         workflow.set_finish_point("call_model_node")
-        workflow.add_edge("tool_node", "call_model_node")
         workflow.add_edge("process_feedback_node", "call_model_node")
 
-        self.graph = workflow.compile()
+        # Sources and sections are checkpointed as content-addressed entries, so unchanged ones are not stored again.
+        # This applies to the checkpointer given here and to the one the LangGraph server gives the served graph.
+        self.graph = ResearchGraph(**workflow.compile(checkpointer=checkpointer).__dict__)
 
     def _build_system_prompt(self, state: ResearchState) -> str:
         """
@@ -76,11 +97,12 @@ class ResearchAgent:
             f"Today's date is {datetime.now().strftime('%d/%m/%Y')}.",
             "You are an expert research assistant, dedicated to helping users create comprehensive, well-sourced research reports. Your primary goal is to assist the user in producing a polished, professional report tailored to their needs.\n\n"
             "When writing a report use the following research tools:\n"
-            "1. Use the tavily_search tool to start the research and gather additional information from credible online sources when needed.\n"
+            "1. Use the tavily_search tool to start the research and gather additional information from credible online sources when needed. When the topic may have been researched before, first use the knowledge_search tool to find sources from earlier research sessions.\n"
             "2. Use the tavily_extract tool to extract additional content from relevant URLs.\n"
             "3. Use the outline_writer tool to analyze the gathered information and organize it into a clear, logical **outline proposal**. Break the content into meaningful sections that will guide the report structure. You must use the outline_writer EVERY time you need to write an outline for the report\n"
             "4. Use the review_proposal tool to review the outline proposal and get feedback from the user.\n"
-            f"5. After the review_proposal tool is called if any sections are approved, use the section_writer tool to write ONLY the sections of the report based on the **Approved Outline**{':' + str([outline[section]['title'] for section in outline]) if outline else ''} generated from the review_proposal tool. Ensure the report is well-written, properly sourced, and easy to understand. Avoid responding with the text of the report directly, always use the section_writer tool for the final product.\n\n"
+            f"5. After the review_proposal tool is called if any sections are approved, use the section_writer tool to write ONLY the sections of the report based on the **Approved Outline**{':' + str([outline[section]['title'] for section in outline]) if outline else ''} generated from the review_proposal tool. Ensure the report is well-written, properly sourced, and easy to understand. Avoid responding with the text of the report directly, always use the section_writer tool for the final product.\n"
+            "6. When the approved outline has several sections that are not written yet, use the approved_sections_writer tool to write all of them at once instead of calling the section_writer tool for each section. Use the section_writer tool to write or edit a single section.\n\n"
             "After using the section_writer tool, actively engage with the user to discuss next steps. **Do not summarize your completed work**, as the user has full access to the research progress.\n"
             "Instead of sharing details like generated outlines or reports, simply confirm the task is ready and ask for feedback or next steps. For example:\n"
             "'I have completed [..MAX additional 5 words]. Would you like me to [..MAX additional 5 words]?'\n\n"
@@ -100,23 +122,50 @@ class ResearchAgent:
 
         # If the outline is present, we add it to the prompt
         if outline:
+            outline_text = "\n".join(
+                f"{idx}. {section['title']}: {section.get('description', '')}"
+                for idx, section in enumerate(outline.values())
+            )
             prompt_parts.append(
                 f"### Current State of the Report\n"
-                f"\n**Approved Outline**:\n{outline}\n\n"
+                f"\n**Approved Outline**:\n{outline_text}\n\n"
             )
 
-        # If the sections are present, we add them to the prompt
+        # Instead of the full text of every section, we add a compact digest of the report. The full text is only
+        # added for the section the user is currently asking about.
+        editing_section = None
         if sections:
-            report_content = "\n".join(
-                f"section {section['idx']} : {section['title']}\n"
-                f"content : {section['content']}"
-                f"footer : {section['footer']}\n"
-                for section in sections
+            digest = sync_digest(state)
+            request = next((msg.content for msg in reversed(state.get("messages", []))
+                            if isinstance(msg, HumanMessage) and isinstance(msg.content, str)), "")
+            editing_section = find_editing_section(sections, request)
+            prompt_parts.append(f"**Report**:\n\n{format_digest(digest)}")
+
+        prompt = "\n".join(prompt_parts)
+        budget = cfg.SYSTEM_PROMPT_TOKEN_BUDGET
+        if count_tokens(prompt) > budget and sections:
+            # Over budget, drop the summaries and keep only titles, hashes and lengths
+            prompt_parts[-1] = f"**Report**:\n\n{format_digest(state['digest'], include_summaries=False)}"
+            prompt = "\n".join(prompt_parts)
+
+        if editing_section:
+            section_text = (
+                f"\n\n**Section the user is working on**:\n"
+                f"section {editing_section['idx']} : {editing_section['title']}\n"
+                f"content : {editing_section['content']}\n"
+                f"footer : {editing_section.get('footer', '')}\n"
             )
-            prompt_parts.append(f"**Report**:\n\n{report_content}")
+            prompt += truncate_to_tokens(section_text, budget - count_tokens(prompt))
+
+        prompt_tokens = count_tokens(prompt)
+        if prompt_tokens > budget:
+            logger.warning("System prompt is %d tokens, over the budget of %d tokens", prompt_tokens, budget)
+        else:
+            logger.info("System prompt is %d tokens (budget %d tokens)", prompt_tokens, budget)
 
-        return "\n".join(prompt_parts)
+        return prompt
 
+    @traced("call_model_node", "node")
     async def call_model_node(self, state: ResearchState, config: RunnableConfig) -> Command[Literal["tool_node", "__end__"]]:
         """
         Node for calling the model and handling the system prompt, messages, state, and tool bindings.
@@ -127,21 +176,33 @@ class ResearchAgent:
             last_message = HumanMessage(content=last_message.content)
             state['messages'][-1] = last_message
         
-        # Call LLM
-        model = cfg.FACTUAL_LLM.bind_tools(self.tools, parallel_tool_calls=False)
-        response = await model.ainvoke([
-            SystemMessage(content=self._build_system_prompt(state)),
-            *state["messages"],
-        ], config)
+        # Keep the history within its token budget, older tool outputs are compacted and old turns summarized
+        history, history_summary = compact_history(state["messages"], state.get("history_summary"),
+                                                   cfg.HISTORY_TOKEN_BUDGET, cfg.HISTORY_RECENT_TURNS)
+
+        # Call LLM, the model is picked by the router for the agent task
+        system_prompt = self._build_system_prompt(state)
+
+        async def call(llm):
+            model = llm.bind_tools(self.tools, parallel_tool_calls=False)
+            return await model.ainvoke([SystemMessage(content=system_prompt), *history], config)
+
+        prompt_tokens = count_tokens(system_prompt) + sum(message_tokens(message) for message in history)
+        response = await model_router.run("agent", call, prompt_tokens)
 
 
         response = cast(AIMessage, response)
 
         # If the LLM decided to use a tool, we go to the tool node. Otherwise, we end the graph.
+        # Commit the digest, it may have been refreshed for sections the user edited in the frontend
+        update = {"messages": response, "history_summary": history_summary}
+        if state.get("digest"):
+            update["digest"] = state["digest"]
         if response.tool_calls:
-            return Command(goto="tool_node", update={"messages": response})
-        return Command(goto="__end__", update={"messages": response})
+            return Command(goto="tool_node", update=update)
+        return Command(goto="__end__", update=update)
 
+    @traced("tool_node", "node")
     async def tool_node(self, state: ResearchState, config: RunnableConfig) -> Command[Literal["process_feedback_node", "call_model_node"]]:
         """
         Custom asynchronous tool node that can access and update agent state. This is necessary
@@ -150,70 +211,69 @@ class ResearchAgent:
         config = copilotkit_customize_config(config, emit_messages=False) # Disable emitting messages to the frontend since these messages will be intermediate
 
         msgs = []
-        tool_state = {}
+        tool_state = ToolState(state)
         for tool_call in state["messages"][-1].tool_calls:
             if tool_call["name"] == "review_proposal":
                 return Command(goto="process_feedback_node", update={"messages": ToolMessage(tool_call_id=tool_call["id"], content="")})
 
-            # Temporary messages struct that are accessible only to tools.
-            # Convert messages to a list of dicts to preserve all messages and their order
-            state['messages'] = [
-                {
-                    'type': 'HumanMessage' if isinstance(message, HumanMessage) else 
-                           'SystemMessage' if isinstance(message, SystemMessage) else 
-                           'ToolMessage' if isinstance(message, ToolMessage) else 'AIMessage',
-                    'content': message.content
-                } 
-                for message in state['messages']
-            ]
-
-            # Add a state key to the tool call so the tool can access state
-            tool_call["args"]["state"] = state
-            
-            # Manually invoke the tool that the LLM decided to use with the args it provided.
-            # Keep in mind, the state key we added above will be apart of args.
+            # Manually invoke the tool that the LLM decided to use with the args it provided. The tool gets a read-only
+            # view of the state as an injected argument, and returns the keys it changed.
             tool = self.tools_by_name[tool_call["name"]]
-            new_state, tool_msg = await tool.ainvoke(tool_call["args"]) # new_state will be the result of the tool call
-
-            # Remove the state key since we don't need to commit it into the saved state
-            tool_call["args"]["state"] = None
+            with span(tool_call["name"], "tool"):
+                changes, tool_msg = await tool.ainvoke({**tool_call["args"], "state": tool_state})
+            tool_state.update(changes)
             msgs.append(ToolMessage(content=tool_msg, name=tool_call["name"], tool_call_id=tool_call["id"]))
+            await emit_state(config, tool_state, force=True)
 
-            # Build the tool state so we can emit it and commit it into the saved state
-            tool_state = {
-                "title": new_state.get("title", ""),
-                "outline": new_state.get("outline", {}),
-                "sections": new_state.get("sections", []),
-                "sources": new_state.get("sources", {}),
-                "proposal": new_state.get("proposal", {}),
-                "logs": new_state.get("logs", []),
-                "tool": new_state.get("tool", {}),
-                "messages": msgs
-            }
-            await copilotkit_emit_state(config, tool_state)
-
-        return tool_state
+        # Keep the session's state within its memory budget (logs ring, source eviction, raw_content spill)
+        await asyncio.to_thread(apply_budget, tool_state, config.get("configurable", {}).get("thread_id"),
+                                set(tool_state.changed))
+
+        # Route with a Command rather than a static edge, a static edge would also run call_model_node next to
+        # process_feedback_node after review_proposal
+        return Command(goto="call_model_node", update={**tool_state.changes(STATE_KEYS), "messages": msgs})
 
     @staticmethod
+    @traced("process_feedback_node", "node")
     async def process_feedback_node(state: ResearchState, config: RunnableConfig):
         """
         Node for retrieving and processing feedback from the user via the frontend.
         """
 
+        # Work ahead on the sections the outline writer approved while the user reviews the proposal (opt-in)
+        speculator.start(config, state)
+
         # Interrupt the graph and wait for feedback. CopilotKit will render a form and wait for the user to submit it on
         # the frontend.
         reviewed_outline = interrupt(state.get("proposal", {}))
 
         # Process the feedback we have in reviewed_proposal.
+        feedback = "User has reviewed the proposal, please process their feedback and act accordingly."
         if reviewed_outline.get("approved"):
             outline = {k: {'title': v['title'], 'description': v['description']} for k, v in
                         reviewed_outline.get("sections", {}).items()
                         if isinstance(v, dict) and v.get('approved')}
             state['outline'] = outline
 
+            # Commit the speculative sources and drafts of the approved sections, the rest is cancelled
+            results = await speculator.commit(config, state.get("proposal", {}), outline)
+            deduper = SourceDeduper(dict(state.get("sources") or {}))
+            for result in results:
+                for url, source in result["sources"].items():
+                    deduper.add(url, source)
+            state["sources"] = deduper.sources
+            drafts = [{**result["section"], "idx": result["idx"]} for result in results if result["section"]]
+            if drafts:
+                merge_sections(state, drafts)
+                feedback += f" The sections {', '.join(draft['title'] for draft in drafts)} were already written while the user reviewed the proposal."
+        else:
+            speculator.cancel(config, state.get("proposal", {}))
+
         # Update proposal and commit the state. Add a system message so the LLM knows that this interaction took place.
         state["proposal"] = reviewed_outline
-        state["messages"] = [SystemMessage(content="User has reviewed the proposal, please process their feedback and act accordingly.")]
+        await asyncio.to_thread(apply_budget, state, config.get("configurable", {}).get("thread_id"),
+                                ("proposal", "outline", "sources", "sections", "digest"))
+        state["messages"] = [SystemMessage(content=feedback)]
         return Command(goto="call_model_node", update={**state})
 
 graph = ResearchAgent().graph
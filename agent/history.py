@@ -0,0 +1,162 @@
+import json
+import re
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from report_digest import summarize
+from tokens import count_tokens, truncate_to_tokens
+
+# Description: Token budgeted conversation history for call_model_node. The most recent turns are sent verbatim,
+# the outputs of older tool calls are replaced by compact references, and when the history is still over budget the
+# oldest turns are folded into a running summary. The summary is kept in state["history_summary"] and only extended
+# with the turns folded since the previous call.
+
+MESSAGE_TOKEN_CACHE_SIZE = 4096
+SUMMARY_LINE_CHARS = 200
+COMPACT_TITLES = 8
+
+_TITLE_RE = re.compile(r'"title": "((?:[^"\\]|\\.)*)"')
+_token_cache: "OrderedDict[tuple, int]" = OrderedDict()
+
+
+def _content_text(message: BaseMessage) -> str:
+    content = message.content
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+def message_tokens(message: BaseMessage, compact: bool = False) -> int:
+    """
+    Count the tokens of a message, including its tool calls. Counts are cached by message id.
+    """
+    key = (message.id, compact) if message.id else None
+    if key in _token_cache:
+        _token_cache.move_to_end(key)
+        return _token_cache[key]
+
+    sent = compact_message(message) if compact else message
+    tokens = count_tokens(_content_text(sent))
+    if isinstance(sent, AIMessage) and sent.tool_calls:
+        tokens += count_tokens(json.dumps([call["args"] for call in sent.tool_calls], default=str))
+
+    if key is not None:
+        _token_cache[key] = tokens
+        while len(_token_cache) > MESSAGE_TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return tokens
+
+
+def _titles(text: str) -> List[str]:
+    return [json.loads(f'"{title}"') for title in _TITLE_RE.findall(text)]
+
+
+def compact_tool_output(name: Optional[str], content: str) -> str:
+    """
+    Replace the output of a tool call by a short reference to what it returned.
+    """
+    if name in ("tavily_search", "knowledge_search"):
+        titles = _titles(content)
+        more = f" and {len(titles) - COMPACT_TITLES} more" if len(titles) > COMPACT_TITLES else ""
+        return f"[search returned {len(titles)} sources: {'; '.join(titles[:COMPACT_TITLES])}{more}]"
+    if name == "outline_writer":
+        titles = _titles(content)
+        return f"[outline proposal with sections: {'; '.join(titles)}]" if titles else f"[{summarize(content)}]"
+    if name == "tavily_extract":
+        urls = content.splitlines()[1:]
+        return f"[extracted {len(urls)} sources]"
+    return content if count_tokens(content) <= 100 else f"[{summarize(content)}]"
+
+
+def compact_message(message: BaseMessage) -> BaseMessage:
+    """
+    The compact form of a message, only tool outputs are compacted.
+    """
+    if isinstance(message, ToolMessage):
+        return message.model_copy(update={"content": compact_tool_output(message.name, _content_text(message))})
+    return message
+
+
+def split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+    """
+    Split the history into turns, each starting with a human or system message. Tool calls and their outputs always
+    stay in the same turn, so dropping whole turns keeps the history valid.
+    """
+    turns = []
+    for message in messages:
+        if not turns or isinstance(message, (HumanMessage, SystemMessage)):
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def summarize_turn(turn: List[BaseMessage]) -> str:
+    """
+    One line summary of a turn: the request, the tools that were used and the answer.
+    """
+    parts = []
+    for message in turn:
+        if isinstance(message, HumanMessage):
+            parts.append(f"User: {summarize(_content_text(message), SUMMARY_LINE_CHARS)}")
+        elif isinstance(message, SystemMessage):
+            parts.append(summarize(_content_text(message), SUMMARY_LINE_CHARS))
+        elif isinstance(message, ToolMessage):
+            parts.append(f"{message.name}: {compact_tool_output(message.name, _content_text(message))}")
+        elif isinstance(message, AIMessage) and message.content:
+            parts.append(f"Assistant: {summarize(_content_text(message), SUMMARY_LINE_CHARS)}")
+    return "- " + " | ".join(parts)
+
+
+def compact_history(messages: List[BaseMessage], summary: Optional[dict], budget: int,
+                    recent_turns: int = 2) -> Tuple[List[BaseMessage], dict]:
+    """
+    Fit the history into budget tokens. Returns the messages to send, starting with a summary of the folded turns
+    when there is one, and the updated summary state ({"text", "last_id"}, last_id being the id of the last message
+    already in the summary).
+    """
+    summary = dict(summary or {"text": "", "last_id": None})
+    ids = [message.id for message in messages]
+    if summary["last_id"] in ids:
+        turns = split_turns(messages[ids.index(summary["last_id"]) + 1:])
+    else:
+        # Nothing folded yet, or the folded messages were removed from the history
+        summary = {"text": "", "last_id": None}
+        turns = split_turns(messages)
+
+    def total(turns, summary_text):
+        tokens = count_tokens(summary_text)
+        for i, turn in enumerate(turns):
+            compact = i < len(turns) - recent_turns
+            tokens += sum(message_tokens(message, compact) for message in turn)
+        return tokens
+
+    # Fold the oldest turns into the summary until the history fits. The last turn is never folded, it holds the
+    # request being answered.
+    while len(turns) > 1 and total(turns, summary["text"]) > budget:
+        turn = turns.pop(0)
+        if turn[-1].id is None:
+            turns.insert(0, turn)
+            break
+        lines = f"{summary['text']}\n{summarize_turn(turn)}".strip().split("\n")
+        # The summary itself is held to a quarter of the budget, the oldest lines go first
+        while len(lines) > 1 and count_tokens("\n".join(lines)) > budget // 4:
+            lines.pop(0)
+        summary = {"text": "\n".join(lines), "last_id": turn[-1].id}
+
+    # Still over budget with only the recent turns left, every tool output but the last message is compacted and the
+    # last message is truncated to whatever budget is left
+    over_budget = total(turns, summary["text"]) > budget
+    history = []
+    for i, turn in enumerate(turns):
+        compact = over_budget or i < len(turns) - recent_turns
+        history.extend(compact_message(message) if compact else message for message in turn)
+    if over_budget:
+        history[-1] = turns[-1][-1]
+        if isinstance(history[-1], ToolMessage):
+            used = count_tokens(summary["text"]) + sum(message_tokens(message, True) for message in history[:-1])
+            history[-1] = history[-1].model_copy(
+                update={"content": truncate_to_tokens(_content_text(history[-1]), max(budget - used, 0))})
+
+    if summary["text"]:
+        history.insert(0, SystemMessage(content=f"Summary of the earlier conversation:\n{summary['text']}"))
+    return history, summary
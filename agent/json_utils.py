@@ -0,0 +1,90 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+import json5
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib json module is used when it is not installed
+    orjson = None
+
+# Description: Fast JSON parsing helpers for model output. Strict JSON is parsed with orjson (or the stdlib), and
+# json5 is only used as a fallback for the lenient output models sometimes produce.
+
+
+def loads(text: str) -> Any:
+    """
+    Parse JSON text, trying the fast strict parsers first and falling back to json5.
+    """
+    try:
+        return orjson.loads(text) if orjson is not None else json.loads(text)
+    except ValueError:
+        return json5.loads(text)
+
+
+class ObjectStreamParser:
+    """
+    Incrementally scans streamed JSON text and returns each member of the object found at `path` as soon as it is
+    complete. For example with path ("sections",), every `"section1": {...}` entry of the top level "sections" object
+    is returned once its closing brace has been streamed, long before the whole document is complete.
+    """
+
+    def __init__(self, path: Tuple[str, ...]):
+        self.path = [None, *path]  # None is the key of the root object
+        self.text = ""
+        self._pos = 0
+        self._stack: List[Optional[str]] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._member_start: Optional[int] = None
+        self._member_key: Optional[str] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Add a streamed chunk and return the (key, value) members that were completed by it.
+        """
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start:i + 1]
+            elif c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c in "{[":
+                # An object or array opened after `"key":` is named by that key
+                key = _decode_key(self._last_string) if c == "{" else None
+                if c == "{" and self._stack == self.path:
+                    self._member_start, self._member_key = i, key
+                self._stack.append(key if self._stack else None)
+                self._last_string = None
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if c == "}" and self._stack == self.path and self._member_start is not None:
+                    try:
+                        completed.append((self._member_key, loads(text[self._member_start:i + 1])))
+                    except ValueError:
+                        pass
+                    self._member_start = None
+        self._pos = len(text)
+        return completed
+
+
+def _decode_key(raw: Optional[str]) -> Optional[str]:
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw.strip('"')
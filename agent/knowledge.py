@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from blob_store import REF_KEY
+from retrieval import tokenize
+
+# Description: Persistent local knowledge store shared by every session. Every source found by tavily_search and
+# every page extracted by tavily_extract is ingested into a SQLite FTS5 full-text index together with its freshness
+# metadata, so repeat topics can be answered locally: by the knowledge_search tool, and by tavily_search itself, which
+# skips the web for sub-queries that have enough fresh local hits.
+
+KNOWLEDGE_STORE_PATH = os.getenv("KNOWLEDGE_STORE_PATH", ".cache/knowledge.sqlite3")  # empty string disables the store
+KNOWLEDGE_MIN_HITS = int(os.getenv("KNOWLEDGE_MIN_HITS", "5"))  # local hits needed to skip a web search
+KNOWLEDGE_PAGE_CHARS = int(os.getenv("KNOWLEDGE_PAGE_CHARS", "50000"))  # indexed prefix of extracted pages
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS documents (url TEXT PRIMARY KEY, doc_id INTEGER, title TEXT, content TEXT, "
+    "published_date TEXT, score REAL, ref TEXT, fetched_at REAL, extracted_at REAL)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(title, content, page, tokenize='porter unicode61')",
+)
+
+
+class KnowledgeStore:
+    """
+    Full-text index of every source seen, with the time it was fetched and, for extracted pages, the blob store
+    reference of the page.
+    """
+
+    def __init__(self, path: Optional[str] = KNOWLEDGE_STORE_PATH):
+        self.path = path
+        self._db = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _connect(self):
+        """
+        Open the SQLite database on first use, so importing the store does no IO.
+        """
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._db.execute(statement)
+        return self._db
+
+    def _upsert(self, db, url: str, title: str, content: str, page: Optional[str], metadata: dict) -> None:
+        row = db.execute("SELECT doc_id, title, content FROM documents WHERE url = ?", (url,)).fetchone()
+        if row is not None:
+            if page is None:
+                # Keep the indexed page of a source that is found again by a search
+                page = (db.execute("SELECT page FROM documents_fts WHERE rowid = ?", (row[0],)).fetchone() or [""])[0]
+            title, content = title or row[1], content or row[2]
+            db.execute("DELETE FROM documents_fts WHERE rowid = ?", (row[0],))
+        doc_id = db.execute("INSERT INTO documents_fts (title, content, page) VALUES (?, ?, ?)",
+                            (title, content, page or "")).lastrowid
+        db.execute(
+            "INSERT INTO documents (url, doc_id, title, content, published_date, score, ref, fetched_at, extracted_at) "
+            "VALUES (:url, :doc_id, :title, :content, :published_date, :score, :ref, :fetched_at, :extracted_at) "
+            "ON CONFLICT(url) DO UPDATE SET doc_id = :doc_id, title = :title, content = :content, "
+            "published_date = COALESCE(:published_date, published_date), score = COALESCE(:score, score), "
+            "ref = COALESCE(:ref, ref), fetched_at = COALESCE(:fetched_at, fetched_at), "
+            "extracted_at = COALESCE(:extracted_at, extracted_at)",
+            {"url": url, "doc_id": doc_id, "title": title, "content": content, **metadata},
+        )
+
+    def add_sources(self, sources: Dict[str, dict]) -> None:
+        """
+        Ingest search results, keyed by url.
+        """
+        if not self.enabled or not sources:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN")
+            for url, source in sources.items():
+                self._upsert(db, url, source.get("title") or "", source.get("content") or "", None, {
+                    "published_date": source.get("published_date"), "score": source.get("score"), "ref": None,
+                    "fetched_at": now, "extracted_at": None,
+                })
+            db.execute("COMMIT")
+
+    def add_page(self, url: str, raw_content: str, ref: dict) -> None:
+        """
+        Ingest an extracted page. The page text is indexed, the page itself stays in the blob store.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN")
+            self._upsert(db, url, "", "", raw_content[:KNOWLEDGE_PAGE_CHARS], {
+                "published_date": None, "score": None, "ref": json.dumps(ref), "fetched_at": now, "extracted_at": now,
+            })
+            db.execute("COMMIT")
+
+    def search(self, query: str, limit: int = 10, max_age: Optional[float] = None,
+               match_all: bool = False) -> List[dict]:
+        """
+        Best matching sources for a query, as Tavily-like results (url, title, content, score, published_date) with
+        the blob store reference of their page when it was extracted. Sources fetched more than max_age seconds ago
+        are left out. Terms are OR-ed, or AND-ed with match_all.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not self.enabled or not terms:
+            return []
+        match = (" AND " if match_all else " OR ").join(f'"{term}"' for term in terms)
+        min_fetched_at = time.time() - max_age if max_age is not None else 0
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT d.url, d.title, d.content, d.score, d.published_date, d.ref "
+                "FROM documents_fts JOIN documents d ON d.doc_id = documents_fts.rowid "
+                "WHERE documents_fts MATCH ? AND d.fetched_at >= ? ORDER BY bm25(documents_fts, 4.0, 2.0, 1.0) LIMIT ?",
+                (match, min_fetched_at, limit),
+            ).fetchall()
+
+        results = []
+        for url, title, content, score, published_date, ref in rows:
+            result = {"url": url, "title": title, "content": content, "score": score if score is not None else 0.5,
+                      "published_date": published_date}
+            if ref:
+                result[REF_KEY] = json.loads(ref)
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        if not self.enabled:
+            return {"documents": 0, "pages": 0}
+        with self._lock:
+            documents, pages = self._connect().execute(
+                "SELECT COUNT(*), COUNT(extracted_at) FROM documents").fetchone()
+        return {"documents": documents, "pages": pages}
+
+
+knowledge_store = KnowledgeStore()
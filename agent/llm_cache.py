@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (AIMessage, AIMessageChunk, BaseMessage, message_chunk_to_message, message_to_dict,
+                                     messages_from_dict)
+from langchain_core.messages.tool import tool_call_chunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from cache import MISSING, TieredCache
+from telemetry import add_attribute
+
+# Description: Cache of model responses, keyed by a hash of the model, its parameters, the bound tools and the
+# messages. Identical prompts are sent again on retries, on re-runs of a node after an interrupt and across regression
+# runs; with the cache they are answered locally. get_llm wraps every chat model in a CachedChatModel, which answers
+# ainvoke and astream from the cache (streamed responses are replayed chunk by chunk) and records the responses of
+# the calls it has to make. A cached response is answered by a ReplayChatModel run with the config of the call, so the
+# callbacks see a hit as a model call: CopilotKit streams its tokens and telemetry records its span. Modes
+# (LLM_CACHE_MODE):
+# - "off" (default): no cache;
+# - "cache": read-through for the calls whose response is deterministic (temperature 0 or a JSON response format),
+#   sampled calls such as drafts and a user's retry always go to the model. Responses are kept for LLM_CACHE_TTL
+#   seconds, expired rows are pruned from the disk tier by TieredCache;
+# - "record": every call goes to the model and its response is recorded, replacing an earlier recording;
+# - "replay": strict, responses only come from the recordings and a call that was not recorded raises LLMCacheMiss,
+#   so a run makes no model calls at all.
+# Recordings do not expire. In record and replay modes the date in the prompts is left out of the key, so recordings
+# can be replayed on another day.
+
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "off")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm.sqlite3")  # empty string disables the disk tier
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "20000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60)))
+RECORDING_TTL = 100 * 365 * 24 * 60 * 60
+LLM_CACHE_MODES = ("off", "cache", "record", "replay")
+
+# Parameters of get_llm that do not change the response
+TRANSPORT_PARAMS = frozenset(("max_retries", "timeout", "request_timeout", "base_url", "api_key", "streaming",
+                              "stream_usage", "http_client", "http_async_client"))
+_DATE_RE = re.compile(r"Today's date is [0-9/]+")
+
+
+class LLMCacheMiss(LookupError):
+    """
+    Raised in replay mode for a model call that was not recorded.
+    """
+
+
+def _message_key(message: Any) -> Any:
+    """
+    The parts of a message that make up the prompt, without the ids and metadata that differ between runs.
+    """
+    if not isinstance(message, BaseMessage):
+        return message if isinstance(message, (str, dict, list)) else str(message)
+    key = {"type": message.type, "content": message.content}
+    if message.name:
+        key["name"] = message.name
+    if isinstance(message, AIMessage) and message.tool_calls:
+        key["tool_calls"] = [{"name": call["name"], "args": call["args"], "id": call.get("id")}
+                             for call in message.tool_calls]
+    if getattr(message, "tool_call_id", None):
+        key["tool_call_id"] = message.tool_call_id
+    return key
+
+
+def _dump(message: BaseMessage) -> dict:
+    """
+    A message as a JSON serializable dict, without its empty fields. The id is dropped, a replayed message gets a new
+    one so that it is not merged with the message it was recorded from.
+    """
+    data = message_to_dict(message)
+    data["data"] = {k: v for k, v in data["data"].items() if (v or k == "content") and k != "id"}
+    return data
+
+
+class LLMCache:
+    """
+    Responses of model calls by key, in a TieredCache.
+    """
+
+    def __init__(self, mode: str = LLM_CACHE_MODE, path: Optional[str] = LLM_CACHE_PATH,
+                 max_entries: int = LLM_CACHE_MEMORY_ENTRIES):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM_CACHE_MODE {mode!r}, expected one of {LLM_CACHE_MODES}")
+        self.mode = mode
+        # Recordings are never pruned for size
+        self.cache = TieredCache("llm", path=path, max_entries=max_entries,
+                                 max_disk_entries=LLM_CACHE_DISK_ENTRIES if mode == "cache" else 0)
+        self.ttl = LLM_CACHE_TTL if mode == "cache" else RECORDING_TTL
+        self.stats = {"hits": 0, "misses": 0, "recorded": 0}
+
+    def cacheable(self, params: dict, bound: dict) -> bool:
+        """
+        Whether the response of a call can be reused. Recording and replaying reuse every response, the read-through
+        cache only deterministic ones.
+        """
+        if self.mode != "cache":
+            return True
+        response_format = {**(params.get("model_kwargs") or {}), **bound}.get("response_format") or {}
+        return params.get("temperature") == 0 or response_format.get("type") in ("json_object", "json_schema")
+
+    def make_key(self, params: dict, bound: dict, messages: List[Any]) -> str:
+        prompt = [_message_key(message) for message in messages]
+        if self.mode in ("record", "replay"):
+            prompt = json.loads(_DATE_RE.sub("Today's date is <date>", json.dumps(prompt)))
+        payload = json.dumps({"params": params, "bound": bound, "messages": prompt}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def lookup(self, key: str) -> Any:
+        """
+        The recorded response of a key, or MISSING. Raises LLMCacheMiss for a missing key in replay mode.
+        """
+        value = MISSING if self.mode == "record" else await self.cache.get(key)
+        if value is MISSING:
+            if self.mode == "replay":
+                raise LLMCacheMiss(f"No recorded response for model call {key[:12]}")
+            self.stats["misses"] += 1
+            add_attribute("llm_cache_misses", 1)
+        else:
+            self.stats["hits"] += 1
+            add_attribute("llm_cache_hits", 1)
+        return value
+
+    async def record(self, key: str, value: Any) -> None:
+        await self.cache.set(key, value, self.ttl)
+        self.stats["recorded"] += 1
+
+
+def _as_chunk(message: BaseMessage) -> AIMessageChunk:
+    """
+    A recorded response as a single chunk, with its tool calls as tool call chunks.
+    """
+    if isinstance(message, AIMessageChunk):
+        return message
+    tool_calls = getattr(message, "tool_calls", None) or []
+    return AIMessageChunk(content=message.content, additional_kwargs=message.additional_kwargs,
+                          response_metadata=message.response_metadata,
+                          usage_metadata=getattr(message, "usage_metadata", None),
+                          tool_call_chunks=[tool_call_chunk(name=call["name"], args=json.dumps(call["args"]),
+                                                            id=call.get("id"), index=index)
+                                            for index, call in enumerate(tool_calls)])
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Chat model answering with a cached response: the recorded chunks when it is streamed, the recorded message
+    otherwise. It runs through the callback manager like the model it stands in for.
+    """
+
+    response: List[BaseMessage]
+    model_name: str = "llm-cache"
+    cache: bool = False
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-cache-replay"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model_name}
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if len(self.response) == 1 and not isinstance(self.response[0], AIMessageChunk):
+            return ChatResult(generations=[ChatGeneration(message=self.response[0])])
+        merged = _as_chunk(self.response[0])
+        for chunk in self.response[1:]:
+            merged += _as_chunk(chunk)
+        return ChatResult(generations=[ChatGeneration(message=message_chunk_to_message(merged))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        for message in self.response:
+            yield ChatGenerationChunk(message=_as_chunk(message))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        for message in self.response:
+            yield ChatGenerationChunk(message=_as_chunk(message))
+            await asyncio.sleep(0)  # the consumer of a replayed stream must not hold the event loop for its length
+
+
+class CachedChatModel:
+    """
+    Wraps a chat model (or a binding of it) so that ainvoke and astream are answered from the LLM cache. bind_tools
+    returns a wrapper of the binding, every other attribute is the wrapped model's.
+    """
+
+    def __init__(self, llm, params: dict, llm_cache: LLMCache, bound: Optional[dict] = None, callbacks=None):
+        self._llm = llm
+        self._params = {k: v for k, v in params.items() if k not in TRANSPORT_PARAMS}
+        self._cache = llm_cache
+        self._bound = bound or {}
+        self._callbacks = getattr(llm, "callbacks", None) if callbacks is None else callbacks
+
+    def __getattr__(self, name: str):
+        return getattr(self._llm, name)
+
+    def bind_tools(self, tools, **kwargs) -> "CachedChatModel":
+        bound = {**self._bound, "tools": [convert_to_openai_tool(tool) for tool in tools], **kwargs}
+        return CachedChatModel(self._llm.bind_tools(tools, **kwargs), self._params, self._cache, bound, self._callbacks)
+
+    def _replay(self, response: List[BaseMessage]) -> ReplayChatModel:
+        return ReplayChatModel(response=response, model_name=str(self._params.get("model", "llm-cache")),
+                               callbacks=self._callbacks)
+
+    async def ainvoke(self, messages: List[Any], config=None, **kwargs) -> BaseMessage:
+        if not self._cache.cacheable(self._params, {**self._bound, **kwargs}):
+            return await self._llm.ainvoke(messages, config, **kwargs)
+        key = self._cache.make_key(self._params, {**self._bound, **kwargs}, messages)
+        value = await self._cache.lookup(key)
+        if value is not MISSING and "message" in value:
+            return await self._replay(messages_from_dict([value["message"]])).ainvoke(messages, config)
+        response = await self._llm.ainvoke(messages, config, **kwargs)
+        await self._cache.record(key, {"message": _dump(response)})
+        return response
+
+    async def astream(self, messages: List[Any], config=None, **kwargs) -> AsyncIterator[BaseMessage]:
+        if not self._cache.cacheable(self._params, {**self._bound, **kwargs}):
+            async for chunk in self._llm.astream(messages, config, **kwargs):
+                yield chunk
+            return
+        key = self._cache.make_key(self._params, {**self._bound, **kwargs, "stream": True}, messages)
+        value = await self._cache.lookup(key)
+        if value is not MISSING and "chunks" in value:
+            async for chunk in self._replay(messages_from_dict(value["chunks"])).astream(messages, config):
+                yield chunk
+            return
+        # The stream is recorded only once it completed
+        chunks = []
+        async for chunk in self._llm.astream(messages, config, **kwargs):
+            chunks.append(_dump(chunk))
+            yield chunk
+        await self._cache.record(key, {"chunks": chunks})
+
+
+_llm_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    """
+    The process wide LLM cache, None when LLM_CACHE_MODE is off.
+    """
+    global _llm_cache
+    if LLM_CACHE_MODE == "off":
+        return None
+    if _llm_cache is None:
+        _llm_cache = LLMCache()
+    return _llm_cache
+
+
+def llm_cache_stats() -> Dict[str, int]:
+    return dict(_llm_cache.stats) if _llm_cache is not None else {}
@@ -0,0 +1,131 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Description: Block level patches of markdown sections. A section is split into blocks (paragraphs, headers, lists,
+# tables, fenced code, ...) that are numbered for the model, which answers an edit request with a few edits of those
+# blocks instead of the whole section. Edits are validated and applied locally: every edit names its block by number
+# and quotes the block's first words as an anchor, and the patched section must still be well-formed.
+
+EDIT_OPS = ("replace", "insert_after", "delete")
+ANCHOR_CHARS = 40  # prefix of a block the anchor is matched against, after whitespace normalization
+
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_FOOTNOTE_REF_RE = re.compile(r"\[\^([^\]]+)\](?!:)")
+_FOOTNOTE_DEF_RE = re.compile(r"^\s*\[\^([^\]]+)\]:", re.MULTILINE)
+
+
+class PatchError(ValueError):
+    """
+    Raised when edits do not apply to a section or leave it malformed.
+    """
+
+
+def split_blocks(markdown: str) -> List[str]:
+    """
+    Split markdown into blocks separated by blank lines. Fenced code blocks are kept whole.
+    """
+    blocks, current, in_fence = [], [], False
+    for line in (markdown or "").splitlines():
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        if not line.strip() and not in_fence:
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def join_blocks(blocks: List[str]) -> str:
+    return "\n\n".join(block.strip("\n") for block in blocks if block.strip())
+
+
+def number_blocks(blocks: List[str]) -> str:
+    """
+    The blocks as they are shown to the model, each preceded by its number.
+    """
+    return "\n\n".join(f"[block {i}]\n{block}" for i, block in enumerate(blocks))
+
+
+def _normalize(text: str) -> str:
+    return " ".join((text or "").split()).lower()
+
+
+def _check_anchor(block: str, anchor: str, number: int) -> None:
+    anchor = _normalize(anchor)
+    if not anchor:
+        raise PatchError(f"The edit of block {number} has no anchor")
+    if not _normalize(block).startswith(anchor[:ANCHOR_CHARS]):
+        raise PatchError(f"The anchor of the edit of block {number} does not match the block")
+
+
+def apply_edits(blocks: List[str], edits: List[dict]) -> Tuple[List[str], List[int]]:
+    """
+    Apply block edits to the blocks of a section. Returns the new blocks and the positions of the changed blocks in
+    them. Edits refer to the original block numbers, at most one replace or delete per block.
+    """
+    replaced: Dict[int, Optional[str]] = {}
+    inserted: Dict[int, List[str]] = {}
+    for edit in edits:
+        op, number = edit.get("op"), edit.get("block")
+        if op not in EDIT_OPS:
+            raise PatchError(f"Unknown edit operation: {op}")
+        if not isinstance(number, int) or not -1 <= number < len(blocks) or (number == -1 and op != "insert_after"):
+            raise PatchError(f"Block {number} does not exist")
+        if number >= 0:
+            _check_anchor(blocks[number], edit.get("anchor", ""), number)
+        if op == "insert_after":
+            if not (edit.get("text") or "").strip():
+                raise PatchError(f"The insertion after block {number} has no text")
+            inserted.setdefault(number, []).append(edit["text"])
+        elif number in replaced:
+            raise PatchError(f"Block {number} is edited more than once")
+        else:
+            replaced[number] = edit.get("text") if op == "replace" else None
+
+    patched, changed = [], []
+    for number in range(-1, len(blocks)):
+        if number >= 0:
+            block = replaced.get(number, blocks[number])
+            if number in replaced and block is not None and block.strip():
+                changed.append(len(patched))
+            if block is not None and block.strip():
+                patched.append(block)
+        for text in inserted.get(number, []):
+            changed.append(len(patched))
+            patched.append(text)
+    return patched, changed
+
+
+def validate_section(content: str, footer: str, original_content: str, original_footer: str) -> None:
+    """
+    Check that a patched section is well-formed: not empty, with balanced code fences and, when the original section
+    defined its footnotes, a definition for every footnote it references.
+    """
+    if not content.strip():
+        raise PatchError("The patched section is empty")
+    if sum(1 for line in content.splitlines() if _FENCE_RE.match(line)) % 2:
+        raise PatchError("The patched section has an unclosed code block")
+    original_refs = set(_FOOTNOTE_REF_RE.findall(original_content))
+    if original_refs <= set(_FOOTNOTE_DEF_RE.findall(original_footer)):
+        undefined = set(_FOOTNOTE_REF_RE.findall(content)) - set(_FOOTNOTE_DEF_RE.findall(footer))
+        if undefined:
+            raise PatchError(f"The patched section references undefined footnotes: {sorted(undefined)}")
+
+
+def patch_section(section: dict, edits: List[dict], footer: Optional[str] = None,
+                  title: Optional[str] = None) -> Tuple[dict, List[int]]:
+    """
+    Apply block edits, and optionally a new footer and title, to a section. Returns the patched section and the
+    positions of its changed blocks. Raises PatchError when the edits do not apply.
+    """
+    if not edits and footer is None and title is None:
+        raise PatchError("The patch has no edits")
+    blocks, changed = apply_edits(split_blocks(section.get("content", "")), edits)
+    content = join_blocks(blocks)
+    footer = section.get("footer", "") if footer is None else footer
+    validate_section(content, footer, section.get("content", ""), section.get("footer", ""))
+    return {**section, "title": title or section.get("title", ""), "content": content, "footer": footer}, changed
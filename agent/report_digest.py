@@ -0,0 +1,103 @@
+import hashlib
+import re
+from typing import List, Optional
+
+# Description: Compact digest of the written report, used in place of the full section text in the system prompt.
+# Each entry holds the section title, a short extractive summary, a content hash and the content length, and is only
+# recomputed when the section content hash changes.
+
+SUMMARY_MAX_CHARS = 240
+
+_MARKDOWN_RE = re.compile(r"(^#{1,6}\s*|[*_`>~]|\[\^\d+\]|!?\[([^\]]*)\]\([^)]*\))", re.MULTILINE)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def content_hash(section: dict) -> str:
+    """
+    Hash the parts of a section that are sent to the model.
+    """
+    text = f"{section.get('title', '')}\x00{section.get('content', '')}\x00{section.get('footer', '')}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def summarize(content: str, max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """
+    Build a short extractive summary from the first sentences of a markdown section.
+    """
+    text = _MARKDOWN_RE.sub(lambda m: m.group(2) or "", content or "")
+    text = " ".join(text.split())
+    summary = ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        if summary and len(summary) + len(sentence) + 1 > max_chars:
+            break
+        summary = f"{summary} {sentence}".strip()
+    return summary if len(summary) <= max_chars else summary[:max_chars - 1].rstrip() + "…"
+
+
+def digest_section(section: dict, previous: Optional[dict] = None) -> dict:
+    """
+    Build the digest entry of a section, reusing the previous entry when the content did not change. Sections merged
+    into state carry their content hash (sections.py), it is only computed here for sections that do not.
+    """
+    section_hash = section.get("hash") or content_hash(section)
+    if previous and previous.get("hash") == section_hash:
+        return previous
+    return {
+        "idx": section["idx"],
+        "title": section.get("title", ""),
+        "summary": summarize(section.get("content", "")),
+        "hash": section_hash,
+        "length": len(section.get("content", "")) + len(section.get("footer", "")),
+    }
+
+
+def update_digest(digest: Optional[dict], sections: List[dict]) -> dict:
+    """
+    Incrementally update a copy of state["digest"] for the given written or edited sections.
+    """
+    digest = dict(digest or {})
+    for section in sections:
+        key = str(section["idx"])
+        digest[key] = digest_section(section, digest.get(key))
+    return digest
+
+
+def sync_digest(state) -> dict:
+    """
+    Bring state["digest"] in line with state["sections"], e.g. after the user edited a section in the frontend.
+    Only sections whose content hash changed are summarized again.
+    """
+    previous = state.get("digest") or {}
+    digest = {str(sec["idx"]): digest_section(sec, previous.get(str(sec["idx"]))) for sec in state.get("sections", [])}
+    state["digest"] = digest
+    return digest
+
+
+def find_editing_section(sections: List[dict], request: str) -> Optional[dict]:
+    """
+    Find the section the user is currently asking about, by title or by "section N" in their latest message.
+    """
+    if not request:
+        return None
+    request = request.lower()
+    # Prefer the longest matching title so "Market" does not shadow "Market Risks"
+    for section in sorted(sections, key=lambda sec: len(sec.get("title", "")), reverse=True):
+        if section.get("title") and section["title"].lower() in request:
+            return section
+    match = re.search(r"section\s+#?(\d+)", request)
+    if match:
+        return {sec["idx"]: sec for sec in sections}.get(int(match.group(1)))
+    return None
+
+
+def format_digest(digest: dict, include_summaries: bool = True) -> str:
+    """
+    Format the digest entries for the system prompt, ordered by idx.
+    """
+    lines = []
+    for entry in sorted(digest.values(), key=lambda e: e["idx"]):
+        line = f"section {entry['idx']} : {entry['title']} (hash: {entry['hash']}, length: {entry['length']} chars)"
+        if include_summaries and entry.get("summary"):
+            line += f"\n  summary : {entry['summary']}"
+        lines.append(line)
+    return "\n".join(lines)
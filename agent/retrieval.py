@@ -0,0 +1,307 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from blob_store import resolve_raw_content, REF_KEY
+from tokens import count_tokens
+
+# Description: In-process BM25 retrieval over the research sources held in state["sources"].
+# Sources are chunked and tokenized once (cached by url and content hash) so the index can be
+# updated incrementally as tavily_search and tavily_extract add sources. Terms are identified by
+# a 64 bit hash rather than a vocabulary, so chunked sources can be shared between sessions without
+# a process wide table that grows with every term ever seen.
+
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "12"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "3000"))
+CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "180"))
+CHUNK_CACHE_SIZE = int(os.getenv("RETRIEVAL_CHUNK_CACHE_SIZE", "5000"))
+INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "64"))
+TERM_CACHE_SIZE = 100_000
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in into is it its of on or that the their this to was were "
+    "will with which who what when where how than then there these those not no can".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase and split text into index terms, dropping stopwords.
+    """
+    return [term for term in _TERM_RE.findall(text.lower()) if term not in _STOPWORDS]
+
+
+@lru_cache(maxsize=TERM_CACHE_SIZE)
+def _term_id(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _term_ids(terms: List[str]) -> List[int]:
+    """
+    Map terms to their ids, a stable hash of the term.
+    """
+    return [_term_id(term) for term in terms]
+
+
+def source_text(source: dict) -> str:
+    """
+    Return the text that should be indexed for a source. The full raw_content is preferred over the search snippet,
+    and is loaded from the blob store when the source only holds a reference to it.
+    """
+    return resolve_raw_content(source) or source.get("content") or ""
+
+
+def chunk_text(text: str, chunk_words: int = CHUNK_WORDS) -> List[str]:
+    """
+    Split text into chunks of roughly chunk_words words, keeping paragraphs together where possible.
+    """
+    chunks, current, current_len = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        words = paragraph.split()
+        if not words:
+            continue
+        # Paragraphs longer than a chunk are split on word boundaries
+        while len(words) > chunk_words:
+            if current:
+                chunks.append(" ".join(current))
+                current, current_len = [], 0
+            chunks.append(" ".join(words[:chunk_words]))
+            words = words[chunk_words:]
+        if current_len + len(words) > chunk_words and current:
+            chunks.append(" ".join(current))
+            current, current_len = [], 0
+        current.extend(words)
+        current_len += len(words)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class ChunkedSource:
+    """
+    The chunks of a single source together with their term postings, stored as flat NumPy arrays.
+    """
+    __slots__ = ("url", "title", "chunks", "term_ids", "term_freqs", "chunk_of", "lengths", "tokens")
+
+    def __init__(self, url: str, source: dict):
+        self.url = url
+        self.title = source.get("title") or url
+        self.chunks = chunk_text(source_text(source))
+
+        term_ids, term_freqs, chunk_of, lengths = [], [], [], []
+        for i, chunk in enumerate(self.chunks):
+            ids = _term_ids(tokenize(chunk))
+            unique, counts = np.unique(np.asarray(ids, dtype=np.int64), return_counts=True)
+            term_ids.append(unique)
+            term_freqs.append(counts)
+            chunk_of.append(np.full(len(unique), i, dtype=np.int64))
+            lengths.append(len(ids))
+
+        empty = np.zeros(0, dtype=np.int64)
+        self.term_ids = np.concatenate(term_ids) if term_ids else empty
+        self.term_freqs = np.concatenate(term_freqs).astype(np.float64) if term_freqs else empty.astype(np.float64)
+        self.chunk_of = np.concatenate(chunk_of) if chunk_of else empty
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.tokens = [count_tokens(chunk) for chunk in self.chunks]
+
+
+# LRU cache of chunked sources keyed by (url, content hash), shared by all sessions in the worker
+_chunk_cache: "OrderedDict[tuple, ChunkedSource]" = OrderedDict()
+_chunk_cache_lock = threading.Lock()
+
+
+def _source_key(url: str, source: dict) -> tuple:
+    # Sources whose raw_content lives in the blob store are keyed by the blob hash, without loading the blob
+    if source.get(REF_KEY) and not source.get("raw_content"):
+        return url, source[REF_KEY]["hash"]
+    return url, hashlib.sha1(source_text(source).encode("utf-8")).hexdigest()
+
+
+def get_chunked_source(url: str, source: dict) -> ChunkedSource:
+    """
+    Return the chunked form of a source, chunking and tokenizing it only the first time its content is seen.
+    """
+    key = _source_key(url, source)
+    with _chunk_cache_lock:
+        chunked = _chunk_cache.get(key)
+        if chunked is not None:
+            _chunk_cache.move_to_end(key)
+            return chunked
+
+    chunked = ChunkedSource(url, source)
+    with _chunk_cache_lock:
+        _chunk_cache[key] = chunked
+        while len(_chunk_cache) > CHUNK_CACHE_SIZE:
+            _chunk_cache.popitem(last=False)
+    return chunked
+
+
+def index_sources(sources: Dict[str, dict]) -> None:
+    """
+    Chunk and index newly added or updated sources ahead of time, so that retrieval does not pay for it later.
+    """
+    for url, source in sources.items():
+        get_chunked_source(url, source)
+
+
+class SourceIndex:
+    """
+    BM25 index over the chunks of a set of sources. The postings of all sources are stacked into flat arrays
+    (a COO sparse matrix of chunk x term frequencies) and scored with vectorized NumPy operations.
+    """
+
+    def __init__(self, sources: Optional[Dict[str, dict]] = None):
+        self._sources: Dict[str, ChunkedSource] = {}
+        self._stacked = None
+        if sources:
+            self.update(sources)
+
+    def update(self, sources: Dict[str, dict]) -> None:
+        """
+        Sync the index with the given sources. Only new or changed sources are chunked, removed sources are dropped.
+        """
+        changed = False
+        for url, source in sources.items():
+            chunked = get_chunked_source(url, source)
+            if self._sources.get(url) is not chunked:
+                self._sources[url] = chunked
+                changed = True
+        for url in [url for url in self._sources if url not in sources]:
+            del self._sources[url]
+            changed = True
+        if changed:
+            self._stacked = None
+
+    def _stack(self):
+        """
+        Stack the postings of every source into global arrays. Cached until the set of sources changes.
+        """
+        if self._stacked is not None:
+            return self._stacked
+
+        chunk_refs, term_ids, term_freqs, chunk_of, lengths = [], [], [], [], []
+        offset = 0
+        for chunked in self._sources.values():
+            chunk_refs.extend((chunked, i) for i in range(len(chunked.chunks)))
+            term_ids.append(chunked.term_ids)
+            term_freqs.append(chunked.term_freqs)
+            chunk_of.append(chunked.chunk_of + offset)
+            lengths.append(chunked.lengths)
+            offset += len(chunked.chunks)
+
+        if offset:
+            self._stacked = (chunk_refs, np.concatenate(term_ids), np.concatenate(term_freqs),
+                             np.concatenate(chunk_of), np.concatenate(lengths))
+        else:
+            empty = np.zeros(0)
+            self._stacked = ([], empty.astype(np.int64), empty, empty.astype(np.int64), empty)
+        return self._stacked
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        Compute the BM25 score of every chunk for the query.
+        """
+        chunk_refs, term_ids, term_freqs, chunk_of, lengths = self._stack()
+        n_chunks = len(chunk_refs)
+        query_ids = np.unique(np.asarray(_term_ids(tokenize(query)), dtype=np.int64))
+        if not n_chunks or not len(query_ids):
+            return np.zeros(n_chunks)
+
+        mask = np.isin(term_ids, query_ids)
+        matched_terms = term_ids[mask]
+        matched_chunks = chunk_of[mask]
+        tf = term_freqs[mask]
+
+        # Document frequency of each query term, counted in chunks
+        terms, inverse, df = np.unique(matched_terms, return_inverse=True, return_counts=True)
+        idf = np.log1p((n_chunks - df + 0.5) / (df + 0.5))
+
+        avg_len = lengths.mean() or 1.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[matched_chunks] / avg_len)
+        contributions = idf[inverse] * tf * (BM25_K1 + 1) / (tf + norm)
+        return np.bincount(matched_chunks, weights=contributions, minlength=n_chunks)
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K, token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[dict]:
+        """
+        Return the top_k most relevant chunks for the query, stopping once token_budget would be exceeded.
+        """
+        chunk_refs = self._stack()[0]
+        scores = self.score(query)
+        if not len(scores):
+            return []
+
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return []
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        results, used_tokens = [], 0
+        for i in candidates:
+            chunked, chunk_idx = chunk_refs[i]
+            tokens = chunked.tokens[chunk_idx]
+            if used_tokens + tokens > token_budget:
+                continue
+            results.append({
+                "url": chunked.url,
+                "title": chunked.title,
+                "content": chunked.chunks[chunk_idx],
+                "score": float(scores[i]),
+            })
+            used_tokens += tokens
+            if len(results) >= top_k:
+                break
+        return results
+
+
+# LRU cache of indexes keyed by the sources they index, so the sections written from the same sources share one
+_index_cache: "OrderedDict[tuple, SourceIndex]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+
+
+def get_source_index(sources: Dict[str, dict]) -> SourceIndex:
+    """
+    Return the index of a set of sources, building it only the first time this set of sources is seen.
+    """
+    key = tuple(_source_key(url, source) for url, source in sources.items())
+    with _index_cache_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+
+    index = SourceIndex(sources)
+    with _index_cache_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def retrieve(sources: Dict[str, dict], query: str, top_k: int = RETRIEVAL_TOP_K,
+             token_budget: int = RETRIEVAL_TOKEN_BUDGET) -> List[dict]:
+    """
+    Retrieve the most relevant source chunks for a query from the given sources.
+    """
+    return get_source_index(sources).search(query, top_k=top_k, token_budget=token_budget)
+
+
+def format_chunks(chunks: List[dict]) -> str:
+    """
+    Format retrieved chunks for a prompt, grouped by source so each url is listed once.
+    """
+    by_url: Dict[str, List[dict]] = {}
+    for chunk in chunks:
+        by_url.setdefault(chunk["url"], []).append(chunk)
+    return "\n\n".join(
+        f"- title: {group[0]['title']}\n  url: {url}\n" + "\n".join(f"  > {chunk['content']}" for chunk in group)
+        for url, group in by_url.items()
+    )
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from clients import get_llm
+from telemetry import span
+
+# Description: Routes every model call of the agent to a model by task. Each task (the agent's tool routing, outline
+# proposals, section drafts and section edits) has an ordered list of candidate models. The first candidate that fits
+# the prompt and is healthy is used: a candidate is skipped when the prompt is larger than its max_prompt_tokens, or
+# when its recent error rate or latency for the task is over the limits. A call that times out or fails is retried on
+# the next candidate. Every decision is recorded on a "router" span and in the router's recent decisions.
+#
+# Routes can be overridden per task with a JSON object in MODEL_ROUTES, e.g.
+#   MODEL_ROUTES='{"draft": [{"model": "gpt-4o-mini", "timeout": 90}]}'
+
+# Prompt tokens a model accepts: its context window less the room kept for its longest response. Candidates of a
+# model listed here get it as their max_prompt_tokens unless they set their own.
+MODEL_PROMPT_LIMITS = {
+    "gpt-4o-mini": 128_000 - 16_384,
+    "gpt-4o": 128_000 - 16_384,
+}
+
+DEFAULT_ROUTES = {
+    # gpt-4o-mini first for every task, as before routing, with gpt-4o as the fallback
+    "agent": [{"model": "gpt-4o-mini", "timeout": 60, "kwargs": {"temperature": 0.0}},
+              {"model": "gpt-4o", "timeout": 60, "kwargs": {"temperature": 0.0}}],
+    "outline": [{"model": "gpt-4o-mini", "timeout": 120}, {"model": "gpt-4o", "timeout": 120}],
+    "draft": [{"model": "gpt-4o-mini", "timeout": 180}, {"model": "gpt-4o", "timeout": 180}],
+    "edit": [{"model": "gpt-4o-mini", "timeout": 90}, {"model": "gpt-4o", "timeout": 90}],
+}
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))  # of the recent calls of a task and model
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))  # calls observed before a model can be skipped
+ROUTER_COOLDOWN = float(os.getenv("ROUTER_COOLDOWN", "60"))  # seconds before a skipped model is tried again
+ROUTER_WINDOW = 50
+DECISIONS_KEPT = 200
+
+logger = logging.getLogger(__name__)
+
+
+def load_routes(overrides: str = MODEL_ROUTES) -> Dict[str, List[dict]]:
+    """
+    The default routes with the tasks of the MODEL_ROUTES JSON object replaced, and the prompt limit of every
+    candidate whose model is in MODEL_PROMPT_LIMITS.
+    """
+    routes = dict(DEFAULT_ROUTES)
+    if overrides:
+        try:
+            routes.update(json.loads(overrides))
+        except ValueError as e:
+            logger.warning("Ignoring invalid MODEL_ROUTES: %s", e)
+    return {task: [{"max_prompt_tokens": MODEL_PROMPT_LIMITS.get(candidate["model"]), **candidate}
+                   for candidate in candidates]
+            for task, candidates in routes.items()}
+
+
+class ModelHealth:
+    """
+    Outcomes and latencies of the recent calls of one model for one task.
+    """
+
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.outcomes: Deque[Tuple[bool, float]] = deque(maxlen=window)
+        self.updated_at = 0.0
+
+    def record(self, ok: bool, latency: float) -> None:
+        self.outcomes.append((ok, latency))
+        self.updated_at = time.monotonic()
+
+    @property
+    def error_rate(self) -> float:
+        return sum(not ok for ok, _ in self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def latency(self) -> Optional[float]:
+        """
+        Median latency of the recent successful calls.
+        """
+        latencies = sorted(latency for ok, latency in self.outcomes if ok)
+        return latencies[len(latencies) // 2] if latencies else None
+
+
+class ModelRouter:
+    """
+    Picks the model of every call by task, prompt size and recent health, and falls back on timeouts and errors.
+    """
+
+    def __init__(self, routes: Optional[Dict[str, List[dict]]] = None):
+        self.routes = routes or load_routes()
+        self._health: Dict[Tuple[str, str], ModelHealth] = {}
+        self.decisions: Deque[dict] = deque(maxlen=DECISIONS_KEPT)
+
+    def health(self, task: str, model: str) -> ModelHealth:
+        return self._health.setdefault((task, model), ModelHealth())
+
+    def _skip_reason(self, task: str, candidate: dict, prompt_tokens: int) -> Optional[str]:
+        if candidate.get("max_prompt_tokens") and prompt_tokens > candidate["max_prompt_tokens"]:
+            return "prompt_too_large"
+        health = self.health(task, candidate["model"])
+        # An unhealthy model is tried again once it has not been called for ROUTER_COOLDOWN seconds
+        if len(health.outcomes) >= ROUTER_MIN_SAMPLES and time.monotonic() - health.updated_at < ROUTER_COOLDOWN:
+            if health.error_rate > ROUTER_MAX_ERROR_RATE:
+                return "error_rate"
+            if candidate.get("max_latency") and (health.latency or 0) > candidate["max_latency"]:
+                return "latency"
+        return None
+
+    def plan(self, task: str, prompt_tokens: int = 0) -> List[Tuple[dict, str]]:
+        """
+        Candidates of a task in the order they are tried, with the reason each one is tried. Unhealthy candidates are
+        moved to the end rather than dropped, so a call is still attempted when every candidate looks unhealthy.
+        """
+        candidates = self.routes.get(task) or self.routes["agent"]
+        preferred, demoted = [], []
+        for candidate in candidates:
+            reason = self._skip_reason(task, candidate, prompt_tokens)
+            if reason is None:
+                preferred.append((candidate, "preferred" if not preferred else "next"))
+            elif reason != "prompt_too_large":
+                demoted.append((candidate, f"demoted:{reason}"))
+        plan = preferred + demoted
+        if not plan:  # the prompt is too large for every candidate, try the one with the largest limit
+            plan = [(max(candidates, key=lambda c: c.get("max_prompt_tokens") or float("inf")), "largest_context")]
+        return plan
+
+    async def run(self, task: str, call: Callable[[Any], Awaitable[Any]], prompt_tokens: int = 0, **llm_kwargs):
+        """
+        Run call(llm) with the model picked for the task, falling back to the next candidate when it times out or
+        fails. llm_kwargs are passed to get_llm on top of the candidate's own parameters.
+        """
+        plan = self.plan(task, prompt_tokens)
+        error = None
+        for attempt, (candidate, reason) in enumerate(plan):
+            model = candidate["model"]
+            llm = get_llm(model, **{"max_retries": 1, **candidate.get("kwargs", {}), **llm_kwargs})
+            decision = {"task": task, "model": model, "reason": reason if attempt == 0 else f"fallback:{reason}",
+                        "attempt": attempt, "prompt_tokens": prompt_tokens, "time": time.time()}
+            start = time.monotonic()
+            with span(f"route.{task}", "router", model=model, reason=decision["reason"], prompt_tokens=prompt_tokens) as current:
+                try:
+                    result = await asyncio.wait_for(call(llm), candidate.get("timeout"))
+                except Exception as e:  # a cancelled call propagates and is not held against the model
+                    error = e
+                    decision["error"] = "Timeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__
+                    if current is not None:
+                        current.error_type = decision["error"]
+                decision["latency_s"] = time.monotonic() - start
+                self.health(task, model).record("error" not in decision, decision["latency_s"])
+                self.decisions.append(decision)
+            if "error" not in decision:
+                return result
+            logger.warning("Model %s failed for %s (%s), %s", model, task, decision["error"],
+                           "falling back" if attempt + 1 < len(plan) else "no fallback left")
+        raise error
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Recent error rate, median latency and number of calls of every task and model.
+        """
+        return {f"{task}/{model}": {"calls": len(health.outcomes), "error_rate": health.error_rate,
+                                    "latency_s": health.latency}
+                for (task, model), health in self._health.items()}
+
+
+model_router = ModelRouter()
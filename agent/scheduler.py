@@ -0,0 +1,175 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from langchain_core.runnables import ensure_config
+
+from telemetry import add_attribute
+
+# Description: Process wide scheduler for outgoing Tavily requests. It bounds the number of requests in flight and
+# their rate (token bucket), serves the sessions waiting for a slot round robin so one large research run cannot
+# starve the others, times out slow requests and hedges the latency tail: when a request is slower than the recent
+# p95 a second attempt is started and whichever finishes first wins.
+
+TAVILY_MAX_CONCURRENCY = int(os.getenv("TAVILY_MAX_CONCURRENCY", "16"))
+TAVILY_RATE_LIMIT = float(os.getenv("TAVILY_RATE_LIMIT", "20"))  # requests per second
+TAVILY_BURST = int(os.getenv("TAVILY_BURST", "20"))
+TAVILY_TIMEOUT = float(os.getenv("TAVILY_TIMEOUT", "30"))
+TAVILY_HEDGE_AFTER = float(os.getenv("TAVILY_HEDGE_AFTER", "2"))  # minimum delay before a hedged attempt, 0 disables
+TAVILY_MAX_ATTEMPTS = int(os.getenv("TAVILY_MAX_ATTEMPTS", "2"))
+
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+
+class RequestScheduler:
+    """
+    Concurrency, rate and fairness limits for one upstream service, with timeouts and hedged retries.
+    """
+
+    def __init__(self, max_concurrency: int = TAVILY_MAX_CONCURRENCY, rate: float = TAVILY_RATE_LIMIT,
+                 burst: int = TAVILY_BURST, timeout: float = TAVILY_TIMEOUT, hedge_after: float = TAVILY_HEDGE_AFTER,
+                 max_attempts: int = TAVILY_MAX_ATTEMPTS):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {"requests": 0, "attempts": 0, "hedged": 0, "timeouts": 0, "errors": 0}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _dispatch(self) -> None:
+        """
+        Hand free slots to the waiting sessions in round robin order, as far as the rate limit allows.
+        """
+        while self._waiters and self._in_flight < self.max_concurrency:
+            session, waiters = next(iter(self._waiters.items()))
+            while waiters and waiters[0].done():  # cancelled while waiting
+                waiters.popleft()
+            if not waiters:
+                del self._waiters[session]
+                continue
+
+            self._refill()
+            if self._tokens < 1:
+                if self._wakeup is None:
+                    self._wakeup = asyncio.get_running_loop().call_later((1 - self._tokens) / self.rate, self._on_wakeup)
+                return
+
+            self._tokens -= 1
+            self._in_flight += 1
+            waiters.popleft().set_result(None)
+            if waiters:
+                self._waiters.move_to_end(session)
+            else:
+                del self._waiters[session]
+
+    def _on_wakeup(self) -> None:
+        self._wakeup = None
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, session: str):
+        """
+        Hold one of the concurrency slots for the duration of the block.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():  # the slot was granted right as we were cancelled
+                self._release()
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Delay before a hedged attempt is started: the p95 latency of recent requests, at least hedge_after.
+        """
+        if not self.hedge_after or self.max_attempts < 2:
+            return None
+        if len(self._latencies) < LATENCY_MIN_SAMPLES:
+            return max(self.hedge_after, self.timeout / 2)
+        latencies = sorted(self._latencies)
+        return max(self.hedge_after, latencies[math.ceil(len(latencies) * 0.95) - 1])
+
+    async def _attempt(self, fn: Callable[[], Awaitable[Any]], session: str):
+        async with self.slot(session):
+            self.stats["attempts"] += 1
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(fn(), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats["timeouts"] += 1
+                raise
+            self._latencies.append(time.monotonic() - start)
+            return result
+
+    async def submit(self, fn: Callable[[], Awaitable[Any]], session: Optional[str] = None):
+        """
+        Run fn() under the limits and return its result. A failed or timed out attempt is retried, and an attempt
+        slower than hedge_delay() is raced against a second one, up to max_attempts attempts in total.
+        """
+        if session is None:
+            session = str(ensure_config().get("configurable", {}).get("thread_id", "default"))
+        self.stats["requests"] += 1
+
+        attempts = 1
+        pending = {asyncio.create_task(self._attempt(fn, session))}
+        error = None
+        try:
+            while pending:
+                delay = self.hedge_delay() if attempts < self.max_attempts else None
+                done, pending = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.stats["hedged"] += 1
+                    add_attribute("hedged_requests", 1)
+                    attempts += 1
+                    pending.add(asyncio.create_task(self._attempt(fn, session)))
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending and attempts < self.max_attempts:
+                    attempts += 1
+                    pending.add(asyncio.create_task(self._attempt(fn, session)))
+            self.stats["errors"] += 1
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+tavily_scheduler = RequestScheduler()
+
+
+def scheduler_stats() -> Dict[str, Dict[str, int]]:
+    """
+    Counters of the Tavily scheduler.
+    """
+    return {"tavily": dict(tavily_scheduler.stats)}
@@ -0,0 +1,83 @@
+from typing import Dict, Iterable, List, Optional
+
+from report_digest import content_hash
+
+# Description: Report sections keyed by idx. state["sections"] stays a list ordered by idx on the wire (the frontend
+# renders it as is), but every write goes through merge_section_lists, which is also the reducer of the sections
+# channel: sections are replaced by idx rather than by list position, so independent writers (parallel section
+# writers, speculative drafts, edits made in the frontend) update their own sections without overwriting the others.
+# Every section carries the hash of its content and a version that is bumped when the hash changes, which is what
+# change tracking (the report digest, the emitter) compares instead of the section text.
+#
+# As a missing idx only means that a writer did not touch that section, a section is deleted explicitly: a write of
+# the tombstone {"idx": n, "deleted": True} (section_tombstone) removes the section n, e.g. when the frontend deletes it.
+
+HASH_KEY = "hash"
+VERSION_KEY = "version"
+DELETED_KEY = "deleted"
+
+
+def stamp_section(section: dict, previous: Optional[dict] = None) -> dict:
+    """
+    The section with its content hash and version. The version of the previous section with the same idx is kept when
+    the content did not change, and bumped when it did.
+    """
+    section_hash = content_hash(section)
+    if previous is not None and previous.get(HASH_KEY) == section_hash:
+        version = previous.get(VERSION_KEY, 1)
+    else:
+        version = (previous.get(VERSION_KEY, 0) if previous is not None else 0) + 1
+    if section.get(HASH_KEY) == section_hash and section.get(VERSION_KEY) == version:
+        return section
+    return {**section, HASH_KEY: section_hash, VERSION_KEY: version}
+
+
+def index_sections(sections: Optional[Iterable[dict]]) -> Dict[int, dict]:
+    """
+    The sections keyed by idx, in idx order.
+    """
+    return {section["idx"]: section for section in sorted(sections or [], key=lambda sec: sec["idx"])}
+
+
+def section_tombstone(idx: int) -> dict:
+    """
+    The write that deletes the section with the given idx.
+    """
+    return {"idx": idx, DELETED_KEY: True}
+
+
+def merge_section_lists(left: Optional[List[dict]], right: Optional[List[dict]]) -> List[dict]:
+    """
+    Merge written sections into a list of sections by idx, keeping it ordered by idx. Sections of right replace the
+    sections of left with the same idx, tombstones of right delete them, the others are kept.
+    """
+    merged = index_sections(left)
+    if isinstance(right, dict):
+        right = [right]
+    changed = False
+    for section in right or []:
+        if section.get(DELETED_KEY):
+            changed = merged.pop(section["idx"], None) is not None or changed
+            continue
+        previous = merged.get(section["idx"])
+        stamped = stamp_section(section, previous)
+        if stamped is not previous and stamped != previous:
+            merged[section["idx"]] = stamped
+            changed = True
+    if not changed and left is not None:
+        return left
+    return [merged[idx] for idx in sorted(merged)]
+
+
+def section_versions(sections: Optional[Iterable[dict]]) -> Dict[int, int]:
+    """
+    The version of every section by idx, to find the sections that changed since with changed_sections.
+    """
+    return {section["idx"]: section.get(VERSION_KEY, 0) for section in sections or []}
+
+
+def changed_sections(sections: Optional[Iterable[dict]], versions: Dict[int, int]) -> List[dict]:
+    """
+    The sections whose version differs from the given versions, including sections that are new since.
+    """
+    return [section for section in sections or [] if versions.get(section["idx"]) != section.get(VERSION_KEY, 0)]
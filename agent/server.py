@@ -0,0 +1,9 @@
+from telemetry import configure_from_env
+from graph import graph
+
+# Description: Entry point of the LangGraph server (see langgraph.json). It serves the graph of graph.py and sets up
+# the telemetry exporters of TELEMETRY_EXPORTERS, which importing graph.py alone does not.
+
+configure_from_env()
+
+__all__ = ["graph"]
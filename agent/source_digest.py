@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+from blob_store import REF_KEY
+from report_digest import summarize
+from retrieval import index_sources, source_text
+from tokens import count_tokens
+
+# Description: Compact digest of every research source, used by outline_writer in place of the full source content.
+# A digest holds the source title, a short extractive summary and the key entities of the source. Digests are computed
+# when sources are ingested (in the same pass off the event loop that indexes them for retrieval), cached process wide
+# by content hash, and the outline prompt is built from them within OUTLINE_SOURCES_TOKEN_BUDGET, so the cost of an
+# outline revision does not grow with the number of sources.
+
+SOURCE_SUMMARY_CHARS = int(os.getenv("SOURCE_SUMMARY_CHARS", "300"))
+SOURCE_ENTITIES = int(os.getenv("SOURCE_ENTITIES", "8"))
+SOURCE_DIGEST_CACHE_SIZE = int(os.getenv("SOURCE_DIGEST_CACHE_SIZE", "10000"))
+OUTLINE_SOURCES_TOKEN_BUDGET = int(os.getenv("OUTLINE_SOURCES_TOKEN_BUDGET", "3000"))
+
+# Runs of capitalized words (names, organizations, places) and acronyms
+_ENTITY_RE = re.compile(r"\b(?:[A-Z][a-z0-9]+(?:[-'][A-Z]?[a-z0-9]+)*(?:\s+(?:of|de|for|and)?\s*[A-Z][a-z0-9]+)*|[A-Z]{2,6}s?)\b")
+_SENTENCE_START_RE = re.compile(r"(?:^|[.!?]\s+|\n\s*)([A-Z][a-z]+)\b")
+_ENTITY_STOPWORDS = frozenset(
+    "The A An And But Or If In On At To For Of By With From As This That These Those It Its Is Are Was Were Be We You "
+    "They He She Our Their His Her There Here What When Where Which Who How Why Not No Yes All Any Some Most More Also "
+    "However While After Before During Since Because Although Today Yesterday".split()
+)
+
+# LRU cache of digests keyed by content hash, shared by all sessions in the worker
+_digest_cache: "OrderedDict[str, dict]" = OrderedDict()
+_digest_cache_lock = threading.Lock()
+
+
+def _content_key(source: dict) -> str:
+    # Sources whose page lives in the blob store are keyed by the blob hash, without loading the blob
+    title = source.get("title") or ""
+    if source.get(REF_KEY) and not source.get("raw_content"):
+        text = f"{source[REF_KEY]['hash']}\x00{source.get('content') or ''}"
+    else:
+        text = source_text(source)
+    return hashlib.sha1(f"{title}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def extract_entities(text: str, limit: int = SOURCE_ENTITIES) -> List[str]:
+    """
+    The most frequent named entities of a text: runs of capitalized words and acronyms, without the capitalized words
+    that only start sentences.
+    """
+    sentence_starts = Counter(_SENTENCE_START_RE.findall(text))
+    counts = Counter()
+    for match in _ENTITY_RE.finditer(text):
+        words = match.group(0).split()
+        while words and words[0] in _ENTITY_STOPWORDS:  # "The International Energy Agency"
+            words.pop(0)
+        entity = " ".join(words)
+        if len(entity) < 2:
+            continue
+        counts[entity] += 1
+    for word, starts in sentence_starts.items():
+        if word in counts and " " not in word:
+            counts[word] -= starts
+    return [entity for entity, count in counts.most_common() if count > 0][:limit]
+
+
+def digest_source(url: str, source: dict) -> dict:
+    """
+    Build the digest of a source. The search snippet is summarized when there is one, the extracted page otherwise.
+    Entities are taken from the full text.
+    """
+    text = source_text(source)
+    title = source.get("title") or urlsplit(url).hostname or url
+    # Only the beginning of a page is needed for its summary
+    summary = summarize(source.get("content") or text[:SOURCE_SUMMARY_CHARS * 8], SOURCE_SUMMARY_CHARS)
+    entities = extract_entities(text)
+    entry = f"- title: {title} url: {url}\n  summary: {summary}"
+    if entities:
+        entry += f"\n  entities: {', '.join(entities)}"
+    return {"title": title, "summary": summary, "entities": entities, "text": entry, "tokens": count_tokens(entry)}
+
+
+def get_source_digest(url: str, source: dict) -> dict:
+    """
+    Return the digest of a source, computing it only the first time its content is seen.
+    """
+    key = f"{url}\x00{_content_key(source)}"
+    with _digest_cache_lock:
+        digest = _digest_cache.get(key)
+        if digest is not None:
+            _digest_cache.move_to_end(key)
+            return digest
+
+    digest = digest_source(url, source)
+    with _digest_cache_lock:
+        _digest_cache[key] = digest
+        while len(_digest_cache) > SOURCE_DIGEST_CACHE_SIZE:
+            _digest_cache.popitem(last=False)
+    return digest
+
+
+def digest_sources(sources: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    The digests of a batch of sources by url.
+    """
+    return {url: get_source_digest(url, source) for url, source in sources.items() if isinstance(source, dict)}
+
+
+def ingest_sources(sources: Dict[str, dict]) -> None:
+    """
+    Index newly added or updated sources for retrieval and compute their digests ahead of time, in one pass that is
+    run off the event loop.
+    """
+    index_sources(sources)
+    digest_sources(sources)
+
+
+def format_source_digests(sources: Dict[str, dict], digests: Dict[str, dict],
+                          token_budget: int = OUTLINE_SOURCES_TOKEN_BUDGET) -> str:
+    """
+    Format the digests of the sources for a prompt, stopping once token_budget would be exceeded. Sources with an
+    extracted page come first, then by search score.
+    """
+    ranked = sorted(digests, key=lambda url: (not sources[url].get(REF_KEY), -(sources[url].get("score") or 0)))
+    entries, used_tokens = [], 0
+    for url in ranked:
+        digest = digests[url]
+        if used_tokens + digest["tokens"] > token_budget:
+            continue
+        entries.append(digest["text"])
+        used_tokens += digest["tokens"]
+    if len(entries) < len(ranked):
+        entries.append(f"({len(ranked) - len(entries)} more sources not listed)")
+    return "\n".join(entries)
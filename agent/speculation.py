@@ -0,0 +1,169 @@
+import asyncio
+import contextvars
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableConfig, ensure_config
+
+from emitter import detached
+from telemetry import record_error, span
+from tool_state import ToolState
+from tools.section_writer import write_section
+from tools.tavily_extract import tavily_extract
+from tools.tavily_search import TavilyQuery, tavily_search
+
+# Description: Opt-in speculative work while the graph is interrupted for the proposal review. As soon as the proposal
+# is sent to the user, every section the outline writer marked as approved gets a targeted search, an extract of its
+# best new sources and, in "draft" mode, a draft written by the section writer. The results are kept in memory keyed
+# by the proposal timestamp and section. When the user approves, process_feedback_node commits the matching results
+# straight into the state and the work for rejected or edited sections is cancelled.
+#
+# SPECULATION_MODE is "off" (default), "prefetch" (search and extract only) or "draft" (also write the sections).
+# Speculative work lives in the process that ran the interrupted graph, if the resume lands on another worker the
+# sections are simply written the usual way.
+
+SPECULATION_MODE = os.getenv("SPECULATION_MODE", "off")
+SPECULATION_EXTRACT_URLS = int(os.getenv("SPECULATION_EXTRACT_URLS", "3"))
+SPECULATION_MAX_PROPOSALS = int(os.getenv("SPECULATION_MAX_PROPOSALS", "64"))
+
+SectionKey = Tuple[str, str]  # (title, description)
+
+logger = logging.getLogger(__name__)
+
+
+def _section_key(section: dict) -> SectionKey:
+    return section.get("title", ""), section.get("description", "")
+
+
+def _research_query(state: dict) -> str:
+    """
+    The user's last request, the proposal itself does not carry the research query.
+    """
+    for message in reversed(state.get("messages", [])):
+        if isinstance(message, HumanMessage) and isinstance(message.content, str):
+            return message.content
+    return state.get("title", "")
+
+
+async def _speculate(research_query: str, section: dict, idx: int, state: ToolState) -> dict:
+    """
+    Search, extract and optionally draft one section against a private copy of the state.
+    """
+    with detached(), span("speculate", "speculation", idx=idx):
+        known_urls = set(state["sources"])
+        query = TavilyQuery(query=f"{research_query} {section['title']}", topic="general", days=30)
+        await tavily_search.coroutine(sub_queries=[query], state=state)
+
+        sources = state["sources"]
+        new_urls = sorted((url for url in sources if url not in known_urls),
+                          key=lambda url: sources[url].get("score", 0), reverse=True)
+        if new_urls and SPECULATION_EXTRACT_URLS:
+            await tavily_extract.coroutine(urls=new_urls[:SPECULATION_EXTRACT_URLS], state=state)
+
+        draft = None
+        if SPECULATION_MODE == "draft":
+            draft = await write_section(research_query, section["title"], idx, state)
+        sources = state["sources"]
+        return {"sources": {url: sources[url] for url in new_urls if url in sources}, "section": draft}
+
+
+class Speculator:
+    """
+    Runs and tracks the speculative work of pending proposals, keyed by (thread id, proposal timestamp).
+    """
+
+    def __init__(self, mode: str = SPECULATION_MODE, max_proposals: int = SPECULATION_MAX_PROPOSALS):
+        self.mode = mode
+        self.max_proposals = max_proposals
+        self._proposals: "OrderedDict[tuple, Dict[SectionKey, asyncio.Task]]" = OrderedDict()
+        self.stats = {"started": 0, "committed": 0, "cancelled": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode in ("prefetch", "draft")
+
+    @staticmethod
+    def _proposal_key(config: RunnableConfig, proposal: dict) -> tuple:
+        thread_id = ensure_config(config).get("configurable", {}).get("thread_id")
+        return thread_id, proposal.get("timestamp")
+
+    def start(self, config: RunnableConfig, state: dict) -> None:
+        """
+        Start the speculative work for the approved sections of the pending proposal. Does nothing when it was already
+        started, process_feedback_node runs again from the top when the graph resumes.
+        """
+        proposal = state.get("proposal") or {}
+        key = self._proposal_key(config, proposal)
+        if not self.enabled or not proposal.get("timestamp") or key in self._proposals:
+            return
+
+        sections = [section for section in (proposal.get("sections") or {}).values()
+                    if isinstance(section, dict) and section.get("approved") and section.get("title")]
+        research_query = _research_query(state)
+        outline = {f"section{i}": {"title": s["title"], "description": s.get("description", "")}
+                   for i, s in enumerate(sections)}
+
+        tasks = {}
+        for idx, section in enumerate(sections):
+            # Every section works on its own copy of the state, nothing leaks into the checkpointed state
+            private_state = ToolState({
+                "sources": dict(state.get("sources") or {}),
+                "outline": outline,
+                "sections": [],
+                "logs": [],
+            })
+            # Run detached from the interrupted graph run, its callbacks are gone by the time the work finishes
+            tasks[_section_key(section)] = asyncio.create_task(
+                _speculate(research_query, section, idx, private_state), context=contextvars.Context()
+            )
+        self.stats["started"] += len(tasks)
+
+        self._proposals[key] = tasks
+        while len(self._proposals) > self.max_proposals:
+            self._cancel(self._proposals.popitem(last=False)[1].values())
+
+    async def commit(self, config: RunnableConfig, proposal: dict, outline: Optional[dict]) -> List[dict]:
+        """
+        Collect the speculative results of the sections of the approved outline, waiting for the ones still running,
+        and cancel the rest. Returns one result per outline section that has one, with the section's idx.
+        """
+        tasks = self._proposals.pop(self._proposal_key(config, proposal or {}), None)
+        if not tasks:
+            return []
+
+        wanted = {_section_key(section): idx for idx, section in enumerate((outline or {}).values())}
+        self._cancel(task for key, task in tasks.items() if key not in wanted)
+
+        loop = asyncio.get_running_loop()
+        results = []
+        for key, task in tasks.items():
+            if key not in wanted or task.get_loop() is not loop:
+                continue
+            try:
+                result = await task
+            except Exception as e:
+                self.stats["failed"] += 1
+                record_error(e)
+                logger.warning("Speculative work for the %s section failed: %s", key[0], e)
+                continue
+            self.stats["committed"] += 1
+            results.append({**result, "idx": wanted[key]})
+        return results
+
+    def cancel(self, config: RunnableConfig, proposal: dict) -> None:
+        """
+        Cancel all the speculative work of a proposal, e.g. when it was rejected.
+        """
+        self._cancel((self._proposals.pop(self._proposal_key(config, proposal or {}), None) or {}).values())
+
+    def _cancel(self, tasks) -> None:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+                self.stats["cancelled"] += 1
+
+
+speculator = Speculator()
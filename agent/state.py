@@ -2,15 +2,19 @@ from langchain_core.messages import AnyMessage
 from langgraph.graph import add_messages
 from typing import TypedDict, Dict, Union, List, Annotated
 from copilotkit import CopilotKitState # extends MessagesState
+from sections import merge_section_lists
 
 class ResearchState(CopilotKitState):
     title: str
     proposal: Dict[str, Union[str, bool, Dict[str, Union[str, bool]]]]  # Stores proposed structure before user approval
     outline: dict
-    sections: List[dict]  # list of dicts with 'title','content',and 'idx'
+    sections: Annotated[List[dict], merge_section_lists]  # list of dicts with 'title','content','idx', 'hash' and 'version', merged by idx
+    digest: Dict[str, dict]  # per-section 'title', 'summary', 'hash' and 'length', keyed by idx
+    history_summary: dict  # running summary of the conversation turns folded out of the model's context
     footnotes: str
     sources: Dict[str, Dict[str, Union[str, float]]]
     tool: str
     logs: List[dict]  # list of dicts logs to be sent to frontend with 'message', 'status'
+    emit_raw_content: bool  # set by the frontend to receive the sources' raw_content in emitted state
 
 
@@ -0,0 +1,201 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from blob_store import REF_KEY, store_raw_content
+from dedup import ALTERNATE_URLS_KEY
+from telemetry import span
+from tool_state import assign_key
+from urls import canonicalize_url
+
+# Description: Per-session memory budget of the research state. Nothing in the state was bounded: every tool appends
+# to the logs, every search and extract adds sources. The budget is applied whenever the graph commits tool results:
+# - logs are a ring of the STATE_MAX_LOGS most recent entries;
+# - sources are capped to STATE_MAX_SOURCES. Sources cited by a written section and extracted pages are kept, the
+#   others are evicted lowest search score first, oldest first. Evicted sources stay in the knowledge store, where
+#   knowledge_search finds them again;
+# - raw_content held in state over RAW_CONTENT_SPILL_BYTES is spilled to the blob store.
+# The size of every session's state is recorded on a "state_budget" span and in the worker's session stats, which is
+# what worker memory can be sized against. It is measured incrementally: a commit only measures the keys it changed and
+# the messages added since the session's previous measurement, and every STATE_SIZE_FULL_EVERY commits the whole state
+# is measured again, to catch up with the changes made elsewhere (the model node, edits made in the frontend). The conversation itself is not trimmed, the frontend renders it; history.py
+# bounds what of it is sent to the model.
+
+STATE_MAX_LOGS = int(os.getenv("STATE_MAX_LOGS", "50"))
+STATE_MAX_SOURCES = int(os.getenv("STATE_MAX_SOURCES", "200"))
+RAW_CONTENT_SPILL_BYTES = int(os.getenv("RAW_CONTENT_SPILL_BYTES", "4096"))
+SESSION_STATS_KEPT = int(os.getenv("SESSION_STATS_KEPT", "1000"))
+STATE_SIZE_FULL_EVERY = int(os.getenv("STATE_SIZE_FULL_EVERY", "20"))  # commits between full measurements
+
+# State keys whose serialized size is measured, the messages are measured by their content
+MEASURED_KEYS = ("sources", "sections", "logs", "digest", "proposal", "outline", "history_summary")
+
+_URL_RE = re.compile(r"https?://[^\s)\]>\"'<]+")
+
+logger = logging.getLogger(__name__)
+
+# Size of the state of the most recently active sessions of the worker, by thread id
+_session_stats: "OrderedDict[str, dict]" = OrderedDict()
+_session_stats_lock = threading.Lock()
+
+
+def _canonical(url: str) -> str:
+    try:
+        return canonicalize_url(url)
+    except ValueError:  # malformed URL, e.g. an invalid port
+        return url
+
+
+def bound_logs(logs: Optional[List[dict]], max_logs: int = STATE_MAX_LOGS) -> List[dict]:
+    """
+    The most recent max_logs log entries.
+    """
+    logs = logs or []
+    return logs if len(logs) <= max_logs else logs[-max_logs:]
+
+
+def cited_urls(sections: Optional[List[dict]]) -> Set[str]:
+    """
+    Canonical form of the URLs referenced by the written sections, in their content or footnotes.
+    """
+    cited = set()
+    for section in sections or []:
+        for text in (section.get("content") or "", section.get("footer") or ""):
+            cited.update(_canonical(url.rstrip(".,;:")) for url in _URL_RE.findall(text))
+    return cited
+
+
+def _is_kept(url: str, source: dict, cited: Set[str]) -> bool:
+    if source.get(REF_KEY) or source.get("raw_content"):
+        return True
+    return any(_canonical(alias) in cited for alias in (url, *source.get(ALTERNATE_URLS_KEY, [])))
+
+
+def evict_sources(sources: Dict[str, dict], sections: Optional[List[dict]],
+                  max_sources: int = STATE_MAX_SOURCES) -> Tuple[Dict[str, dict], List[str]]:
+    """
+    Cap the number of sources to max_sources. Sources cited by a section and extracted pages are never evicted, the
+    other sources are evicted lowest search score first, then oldest first. Returns the sources and the evicted URLs.
+    """
+    if len(sources) <= max_sources:
+        return sources, []
+    cited = cited_urls(sections)
+    candidates = [(source.get("score") or 0, position, url)
+                  for position, (url, source) in enumerate(sources.items())
+                  if not (isinstance(source, dict) and _is_kept(url, source, cited))]
+    evicted = {url for _, _, url in sorted(candidates)[:len(sources) - max_sources]}
+    return {url: source for url, source in sources.items() if url not in evicted}, sorted(evicted)
+
+
+def spill_raw_content(sources: Dict[str, dict], threshold: int = RAW_CONTENT_SPILL_BYTES) -> Tuple[Dict[str, dict], int]:
+    """
+    Move raw_content larger than threshold out of the sources into the blob store. Returns the sources and the number
+    of sources spilled. Spilled sources are copied, the given ones are not modified.
+    """
+    spilled = {url: store_raw_content({**source}, source["raw_content"])
+               for url, source in sources.items()
+               if isinstance(source, dict) and len(source.get("raw_content") or "") > threshold}
+    return ({**sources, **spilled} if spilled else sources), len(spilled)
+
+
+def _message_chars(message) -> int:
+    content = message.get("content") if isinstance(message, Mapping) else getattr(message, "content", "")
+    return len(content) if isinstance(content, str) else len(json.dumps(content, default=str))
+
+
+def state_size(state: Mapping, previous: Optional[dict] = None, changed: Optional[Iterable[str]] = None) -> dict:
+    """
+    Number of entries and approximate serialized bytes of the parts of a state. Given the previous size of the same
+    state and the keys changed since, only the changed keys and the messages added since are measured.
+    """
+    messages = state.get("messages") or []
+    if previous is None or changed is None:
+        previous, keys = {}, MEASURED_KEYS
+    else:
+        keys = [key for key in MEASURED_KEYS if key in set(changed)]
+    sizes = dict(previous.get("bytes_by_key") or {})
+    for key in keys:
+        if state.get(key):
+            sizes[key] = len(json.dumps(state.get(key), default=str))
+        else:
+            sizes.pop(key, None)
+    measured = previous.get("messages", 0)
+    if previous and measured <= len(messages):
+        sizes["messages"] = sizes.get("messages", 0) + sum(_message_chars(message) for message in messages[measured:])
+    else:
+        sizes["messages"] = sum(_message_chars(message) for message in messages)
+    return {
+        "bytes": sum(sizes.values()),
+        "bytes_by_key": sizes,
+        "messages": len(messages),
+        "sources": len(state.get("sources") or {}),
+        "sections": len(state.get("sections") or []),
+        "logs": len(state.get("logs") or []),
+        "commits": previous.get("commits", 0) + 1,
+    }
+
+
+def apply_budget(state, session_id: Optional[str] = None, changed: Optional[Iterable[str]] = None) -> dict:
+    """
+    Apply the budget to a state, assigning the keys it changes, and record the size of the session's state. Given the
+    keys the commit changed, the size is measured from the session's previous size. Returns the size with the number of
+    evicted sources, spilled sources and dropped log entries. Blocking (blob store writes, state serialization), run it
+    off the event loop.
+    """
+    with span("state_budget", "state") as current:
+        changed = None if changed is None else set(changed)
+        logs = state.get("logs") or []
+        if len(logs) > STATE_MAX_LOGS:
+            assign_key(state, "logs", bound_logs(logs, STATE_MAX_LOGS))
+            if changed is not None:
+                changed.add("logs")
+
+        sources, spilled = spill_raw_content(state.get("sources") or {})
+        sources, evicted = evict_sources(sources, state.get("sections"), STATE_MAX_SOURCES)
+        if spilled or evicted:
+            assign_key(state, "sources", sources)
+            if changed is not None:
+                changed.add("sources")
+
+        previous = None
+        if session_id is not None and changed is not None:
+            with _session_stats_lock:
+                previous = _session_stats.get(session_id)
+        if previous is not None and previous.get("commits", 0) % max(STATE_SIZE_FULL_EVERY, 1) == 0:
+            previous = None
+        size = state_size(state, previous, changed)
+        size.update(evicted_sources=len(evicted), spilled_sources=spilled,
+                    dropped_logs=max(0, len(logs) - STATE_MAX_LOGS))
+        if current is not None:
+            current.attributes.update({k: v for k, v in size.items() if isinstance(v, int)})
+        if evicted:
+            logger.info("Evicted %d sources from session %s, over the budget of %d sources",
+                        len(evicted), session_id, STATE_MAX_SOURCES)
+
+    if session_id is not None:
+        with _session_stats_lock:
+            _session_stats[session_id] = size
+            _session_stats.move_to_end(session_id)
+            while len(_session_stats) > SESSION_STATS_KEPT:
+                _session_stats.popitem(last=False)
+    return size
+
+
+def session_stats() -> dict:
+    """
+    Size of the state of the most recently active sessions of the worker, and their total and largest size.
+    """
+    with _session_stats_lock:
+        sessions = dict(_session_stats)
+    sizes = [size["bytes"] for size in sessions.values()]
+    return {
+        "sessions": len(sessions),
+        "total_bytes": sum(sizes),
+        "max_bytes": max(sizes, default=0),
+        "by_session": sessions,
+    }
@@ -0,0 +1,330 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+# Description: Lightweight tracing of graph nodes, tools, LLM calls and Tavily calls. Every unit of work is recorded as
+# a span with its duration, token counts, cache hits, emitted state bytes and error type, and handed to pluggable
+# exporters: JSONL to disk, a Prometheus text endpoint, or OpenTelemetry spans.
+#
+# Exporters are configured with TELEMETRY_EXPORTERS, a comma separated list of "jsonl", "prometheus" and "otel", when
+# an entry point calls configure_from_env(): server.py for the LangGraph server, batch.py and benchmarks/run.py.
+# Importing the graph does not start any exporter. Nothing is recorded when no exporter is configured.
+
+TELEMETRY_EXPORTERS = os.getenv("TELEMETRY_EXPORTERS", "")
+TELEMETRY_JSONL_PATH = os.getenv("TELEMETRY_JSONL_PATH", ".cache/telemetry.jsonl")
+TELEMETRY_PROMETHEUS_PORT = int(os.getenv("TELEMETRY_PROMETHEUS_PORT", "9464"))
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Span:
+    """
+    A timed unit of work. Attributes hold the measurements, e.g. prompt_tokens, cache_hits or emitted_bytes.
+    """
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "start_time", "end_time", "attributes",
+                 "error_type")
+
+    def __init__(self, name: str, kind: str, parent: Optional["Span"] = None, attributes: Optional[dict] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start_time = time.time()
+        self.end_time = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error_type: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time or time.time()) - self.start_time
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_s": self.duration,
+            "error_type": self.error_type,
+            "attributes": self.attributes,
+        }
+
+
+class JsonlExporter:
+    """
+    Appends every finished span as a JSON line to a file.
+    """
+
+    def __init__(self, path: str = TELEMETRY_JSONL_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+
+class PrometheusExporter:
+    """
+    Aggregates spans into Prometheus counters and duration histograms, served in the text exposition format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations: Dict[tuple, List[float]] = {}
+        self._counters: Dict[tuple, float] = {}
+
+    def export(self, span: Span):
+        labels = (span.kind, span.name)
+        with self._lock:
+            histogram = self._durations.setdefault(labels, [0] * len(DURATION_BUCKETS) + [0, 0.0])
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if span.duration <= bound:
+                    histogram[i] += 1
+            histogram[-2] += 1
+            histogram[-1] += span.duration
+            if span.error_type:
+                key = ("research_agent_errors_total", labels + (span.error_type,))
+                self._counters[key] = self._counters.get(key, 0) + 1
+            for attribute in ("prompt_tokens", "completion_tokens", "cache_hits", "emitted_bytes"):
+                if isinstance(span.attributes.get(attribute), (int, float)):
+                    key = (f"research_agent_{attribute}_total", labels)
+                    self._counters[key] = self._counters.get(key, 0) + span.attributes[attribute]
+
+    def render(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = ["# TYPE research_agent_span_duration_seconds histogram"]
+        with self._lock:
+            for (kind, name), histogram in sorted(self._durations.items()):
+                labels = f'kind="{kind}",name="{name}"'
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f'research_agent_span_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'research_agent_span_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram[-2]}')
+                lines.append(f"research_agent_span_duration_seconds_count{{{labels}}} {histogram[-2]}")
+                lines.append(f"research_agent_span_duration_seconds_sum{{{labels}}} {histogram[-1]}")
+            for (metric, labels), value in sorted(self._counters.items()):
+                label_text = f'kind="{labels[0]}",name="{labels[1]}"'
+                if len(labels) > 2:
+                    label_text += f',error_type="{labels[2]}"'
+                lines.append(f"{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = TELEMETRY_PROMETHEUS_PORT) -> ThreadingHTTPServer:
+        """
+        Serve the metrics on http://0.0.0.0:port/metrics from a daemon thread.
+        """
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render().encode("utf-8")
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.end_headers()
+                if self.path == "/metrics":
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class OpenTelemetryExporter:
+    """
+    Re-emits finished spans through the OpenTelemetry API, so they reach whatever SDK and exporter the process has
+    configured. Requires the opentelemetry-api package.
+    """
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._tracer = trace.get_tracer("research-agent")
+
+    def export(self, span: Span):
+        attributes = {k: v for k, v in span.attributes.items() if isinstance(v, (str, bool, int, float))}
+        attributes.update({"research_agent.kind": span.kind, "research_agent.span_id": span.span_id,
+                           "research_agent.trace_id": span.trace_id})
+        if span.parent_id:
+            attributes["research_agent.parent_id"] = span.parent_id
+        if span.error_type:
+            attributes["error.type"] = span.error_type
+        otel_span = self._tracer.start_span(span.name, start_time=int(span.start_time * 1e9), attributes=attributes)
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+
+_exporters: list = []
+_configured = False
+_current_span: ContextVar[Optional[Span]] = ContextVar("research_agent_span", default=None)
+
+
+def add_exporter(exporter) -> None:
+    _exporters.append(exporter)
+
+
+def is_enabled() -> bool:
+    return bool(_exporters)
+
+
+def configure_from_env(exporters: str = TELEMETRY_EXPORTERS) -> None:
+    """
+    Set up the exporters listed in TELEMETRY_EXPORTERS. Only the first call of a process sets them up.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    for name in filter(None, (part.strip() for part in exporters.split(","))):
+        if name == "jsonl":
+            add_exporter(JsonlExporter())
+        elif name == "prometheus":
+            exporter = PrometheusExporter()
+            exporter.serve()
+            add_exporter(exporter)
+        elif name == "otel":
+            add_exporter(OpenTelemetryExporter())
+        else:
+            raise ValueError(f"Unknown telemetry exporter: {name}")
+
+
+def _finish(span: Span):
+    span.end_time = time.time()
+    for exporter in _exporters:
+        try:
+            exporter.export(span)
+        except Exception as e:  # an exporter failure must never fail the research run
+            logger.warning("Telemetry exporter %s failed: %s", type(exporter).__name__, e)
+
+
+@contextmanager
+def span(name: str, kind: str, **attributes):
+    """
+    Record the enclosed block as a span, nested under the current span. Yields None when telemetry is disabled.
+    """
+    if not _exporters:
+        yield None
+        return
+
+    current = Span(name, kind, parent=_current_span.get(), attributes=attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        # Interrupts are how LangGraph pauses for human feedback, they are not errors
+        if type(e).__name__ in ("GraphInterrupt", "NodeInterrupt"):
+            current.attributes["interrupted"] = True
+        elif current.error_type is None:
+            current.error_type = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(current)
+
+
+def traced(name: str, kind: str):
+    """
+    Decorator recording every call of an async function as a span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_attribute(key: str, value: float) -> None:
+    """
+    Add value to a numeric attribute of the current span, e.g. cache_hits or emitted_bytes.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.attributes[key] = current.attributes.get(key, 0) + value
+
+
+def record_error(error: BaseException) -> None:
+    """
+    Record an error that was handled (and not re-raised) on the current span.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.error_type = type(error).__name__
+
+
+class LLMTelemetryHandler(AsyncCallbackHandler):
+    """
+    LangChain callback recording every chat model call as an "llm" span with its token usage.
+    """
+
+    def __init__(self):
+        self._spans: Dict[UUID, Span] = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        if _exporters:
+            model = (kwargs.get("invocation_params") or {}).get("model") or (kwargs.get("metadata") or {}).get("ls_model_name", "llm")
+            self._spans[run_id] = Span(str(model), "llm", parent=_current_span.get())
+
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+        if prompt_tokens is None:
+            message = getattr(response.generations[0][0], "message", None) if response.generations and response.generations[0] else None
+            metadata = getattr(message, "usage_metadata", None) or {}
+            prompt_tokens, completion_tokens = metadata.get("input_tokens"), metadata.get("output_tokens")
+        if prompt_tokens is not None:
+            current.attributes.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens or 0)
+        _finish(current)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            current.error_type = type(error).__name__
+            _finish(current)
+
+
+class TracedTavilyClient:
+    """
+    Wraps a Tavily client so that every search and extract call is recorded as a "tavily" span.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    async def search(self, *args, **kwargs):
+        with span("tavily.search", "tavily", topic=kwargs.get("topic")):
+            return await self._client.search(*args, **kwargs)
+
+    async def extract(self, *args, **kwargs):
+        with span("tavily.extract", "tavily", urls=len(kwargs.get("urls") or [])):
+            return await self._client.extract(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The agent's modules import each other by their flat names, as when the graph is served from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
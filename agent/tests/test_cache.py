@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+
+from cache import MISSING, TieredCache
+
+
+def test_concurrent_misses_share_one_fetch():
+    cache = TieredCache("test", path=None)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"answer": 42}
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("key", fetch, ttl=60) for _ in range(5)))
+
+    assert asyncio.run(run()) == [{"answer": 42}] * 5
+    assert len(calls) == 1
+    assert cache.stats["coalesced"] == 4
+
+
+def test_batch_fetches_only_missing_keys():
+    cache = TieredCache("test", path=None)
+    requested = []
+
+    async def fetch_many(keys):
+        requested.append(keys)
+        return {key: key.upper() for key in keys if key != "absent"}
+
+    async def run():
+        await cache.set("a", "cached", ttl=60)
+        return await cache.get_many_or_fetch(["a", "b", "absent", "b"], fetch_many, ttl=60)
+
+    assert asyncio.run(run()) == {"a": "cached", "b": "B", "absent": None}
+    assert requested == [["b", "absent"]]
+    assert asyncio.run(cache.get("absent")) is MISSING
+
+
+def test_fetch_error_reaches_every_waiter():
+    cache = TieredCache("test", path=None)
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("key", fetch, ttl=60) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert not cache._inflight
+
+
+def test_disk_tier_prunes_expired_and_excess_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr("cache.CACHE_PRUNE_INTERVAL", 5)
+    path = str(tmp_path / "cache.sqlite3")
+    cache = TieredCache("test", path=path, max_disk_entries=3)
+
+    async def run():
+        await cache.set("expired", 1, ttl=-1)
+        for i in range(4):
+            await cache.set(f"key{i}", i, ttl=60 + i)
+
+    asyncio.run(run())
+    keys = [row[0] for row in cache._connect().execute("SELECT key FROM cache_test ORDER BY key")]
+    assert keys == ["key1", "key2", "key3"]
+    assert cache.stats["pruned"] == 2
+
+    reopened = TieredCache("test", path=path)
+    assert asyncio.run(reopened.get("key3")) == 3
+    assert asyncio.run(reopened.get("key0")) is MISSING
+
+
+def test_cancelled_fetch_does_not_block_waiters():
+    cache = TieredCache("test", path=None)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05 if len(calls) == 1 else 0)
+        return len(calls)
+
+    async def run():
+        fetcher = asyncio.create_task(cache.get_or_fetch("key", fetch, ttl=60))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_fetch("key", fetch, ttl=60))
+        await asyncio.sleep(0.01)
+        fetcher.cancel()
+        result = await asyncio.wait_for(waiter, 1)
+        assert fetcher.cancelled()
+        return result
+
+    assert asyncio.run(run()) == 2
+    assert not cache._inflight
+
+
+def test_cancelled_waiter_does_not_cancel_the_fetch():
+    cache = TieredCache("test", path=None)
+
+    async def fetch():
+        await asyncio.sleep(0.03)
+        return "value"
+
+    async def run():
+        fetcher = asyncio.create_task(cache.get_or_fetch("key", fetch, ttl=60))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_fetch("key", fetch, ttl=60))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        return await fetcher
+
+    assert asyncio.run(run()) == "value"
@@ -0,0 +1,151 @@
+import copy
+import operator
+from typing import Annotated, List, TypedDict
+
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.graph import StateGraph
+
+from checkpoint_entries import SEGMENT_PREFIX, EntryCheckpointSaver, ResearchGraph, wrap_checkpointer
+
+
+class State(TypedDict):
+    sources: dict
+    sections: Annotated[List[dict], operator.add]
+    messages: Annotated[List[str], operator.add]
+
+
+def _source(i: int) -> dict:
+    return {"url": f"https://example.com/{i}", "title": f"Source {i}", "content": f"Content of source {i}. " * 80}
+
+
+class InlineSaver(BaseCheckpointSaver):
+    """
+    Checkpointer that stores the channel values inline with each checkpoint, not by (channel, version).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.checkpoints = {}
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        saved = {"configurable": {"thread_id": thread_id, "checkpoint_ns": "", "checkpoint_id": checkpoint["id"]}}
+        parent = config if "checkpoint_id" in config["configurable"] else None
+        self.checkpoints.setdefault(thread_id, []).append(
+            CheckpointTuple(saved, copy.deepcopy(checkpoint), metadata, parent, []))
+        return saved
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        pass
+
+    def get_tuple(self, config):
+        saved = self.checkpoints.get(config["configurable"]["thread_id"]) or [None]
+        checkpoint_id = config["configurable"].get("checkpoint_id")
+        if checkpoint_id is None:
+            return saved[-1]
+        return next(t for t in saved if t.config["configurable"]["checkpoint_id"] == checkpoint_id)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        yield from reversed(self.checkpoints.get(config["configurable"]["thread_id"], []))
+
+
+def _graph(checkpointer):
+    def search(state):
+        sources = dict(state["sources"])
+        start = len(sources)
+        sources.update({f"https://example.com/{i}": _source(i) for i in range(start, start + 3)})
+        return {"sources": sources, "messages": ["searched"]}
+
+    def write(state):
+        idx = len(state["sections"])
+        return {"sections": [{"idx": idx, "title": f"Section {idx}", "content": "Text. " * 300}],
+                "messages": ["wrote"]}
+
+    workflow = StateGraph(State)
+    workflow.add_node("search", search)
+    workflow.add_node("write", write)
+    workflow.set_entry_point("search")
+    workflow.add_edge("search", "write")
+    workflow.set_finish_point("write")
+    return ResearchGraph(**workflow.compile(checkpointer=checkpointer).__dict__)
+
+
+def _segments(memory: MemorySaver) -> list:
+    return [key for key in memory.blobs if key[2].startswith(SEGMENT_PREFIX)]
+
+
+def test_state_round_trips_through_entries():
+    memory = MemorySaver()
+    graph = _graph(memory)
+    assert isinstance(graph.checkpointer, EntryCheckpointSaver)
+    config = {"configurable": {"thread_id": "t1"}}
+    graph.invoke({"sources": {}, "sections": [], "messages": []}, config)
+    graph.invoke({"messages": ["again"]}, config)
+
+    values = graph.get_state(config).values
+    assert values["sources"] == {f"https://example.com/{i}": _source(i) for i in range(6)}
+    assert [section["idx"] for section in values["sections"]] == [0, 1]
+    assert values["messages"] == ["searched", "wrote", "again", "searched", "wrote"]
+
+    # Every entry is written once: the sources and sections channels only hold their hashes
+    stored = [memory.blobs[key] for key in memory.blobs if key[2] == "sources"]
+    assert all(len(data) < 2000 for _, data in stored)
+    assert len(_segments(memory)) == 4
+
+    history = list(graph.get_state_history(config))
+    assert all(not any(k.startswith(SEGMENT_PREFIX) for k in state.values) for state in history)
+    assert len(history[-2].values["sources"]) == 0
+
+
+def test_a_new_saver_reads_entries_written_by_another():
+    memory = MemorySaver()
+    config = {"configurable": {"thread_id": "t1"}}
+    _graph(memory).invoke({"sources": {}, "sections": [], "messages": []}, config)
+
+    other = EntryCheckpointSaver(memory)
+    checkpoint = other.get_tuple(config).checkpoint
+    assert len(checkpoint["channel_values"]["sources"]) == 3
+    assert not any(channel.startswith(SEGMENT_PREFIX) for channel in checkpoint["channel_versions"])
+
+
+def test_copies_of_the_graph_share_one_wrapper_and_deleting_a_thread_deletes_its_entries():
+    memory = MemorySaver()
+    graph = _graph(None)
+    served = graph.copy(update={"checkpointer": memory})
+    assert served.checkpointer is wrap_checkpointer(memory)
+    assert served.copy().checkpointer is served.checkpointer
+
+    config = {"configurable": {"thread_id": "t1"}}
+    served.invoke({"sources": {}, "sections": [], "messages": []}, config)
+    served.invoke({"sources": {}, "sections": [], "messages": []}, {"configurable": {"thread_id": "t2"}})
+    assert {key[0] for key in _segments(memory)} == {"t1", "t2"}
+
+    served.checkpointer.delete_thread("t1")
+    assert {key[0] for key in _segments(memory)} == {"t2"}
+    assert served.get_state(config).values == {}
+
+
+def _second_checkpoint_keeps_unchanged_segments(checkpointer):
+    graph = _graph(checkpointer)
+    config = {"configurable": {"thread_id": "t1"}}
+    graph.invoke({"sources": {}, "sections": [], "messages": []}, config)
+    first = graph.get_state(config).values
+
+    # Only the new sources and section are in a new segment, the others are still referenced from the older ones
+    graph.invoke({"messages": ["again"]}, config)
+    values = EntryCheckpointSaver(graph.checkpointer.inner).get_tuple(config).checkpoint["channel_values"]
+    assert values["sources"] == {**first["sources"], **{f"https://example.com/{i}": _source(i) for i in range(3, 6)}}
+    assert [section["idx"] for section in values["sections"]] == [0, 1]
+
+
+def test_unchanged_segments_are_loaded_from_blob_checkpointers():
+    _second_checkpoint_keeps_unchanged_segments(MemorySaver())
+
+
+def test_unchanged_segments_are_stored_by_inline_checkpointers():
+    saver = InlineSaver()
+    _second_checkpoint_keeps_unchanged_segments(saver)
+    latest = saver.checkpoints["t1"][-1].checkpoint
+    segments = [channel for channel in latest["channel_values"] if channel.startswith(SEGMENT_PREFIX)]
+    assert len(segments) == 4
@@ -0,0 +1,60 @@
+import numpy as np
+
+import dedup
+from dedup import ALTERNATE_URLS_KEY, SIMHASH_KEY, SimHashIndex, SourceDeduper, simhash
+
+ARTICLE = (
+    "The harbour authority reported record cargo volumes for the third quarter, driven by container traffic from "
+    "Asian routes and a recovery of bulk shipments. Officials said dredging works finished in June allowed larger "
+    "vessels to berth, while rail connections to inland terminals reduced truck congestion around the port. Analysts "
+    "expect growth to slow next year as freight rates normalize, although new cold storage warehouses should attract "
+    "perishable goods. Labour unions welcomed the hiring of two hundred dock workers but warned about overtime. The "
+    "city council approved a budget for electric cranes and shore power, aiming to cut emissions from idling ships."
+)
+
+
+def test_url_variants_are_folded_into_the_first_source():
+    sources = {}
+    deduper = SourceDeduper(sources)
+    assert deduper.add("https://example.com/a", {"url": "https://example.com/a", "content": "short"})
+    assert deduper.add("http://www.example.com/a?utm_source=x", {"content": "short"}) is None
+    assert sources["https://example.com/a"][ALTERNATE_URLS_KEY] == ["http://www.example.com/a?utm_source=x"]
+
+
+def test_near_duplicate_content_is_folded():
+    sources = {}
+    deduper = SourceDeduper(sources)
+    assert deduper.add("https://one.example/story", {"content": ARTICLE})
+    assert deduper.add("https://two.example/copy", {"content": ARTICLE + " Updated."}) is None
+    assert list(sources) == ["https://one.example/story"]
+
+
+def test_sources_are_copied_not_modified():
+    existing = {"content": ARTICLE}
+    new = {"content": "A different article about the quarterly results of an airline " * 6}
+    state_sources = {"https://one.example/story": existing}
+    sources = dict(state_sources)
+    deduper = SourceDeduper(sources)
+    deduper.add("https://other.example/news", new)
+    deduper.add("https://one.example/story?utm_medium=email", {"content": ARTICLE})
+
+    assert SIMHASH_KEY not in existing and SIMHASH_KEY not in new
+    assert ALTERNATE_URLS_KEY not in existing
+    assert state_sources == {"https://one.example/story": {"content": ARTICLE}}
+    assert SIMHASH_KEY in sources["https://one.example/story"]
+    assert SIMHASH_KEY in sources["https://other.example/news"]
+
+
+def test_popcount_fallback_matches_bitwise_count(monkeypatch):
+    values = np.array([0, 1, 0xFF, 2 ** 63 + 5, 2 ** 64 - 1], dtype=np.uint64)
+    expected = [0, 1, 8, 3, 64]
+    assert dedup._popcount(values).tolist() == expected
+    monkeypatch.delattr(np, "bitwise_count", raising=False)
+    assert dedup._popcount(values).tolist() == expected
+
+    index = SimHashIndex(capacity=1)
+    signature = simhash(ARTICLE)
+    index.add("a", signature ^ 0b101)
+    index.add("b", signature ^ 0xFFFF)
+    assert index.find(signature) == "a"
+    assert index.find(signature, max_distance=1) is None
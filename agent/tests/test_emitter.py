@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import emitter
+from emitter import StateEmitter
+
+CONFIG = {"configurable": {"thread_id": "test"}}
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    payloads = []
+
+    async def record(config, payload):
+        payloads.append(payload)
+
+    monkeypatch.setattr(emitter, "copilotkit_emit_state", record)
+    return payloads
+
+
+def _state(step, **extra):
+    return {"messages": [step], "logs": [{"message": f"step {step}", "done": False}], **extra}
+
+
+def test_unchanged_state_is_not_emitted_again(sent):
+    async def run():
+        state_emitter = StateEmitter(window=0)
+        await state_emitter.emit(CONFIG, _state(1))
+        await state_emitter.emit(CONFIG, _state(1))
+        # Messages are not emitted, a state that only differs by its messages is unchanged
+        await state_emitter.emit(CONFIG, {**_state(1), "messages": [2]})
+        await state_emitter.emit(CONFIG, _state(2))
+        return state_emitter
+
+    state_emitter = asyncio.run(run())
+    assert [payload["logs"][0]["message"] for payload in sent] == ["step 1", "step 2"]
+    assert "messages" not in sent[0]
+    assert state_emitter.skipped == 2 and state_emitter.last_changed_keys == ["logs"]
+
+
+def test_forced_emit_replaces_the_pending_one(sent):
+    async def run():
+        state_emitter = StateEmitter(window=0.05)
+        await state_emitter.emit(CONFIG, _state(1))
+        await state_emitter.emit(CONFIG, _state(2))  # within the window, deferred
+        pending = state_emitter._pending_task
+        assert pending is not None and len(sent) == 1
+
+        await state_emitter.emit(CONFIG, _state(3), force=True)
+        await asyncio.sleep(0.1)
+        assert pending.cancelled() and state_emitter._pending_task is None
+
+    asyncio.run(run())
+    assert [payload["logs"][0]["message"] for payload in sent] == ["step 1", "step 3"]
+
+
+def test_latest_state_of_a_burst_is_delivered(sent):
+    async def run():
+        state_emitter = StateEmitter(window=0.05)
+        for step in range(1, 5):
+            await state_emitter.emit(CONFIG, _state(step))
+        assert len(sent) == 1
+        await asyncio.sleep(0.1)
+        assert [payload["logs"][0]["message"] for payload in sent] == ["step 1", "step 4"]
+
+        # flush delivers the pending state without waiting for the window
+        await state_emitter.emit(CONFIG, _state(5))
+        await state_emitter.flush(CONFIG)
+        assert sent[-1]["logs"][0]["message"] == "step 5" and state_emitter._pending_task is None
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import extraction
+from extraction import clean_page, clean_pages, split_chunks
+from tokens import count_tokens
+
+ARTICLE = [
+    "# Port traffic in 2024",
+    "Cargo volumes reached a record in the third quarter, driven by container traffic from Asia.",
+    "Rail connections reduced truck congestion around the terminals. " * 3,
+]
+PAGE = "\n".join([
+    "Skip to main content",
+    "Home", "News", "Ports", "Contact",
+    "",
+    "We use cookies to improve your experience. Accept all",
+    "",
+    ARTICLE[0],
+    "",
+    "[Share](https://example.com/share) [Tweet](https://twitter.com/x)",
+    ARTICLE[1],
+    "​",
+    ARTICLE[2],
+    "",
+    "![chart](https://example.com/chart.png)",
+    "Back to top",
+    "© 2024 Harbour News. All rights reserved.",
+])
+
+
+def test_boilerplate_is_stripped_and_measured():
+    content, stats = clean_page(PAGE)
+    # The zero width space is removed, leaving a blank line between the paragraphs
+    assert split_chunks(content) == [ARTICLE[0], ARTICLE[1], ARTICLE[2].strip()]
+    assert stats["chunks"] == 3 and stats["chunk_tokens"] == [count_tokens(chunk) for chunk in split_chunks(content)]
+    assert stats["tokens"] == sum(stats["chunk_tokens"]) and stats["chars"] == len(content)
+    assert stats["raw_chars"] == len(PAGE) and stats["dropped_lines"] == 10 and not stats["truncated"]
+
+
+def test_pages_are_capped_to_the_token_budget():
+    page = "\n\n".join(f"Paragraph {i}. " + "The terminal handled more ships than planned. " * 10 for i in range(20))
+    content, stats = clean_page(page, max_tokens=300, chunk_tokens=40)
+    assert stats["truncated"] and stats["tokens"] <= 300
+    assert max(stats["chunk_tokens"]) <= 40 and content.startswith("Paragraph 0.")
+    assert clean_page(page, max_tokens=10)[1]["chunks"] == 0  # too little left for a truncated chunk
+
+
+class BrokenPool(ProcessPoolExecutor):
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("no process support")
+
+
+def test_pages_are_cleaned_in_threads_when_the_process_pool_fails(monkeypatch):
+    monkeypatch.setattr(extraction, "EXTRACT_POOL", "process")
+    monkeypatch.setattr(extraction, "_executor", BrokenPool(1))
+
+    pages = [PAGE, "\n\n".join(ARTICLE)]
+    assert asyncio.run(clean_pages(pages)) == [clean_page(page) for page in pages]
+    assert isinstance(extraction._executor, ThreadPoolExecutor)
+    extraction._executor.shutdown()
@@ -0,0 +1,66 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+
+from history import compact_history
+
+
+def _turn(i, tool=True):
+    messages = [HumanMessage(content=f"Question {i} " + "about the port traffic " * 20, id=f"h{i}")]
+    if tool:
+        call = {"name": "tavily_search", "args": {"query": f"query {i}"}, "id": f"call{i}"}
+        messages.append(AIMessage(content="", tool_calls=[call], id=f"a{i}"))
+        messages.append(ToolMessage(content=f'[{{"title": "Source {i}", "content": "{"text " * 200}"}}]',
+                                    tool_call_id=f"call{i}", name="tavily_search", id=f"t{i}"))
+    messages.append(AIMessage(content=f"Answer {i}. " + "The volumes grew. " * 20, id=f"r{i}"))
+    return messages
+
+
+def _history(turns):
+    return [message for i in range(turns) for message in _turn(i)]
+
+
+def _assert_tool_pairs(history):
+    calls = set()
+    for message in history:
+        if isinstance(message, AIMessage):
+            calls.update(call["id"] for call in message.tool_calls)
+        elif isinstance(message, ToolMessage):
+            assert message.tool_call_id in calls
+
+
+def test_history_under_budget_is_unchanged():
+    messages = _history(2)
+    history, summary = compact_history(messages, None, budget=100_000)
+    assert history == messages
+    assert summary == {"text": "", "last_id": None}
+
+
+def test_folded_turns_keep_tool_calls_with_their_outputs():
+    messages = _history(6)
+    history, summary = compact_history(messages, None, budget=600)
+
+    assert isinstance(history[0], SystemMessage) and summary["text"] in history[0].content
+    assert summary["last_id"].startswith("r")
+    # Whole turns are folded: the history resumes at the human message after the last folded one
+    kept = history[1:]
+    assert isinstance(kept[0], HumanMessage) and kept[-1] == messages[-1]
+    assert kept[0].id == f"h{int(summary['last_id'][1:]) + 1}"
+    _assert_tool_pairs(kept)
+    # The folded tool output is summarized on the line of its turn
+    last = summary["text"].split("\n")[-1]
+    assert f"tavily_search: [search returned 1 sources: Source {summary['last_id'][1:]}]" in last
+
+
+def test_summary_is_not_duplicated_when_compacting_again():
+    messages = _history(6)
+    _, summary = compact_history(messages, None, budget=600)
+
+    messages += _turn(6)
+    history, again = compact_history(messages, summary, budget=600)
+    lines = again["text"].split("\n")
+    assert len(lines) == len(set(lines))
+    assert sum(isinstance(message, SystemMessage) for message in history) == 1
+    assert int(again["last_id"][1:]) > int(summary["last_id"][1:])
+    _assert_tool_pairs(history[1:])
+
+    # Compacting the same history with its own summary folds nothing more
+    assert compact_history(messages, again, budget=600) == (history, again)
@@ -0,0 +1,45 @@
+import json
+
+from json_utils import ObjectStreamParser, loads
+
+DOCUMENT = {
+    "title": "Port {traffic}",
+    "sections": {
+        "section1": {"title": "Volumes", "content": 'Cargo "records" {and} [brackets] \\ backslash', "refs": [1, {"n": 2}]},
+        "section2": {"title": "Rail", "content": "Rail links.\n\"Quoted\" end}"},
+    },
+    "footer": {"note": "not a section"},
+}
+TEXT = json.dumps(DOCUMENT, indent=2)
+
+
+def _stream(chunks, path=("sections",)):
+    parser = ObjectStreamParser(path)
+    return [member for chunk in chunks for member in parser.feed(chunk)]
+
+
+def test_members_split_across_chunks():
+    expected = list(DOCUMENT["sections"].items())
+    assert _stream([TEXT]) == expected
+    assert _stream(TEXT) == expected  # one character per chunk
+    for split in range(1, len(TEXT)):
+        assert _stream([TEXT[:split], TEXT[split:]]) == expected
+
+
+def test_quotes_and_braces_inside_strings_are_ignored():
+    text = '{"sections": {"a": {"content": "\\"}\\" {", "k\\"ey": "]"}, "b\\"": {"x": "\\\\"}}}'
+    assert _stream(text) == [("a", {"content": '"}" {', 'k"ey': "]"}), ('b"', {"x": "\\"})]
+    assert _stream([TEXT], path=("footer",)) == []  # the footer is a member of the root, not of "footer"
+    assert _stream([TEXT], path=()) == [("sections", DOCUMENT["sections"]), ("footer", DOCUMENT["footer"])]
+
+
+def test_truncated_input_returns_the_completed_members():
+    end = TEXT.index('"section2"')
+    assert _stream([TEXT[:end]]) == [("section1", DOCUMENT["sections"]["section1"])]
+    assert _stream([TEXT[:TEXT.index("Rail links")]]) == [("section1", DOCUMENT["sections"]["section1"])]
+    assert _stream(['{"sections": {"section1": {"title": "Vol']) == []
+
+
+def test_loads_accepts_lenient_json():
+    assert loads('{"a": [1, 2]}') == {"a": [1, 2]}
+    assert loads("{a: 'b', trailing: [1,],}") == {"a": "b", "trailing": [1]}
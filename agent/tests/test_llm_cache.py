@@ -0,0 +1,75 @@
+import asyncio
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from llm_cache import CachedChatModel, LLMCache
+
+
+class Events(AsyncCallbackHandler):
+    def __init__(self):
+        self.events = []
+
+    async def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.events.append("start")
+
+    async def on_llm_new_token(self, token, **kwargs):
+        self.events.append("token")
+
+    async def on_llm_end(self, response, **kwargs):
+        self.events.append("end")
+
+
+class CountingModel(GenericFakeChatModel):
+    calls: int = 0
+
+    async def _agenerate(self, *args, **kwargs):
+        self.calls += 1
+        return await super()._agenerate(*args, **kwargs)
+
+    async def _astream(self, *args, **kwargs):
+        self.calls += 1
+        async for chunk in super()._astream(*args, **kwargs):
+            yield chunk
+
+
+def _model(params, path):
+    llm = CountingModel(messages=iter([AIMessage(content=f"answer {i}") for i in range(10)]))
+    return llm, CachedChatModel(llm, params, LLMCache("cache", path=path))
+
+
+def test_only_deterministic_calls_are_cached(tmp_path):
+    async def run():
+        prompt = [HumanMessage(content="Outline the topic")]
+        llm, cached = _model({"model": "m", "temperature": 0}, str(tmp_path / "llm.sqlite3"))
+        first = await cached.ainvoke(prompt)
+        second = await cached.ainvoke(prompt)
+        assert llm.calls == 1 and second.content == first.content
+
+        llm, sampled = _model({"model": "m"}, str(tmp_path / "sampled.sqlite3"))
+        assert (await sampled.ainvoke(prompt)).content != (await sampled.ainvoke(prompt)).content
+        assert llm.calls == 2
+
+    asyncio.run(run())
+
+
+def test_hits_run_through_the_callbacks(tmp_path):
+    async def run():
+        prompt = [HumanMessage(content="Draft the section")]
+        llm, cached = _model({"model": "m", "model_kwargs": {"response_format": {"type": "json_object"}}},
+                             str(tmp_path / "llm.sqlite3"))
+        recorded = [chunk.content async for chunk in cached.astream(prompt)]
+
+        handler = Events()
+        replayed = [chunk.content async for chunk in cached.astream(prompt, {"callbacks": [handler]})]
+        assert llm.calls == 1 and "".join(replayed) == "".join(recorded)
+        assert handler.events[0] == "start" and handler.events[-1] == "end" and "token" in handler.events
+
+        handler = Events()
+        await cached.ainvoke(prompt, {"callbacks": [handler]})  # recorded by this call
+        response = await cached.ainvoke(prompt, {"callbacks": [handler]})
+        assert llm.calls == 2 and response.id and response.content == "answer 1"
+        assert handler.events == ["start", "end", "start", "end"]
+
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+import pytest
+
+from patches import PatchError, apply_edits, join_blocks, patch_section, split_blocks
+
+SECTION = {
+    "title": "Port traffic",
+    "content": (
+        "## Volumes\n\n"
+        "Cargo volumes reached a record in the third quarter.[^1]\n\n"
+        "```\nteu = 1200000\n\nmonthly = teu / 3\n```\n\n"
+        "Rail connections reduced truck congestion."
+    ),
+    "footer": "[^1]: Harbour authority report",
+    "idx": 0,
+}
+
+
+def test_fenced_code_is_one_block():
+    blocks = split_blocks(SECTION["content"])
+    assert len(blocks) == 4
+    assert blocks[2].startswith("```") and blocks[2].endswith("```")
+    assert join_blocks(blocks) == SECTION["content"]
+
+
+def test_edits_refer_to_the_original_block_numbers():
+    blocks = split_blocks(SECTION["content"])
+    patched, changed = apply_edits(blocks, [
+        {"op": "delete", "block": 0, "anchor": "## Volumes"},
+        {"op": "insert_after", "block": -1, "text": "## Traffic"},
+        {"op": "replace", "block": 3, "anchor": "Rail connections", "text": "Rail links cut congestion."},
+    ])
+    assert patched == ["## Traffic", blocks[1], blocks[2], "Rail links cut congestion."]
+    assert changed == [0, 3]
+
+
+def test_patch_section_keeps_the_other_fields():
+    patched, changed = patch_section(SECTION, [
+        {"op": "insert_after", "block": 1, "anchor": "cargo volumes reached", "text": "Growth should slow next year."},
+    ])
+    assert changed == [2]
+    assert patched["idx"] == 0 and patched["footer"] == SECTION["footer"] and patched["title"] == SECTION["title"]
+    assert "Growth should slow next year." in patched["content"]
+    assert "Growth" not in SECTION["content"]  # the given section is not modified
+
+
+@pytest.mark.parametrize("edits, footer", [
+    ([], None),
+    ([{"op": "replace", "block": 1, "anchor": "Rail connections", "text": "x"}], None),
+    ([{"op": "replace", "block": 9, "anchor": "Rail", "text": "x"}], None),
+    ([{"op": "delete", "block": 1, "anchor": "Cargo"}, {"op": "replace", "block": 1, "anchor": "Cargo", "text": "x"}], None),
+    ([{"op": "replace", "block": 2, "anchor": "```", "text": "```\nunclosed"}], None),
+    ([{"op": "replace", "block": 3, "anchor": "Rail", "text": "Rail links.[^2]"}], None),
+    ([{"op": "replace", "block": 1, "anchor": "Cargo", "text": "Cargo grew.[^1]"}], "[^2]: Another report"),
+])
+def test_invalid_patches_are_rejected(edits, footer):
+    with pytest.raises(PatchError):
+        patch_section(SECTION, edits, footer)
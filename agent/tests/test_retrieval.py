@@ -0,0 +1,51 @@
+from retrieval import SourceIndex, chunk_text, get_chunked_source, retrieve
+
+SOURCES = {
+    "https://example.com/ports": {"title": "Ports", "content": "Container ports handled record cargo volumes."},
+    "https://example.com/rail": {"title": "Rail", "content": "Rail freight eased congestion at container ports. "
+                                                             "Rail links carried cargo inland."},
+    "https://example.com/weather": {"title": "Weather", "content": "Storms delayed shipping in the north sea."},
+}
+
+
+def test_chunks_keep_paragraphs_together():
+    text = "one two\n\nthree\n\nfour five six\n\n" + " ".join(f"w{i}" for i in range(7))
+    assert chunk_text(text, chunk_words=5) == ["one two three", "four five six", "w0 w1 w2 w3 w4", "w5 w6"]
+    assert chunk_text("", chunk_words=5) == []
+
+
+def test_chunks_are_ranked_by_relevance():
+    results = SourceIndex(SOURCES).search("rail cargo")
+    assert [result["url"] for result in results] == ["https://example.com/rail", "https://example.com/ports"]
+    assert results[0]["score"] > results[1]["score"] > 0
+    assert results[0]["title"] == "Rail"
+
+    # Chunks that do not fit the token budget are skipped, not truncated
+    assert retrieve(SOURCES, "rail cargo", token_budget=12) == results[1:]
+    assert retrieve(SOURCES, "rail cargo", top_k=1) == results[:1]
+
+
+def test_empty_query_or_corpus_returns_nothing():
+    index = SourceIndex(SOURCES)
+    assert index.search("") == []
+    assert index.search("the and of") == []  # only stopwords
+    assert index.search("volcano") == []
+    assert SourceIndex().search("rail") == []
+    assert SourceIndex({"https://example.com/empty": {"content": ""}}).search("rail") == []
+
+
+def test_changed_content_is_chunked_again():
+    url = "https://example.com/changing"
+    first = get_chunked_source(url, {"content": "Harbour dredging finished in spring."})
+    assert get_chunked_source(url, {"content": "Harbour dredging finished in spring."}) is first
+
+    updated = {"content": "Harbour expansion approved by the council."}
+    second = get_chunked_source(url, updated)
+    assert second is not first and second.chunks == [updated["content"]]
+
+    index = SourceIndex({url: {"content": "Harbour dredging finished in spring."}})
+    assert index.search("dredging")
+    index.update({url: updated})
+    assert index.search("dredging") == [] and index.search("council")[0]["url"] == url
+    index.update({})
+    assert index.search("council") == []
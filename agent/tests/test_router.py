@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+import router
+from router import MODEL_PROMPT_LIMITS, ModelRouter, load_routes
+
+ROUTES = {"agent": [{"model": "small", "max_prompt_tokens": 1000}, {"model": "large", "max_prompt_tokens": 8000}]}
+
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    # call(llm) receives the name of the routed model
+    monkeypatch.setattr(router, "get_llm", lambda model, **kwargs: model)
+
+
+def _run(model_router, call, prompt_tokens=0):
+    return asyncio.run(model_router.run("agent", call, prompt_tokens))
+
+
+def test_default_candidates_have_prompt_limits():
+    routes = load_routes('{"draft": [{"model": "gpt-4o", "max_prompt_tokens": 5000}, {"model": "custom"}]}')
+    assert all(c["max_prompt_tokens"] == MODEL_PROMPT_LIMITS[c["model"]] for c in routes["agent"])
+    assert [c["max_prompt_tokens"] for c in routes["draft"]] == [5000, None]
+
+
+def test_falls_back_to_the_next_candidate_on_error():
+    model_router = ModelRouter(ROUTES)
+
+    async def call(model):
+        if model == "small":
+            raise RuntimeError("overloaded")
+        return model
+
+    assert _run(model_router, call) == "large"
+    assert [(d["model"], d.get("error")) for d in model_router.decisions] == [("small", "RuntimeError"), ("large", None)]
+
+    async def fail(model):
+        raise RuntimeError(model)
+
+    with pytest.raises(RuntimeError, match="large"):
+        _run(model_router, fail)
+
+
+def test_skips_candidates_the_prompt_is_too_large_for():
+    model_router = ModelRouter(ROUTES)
+
+    async def call(model):
+        return model
+
+    assert _run(model_router, call, prompt_tokens=500) == "small"
+    assert _run(model_router, call, prompt_tokens=2000) == "large"
+    assert model_router.plan("agent", 2000) == [(ROUTES["agent"][1], "preferred")]
+    # Too large for every candidate: the one with the largest context is still tried
+    assert model_router.plan("agent", 10000) == [(ROUTES["agent"][1], "largest_context")]
+
+
+def test_unhealthy_candidate_is_demoted_until_its_cooldown_ends(monkeypatch):
+    monkeypatch.setattr(router, "ROUTER_MIN_SAMPLES", 3)
+    model_router = ModelRouter(ROUTES)
+    for _ in range(3):
+        model_router.health("agent", "small").record(False, 0.1)
+
+    assert [(c["model"], reason) for c, reason in model_router.plan("agent")] == [
+        ("large", "preferred"), ("small", "demoted:error_rate")]
+
+    model_router.health("agent", "small").updated_at -= router.ROUTER_COOLDOWN + 1
+    assert model_router.plan("agent")[0] == (ROUTES["agent"][0], "preferred")
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from scheduler import RequestScheduler
+
+
+def _scheduler(**kwargs):
+    options = dict(max_concurrency=4, rate=1000, burst=1000, timeout=1.0, hedge_after=0.05, max_attempts=2)
+    options.update(kwargs)
+    return RequestScheduler(**options)
+
+
+def test_slow_attempt_is_hedged_and_the_fastest_wins():
+    scheduler = _scheduler(timeout=0.2)  # hedged after max(hedge_after, timeout / 2) without latency samples
+    delays = iter([1.0, 0.01])
+    started = []
+
+    async def fn():
+        delay = next(delays)
+        started.append(delay)
+        await asyncio.sleep(delay)
+        return delay
+
+    assert asyncio.run(scheduler.submit(fn, session="s")) == 0.01
+    assert started == [1.0, 0.01]
+    assert scheduler.stats["hedged"] == 1
+    assert scheduler.stats["attempts"] == 2
+
+
+def test_hedge_delay_follows_the_recent_p95():
+    scheduler = _scheduler(hedge_after=0.01)
+    scheduler._latencies.extend([0.1] * 19 + [0.5] * 2)
+    assert scheduler.hedge_delay() == 0.5
+    assert _scheduler(hedge_after=0).hedge_delay() is None
+    assert _scheduler(max_attempts=1).hedge_delay() is None
+
+
+def test_failed_attempt_is_retried_then_the_error_is_raised():
+    scheduler = _scheduler(hedge_after=0)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("reset")
+        return "ok"
+
+    assert asyncio.run(scheduler.submit(flaky, session="s")) == "ok"
+
+    async def failing():
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(scheduler.submit(failing, session="s"))
+    assert scheduler.stats["errors"] == 1
+
+
+def test_waiting_sessions_are_served_round_robin():
+    scheduler = _scheduler(max_concurrency=1, hedge_after=0)
+    order = []
+
+    def request(session):
+        async def fn():
+            order.append(session)
+            await asyncio.sleep(0)
+        return scheduler.submit(fn, session=session)
+
+    async def run():
+        await asyncio.gather(*(request("big") for _ in range(3)), request("small"))
+
+    asyncio.run(run())
+    # The small session waits for one request of the big one, not for all of them
+    assert order == ["big", "big", "small", "big"]
@@ -0,0 +1,31 @@
+from sections import DELETED_KEY, HASH_KEY, VERSION_KEY, merge_section_lists, section_tombstone
+
+
+def _section(idx, content="text"):
+    return {"idx": idx, "title": f"Section {idx}", "content": content, "footer": ""}
+
+
+def test_sections_are_merged_by_idx():
+    merged = merge_section_lists(merge_section_lists(None, [_section(2)]), [_section(0), _section(1)])
+    assert [sec["idx"] for sec in merged] == [0, 1, 2]
+    assert all(sec[VERSION_KEY] == 1 and sec[HASH_KEY] for sec in merged)
+
+    edited = merge_section_lists(merged, [_section(1, "edited")])
+    assert [sec["content"] for sec in edited] == ["text", "edited", "text"]
+    assert edited[1][VERSION_KEY] == 2 and edited[0] is merged[0]
+
+
+def test_unchanged_write_keeps_the_list():
+    merged = merge_section_lists(None, [_section(0)])
+    assert merge_section_lists(merged, [_section(0)]) is merged
+
+
+def test_tombstone_deletes_the_section():
+    merged = merge_section_lists(None, [_section(0), _section(1), _section(2)])
+    deleted = merge_section_lists(merged, [section_tombstone(1)])
+    assert [sec["idx"] for sec in deleted] == [0, 2]
+    assert not any(DELETED_KEY in sec for sec in deleted)
+
+    # A later write without section 1 does not bring it back, a tombstone of a missing section is a no-op
+    assert [sec["idx"] for sec in merge_section_lists(deleted, [_section(2, "edited")])] == [0, 2]
+    assert merge_section_lists(deleted, [section_tombstone(5)]) is deleted
@@ -0,0 +1,47 @@
+from blob_store import REF_KEY
+from source_digest import digest_sources, extract_entities, format_source_digests, get_source_digest
+from tokens import count_tokens
+
+
+def _sources(n):
+    return {
+        f"https://example.com/{i}": {
+            "title": f"Port report {i}",
+            "content": f"The Port of Rotterdam handled {i} million containers. Maersk and MSC expanded the terminal.",
+            "score": i / n,
+        }
+        for i in range(n)
+    }
+
+
+def test_entities_skip_sentence_starts():
+    text = "Shipping grew. Vessels from Maersk reached the Port of Rotterdam. Later, Maersk told the EU. Shipping slowed."
+    assert extract_entities(text) == ["Maersk", "Port of Rotterdam", "EU"]
+
+
+def test_digests_fit_the_token_budget():
+    sources = _sources(40)
+    sources["https://example.com/0"][REF_KEY] = {"hash": "page"}  # extracted, listed first despite its score
+    sources["https://example.com/0"]["raw_content"] = "The Port of Rotterdam page."
+    digests = digest_sources(sources)
+    budget = sum(digest["tokens"] for digest in digests.values()) // 4
+
+    text = format_source_digests(sources, digests, token_budget=budget)
+    listed, more = text.rsplit("\n", 1)
+    assert count_tokens(listed) <= budget
+    assert listed.startswith("- title: Port report 0 ") and "\n- title: Port report 39 " in listed
+    assert more == f"({40 - listed.count('- title: ')} more sources not listed)"
+
+    assert "not listed" not in format_source_digests(sources, digests, token_budget=100_000)
+
+
+def test_digests_are_stable_for_unchanged_sources():
+    sources = _sources(5)
+    digests = digest_sources(sources)
+    assert digest_sources(_sources(5)) == digests
+    assert get_source_digest("https://example.com/1", dict(sources["https://example.com/1"])) is digests["https://example.com/1"]
+    assert format_source_digests(sources, digests) == format_source_digests(_sources(5), digest_sources(_sources(5)))
+
+    changed = {**sources["https://example.com/1"], "content": "A rail terminal opened in Hamburg."}
+    digest = get_source_digest("https://example.com/1", changed)
+    assert digest is not digests["https://example.com/1"] and digest["entities"] == ["Hamburg"]
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import speculation
+from cache import TieredCache
+from speculation import Speculator
+
+CONFIG = {"configurable": {"thread_id": "thread"}}
+
+
+def _state(*titles, rejected=()):
+    sections = {f"section{i}": {"title": title, "description": f"About {title}", "approved": title not in rejected}
+                for i, title in enumerate(titles)}
+    return {"messages": [HumanMessage(content="Port traffic")], "sources": {},
+            "proposal": {"timestamp": "1", "sections": sections}}
+
+
+def _outline(*titles):
+    return {f"section{i}": {"title": title, "description": f"About {title}"} for i, title in enumerate(titles)}
+
+
+@pytest.fixture
+def speculated(monkeypatch):
+    calls = {}
+
+    async def speculate(research_query, section, idx, state):
+        calls[section["title"]] = (research_query, idx)
+        if "block" in calls:
+            await calls["block"].wait()
+        return {"sources": {f"https://example.com/{section['title']}": {}}, "section": None}
+
+    monkeypatch.setattr(speculation, "_speculate", speculate)
+    return calls
+
+
+def test_commit_returns_the_results_of_the_approved_outline(speculated):
+    async def run():
+        speculator = Speculator("prefetch")
+        state = _state("Volumes", "Rail", "Weather", rejected=("Weather",))
+        speculator.start(CONFIG, state)
+        speculator.start(CONFIG, state)  # already started
+        assert speculator.stats["started"] == 2
+
+        # Rail was kept and moved first, Volumes was edited out of the outline
+        results = await speculator.commit(CONFIG, state["proposal"], _outline("Rail", "Harbours"))
+        assert results == [{"sources": {"https://example.com/Rail": {}}, "section": None, "idx": 0}]
+        assert speculated["Rail"] == ("Port traffic", 1)
+        assert await speculator.commit(CONFIG, state["proposal"], _outline("Rail")) == []
+        return speculator.stats
+
+    assert asyncio.run(run()) == {"started": 2, "committed": 1, "cancelled": 1, "failed": 0}
+
+
+def test_cancel_leaves_no_pending_tasks(speculated):
+    async def run():
+        speculated["block"] = asyncio.Event()  # never set
+        speculator = Speculator("prefetch", max_proposals=1)
+        speculator.start(CONFIG, _state("Volumes"))
+        speculator.start(CONFIG, {**_state("Rail"), "proposal": {**_state("Rail")["proposal"], "timestamp": "2"}})
+        assert speculator.stats["cancelled"] == 1  # the oldest proposal was evicted
+
+        speculator.cancel(CONFIG, {"timestamp": "2"})
+        await asyncio.sleep(0)
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+        return speculator
+
+    speculator = asyncio.run(run())
+    assert speculator.stats["cancelled"] == 2 and not speculator._proposals
+
+
+def test_cancelled_prefetch_does_not_block_cache_waiters(monkeypatch):
+    cache = TieredCache("test", path=None)
+    fetches = []
+
+    async def search():
+        fetches.append(1)
+        await asyncio.sleep(0.05)
+        return ["result"]
+
+    async def speculate(research_query, section, idx, state):
+        return {"sources": await cache.get_or_fetch("query", search, ttl=60), "section": None}
+
+    monkeypatch.setattr(speculation, "_speculate", speculate)
+
+    async def run():
+        speculator = Speculator("prefetch")
+        state = _state("Volumes")
+        speculator.start(CONFIG, state)
+        await asyncio.sleep(0)  # the speculative search is in flight
+        waiter = asyncio.create_task(cache.get_or_fetch("query", search, ttl=60))
+        await asyncio.sleep(0)
+
+        speculator.cancel(CONFIG, state["proposal"])
+        return await asyncio.wait_for(waiter, 1)
+
+    assert asyncio.run(run()) == ["result"]
+    assert len(fetches) == 2
@@ -0,0 +1,48 @@
+import state_budget
+from blob_store import REF_KEY
+from state_budget import apply_budget, evict_sources, state_size
+
+
+def _sources(n):
+    return {f"https://example.com/{i}": {"url": f"https://example.com/{i}", "content": "text", "score": i / n}
+            for i in range(n)}
+
+
+def test_lowest_scored_uncited_sources_are_evicted():
+    sources = _sources(6)
+    sources["https://example.com/0"][REF_KEY] = {"key": "page"}  # extracted
+    sections = [{"idx": 0, "content": "As reported,[^1] ...", "footer": "[^1]: https://www.example.com/1."}]
+
+    kept, evicted = evict_sources(sources, sections, max_sources=3)
+    assert evicted == ["https://example.com/2", "https://example.com/3", "https://example.com/4"]
+    assert list(kept) == ["https://example.com/0", "https://example.com/1", "https://example.com/5"]
+    assert evict_sources(kept, sections, max_sources=3) == (kept, [])
+
+
+def test_apply_budget_bounds_logs_and_sources(monkeypatch):
+    monkeypatch.setattr(state_budget, "STATE_MAX_SOURCES", 4)
+    monkeypatch.setattr(state_budget, "STATE_MAX_LOGS", 2)
+    state = {"messages": [], "sources": _sources(6), "logs": [{"message": str(i), "done": True} for i in range(5)]}
+
+    size = apply_budget(state)
+    assert list(state["sources"]) == [f"https://example.com/{i}" for i in (2, 3, 4, 5)]
+    assert [log["message"] for log in state["logs"]] == ["3", "4"]
+    assert (size["evicted_sources"], size["dropped_logs"], size["sources"]) == (2, 3, 4)
+
+
+def test_size_is_measured_from_the_changed_keys(monkeypatch):
+    monkeypatch.setattr(state_budget, "_session_stats", type(state_budget._session_stats)())
+    state = {"messages": [{"content": "hello"}], "sources": _sources(3), "outline": {"a": 1}}
+    apply_budget(state, "session")
+
+    state["messages"].append({"content": "world!"})
+    state["sources"] = _sources(5)
+    state["outline"] = {"a": 2, "b": 3}  # not reported as changed, measured at the next full measurement
+    size = apply_budget(state, "session", ["sources"])
+    full = state_size(state)
+    assert size["bytes_by_key"]["messages"] == full["bytes_by_key"]["messages"] == 11
+    assert size["bytes_by_key"]["sources"] == full["bytes_by_key"]["sources"]
+    assert size["bytes_by_key"]["outline"] < full["bytes_by_key"]["outline"]
+
+    monkeypatch.setattr(state_budget, "STATE_SIZE_FULL_EVERY", 2)
+    assert apply_budget(state, "session", [])["bytes"] == full["bytes"]
@@ -0,0 +1,45 @@
+import pytest
+
+from tool_state import ReadOnlyStateError, ToolState
+
+
+def _graph_state():
+    return {
+        "messages": [],
+        "logs": [{"message": "Searching", "done": False}],
+        "sources": {"https://example.com": {"url": "https://example.com", "title": "Example"}},
+        "proposal": {"approved": False},
+    }
+
+
+def test_assigning_a_key_that_was_not_taken_over_is_rejected():
+    state = ToolState(_graph_state())
+    with pytest.raises(ReadOnlyStateError):
+        state["proposal"] = {"approved": True}
+    with pytest.raises(ReadOnlyStateError):
+        state.update(logs=[])
+    assert state.changes() == {}
+
+
+def test_own_copies_nested_values():
+    graph_state = _graph_state()
+    state = ToolState(graph_state)
+    logs = state.own("logs", list)
+    logs[0]["done"] = True
+    logs.append({"message": "Extracting", "done": False})
+    state.own("sources")["https://example.com"]["title"] = "Changed"
+
+    assert graph_state["logs"] == [{"message": "Searching", "done": False}]
+    assert graph_state["sources"]["https://example.com"]["title"] == "Example"
+    assert state.changes()["logs"][0]["done"] is True
+    assert state.own("logs") is logs  # taken over once
+
+
+def test_assign_replaces_without_copying():
+    graph_state = _graph_state()
+    state = ToolState(graph_state)
+    proposal = {"approved": True}
+    state.assign("proposal", proposal)
+    state["proposal"] = proposal  # taken over, further writes are allowed
+    assert state.changes() == {"proposal": proposal}
+    assert graph_state["proposal"] == {"approved": False}
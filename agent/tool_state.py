@@ -0,0 +1,161 @@
+import copy
+from collections import OrderedDict
+from collections.abc import Sequence
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Set
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+# Description: The state tools receive from tool_node. Tools used to get the whole graph state with the conversation
+# converted to a new list of dicts on every call, validated by pydantic and stringified by the tool callbacks. A
+# ToolState is a shallow, per-call view of the graph state instead:
+# - the conversation is projected lazily, a message is converted to its {"type", "content"} dict only when a tool
+#   reads it, and projections are cached by message id across calls;
+# - keys the tool assigns are recorded, and tools return changes() as the explicit change set that tool_node commits;
+# - the values are the graph's own. A tool takes a key over with own(), which copies the value and the dicts and lists
+#   it holds, before modifying it in place or assigning it, and with assign() to only replace it. Assigning a key that
+#   was not taken over raises ReadOnlyStateError;
+# - its repr is constant size, so the tool callbacks do not serialize the state.
+
+PROJECTION_CACHE_SIZE = 4096
+
+_projections: "OrderedDict[str, Mapping[str, Any]]" = OrderedDict()
+
+
+def _message_type(message: BaseMessage) -> str:
+    if isinstance(message, HumanMessage):
+        return "HumanMessage"
+    if isinstance(message, SystemMessage):
+        return "SystemMessage"
+    if isinstance(message, ToolMessage):
+        return "ToolMessage"
+    return "AIMessage"
+
+
+def project_message(message: Any) -> Mapping[str, Any]:
+    """
+    Read-only {"type", "content"} projection of a message, cached by message id.
+    """
+    if not isinstance(message, BaseMessage):
+        return MappingProxyType(dict(message)) if isinstance(message, Mapping) else message
+    projection = _projections.get(message.id) if message.id else None
+    if projection is None:
+        projection = MappingProxyType({"type": _message_type(message), "content": message.content})
+        if message.id:
+            _projections[message.id] = projection
+            while len(_projections) > PROJECTION_CACHE_SIZE:
+                _projections.popitem(last=False)
+    else:
+        _projections.move_to_end(message.id)
+    return projection
+
+
+class MessagesView(Sequence):
+    """
+    Read-only sequence of message projections over the messages of the graph state, projected on access.
+    """
+
+    def __init__(self, messages: Optional[List[Any]] = None):
+        self._messages = messages or []
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [project_message(message) for message in self._messages[index]]
+        return project_message(self._messages[index])
+
+    def __repr__(self) -> str:
+        return f"MessagesView({len(self._messages)} messages)"
+
+
+class ReadOnlyStateError(KeyError):
+    """
+    Raised when a tool assigns a key of the state it did not take over with own() or assign().
+    """
+
+
+def _copy_value(value: Any) -> Any:
+    """
+    Copy of a container and of the dicts and lists it holds, e.g. the log entries or the source dicts.
+    """
+    if isinstance(value, Mapping):
+        return {k: copy.copy(v) if isinstance(v, (dict, list)) else v for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy.copy(v) if isinstance(v, (dict, list)) else v for v in value]
+    return copy.copy(value)
+
+
+def assign_key(state: Any, key: str, value: Any) -> None:
+    """
+    Assign a key of a state that is either a ToolState or the graph's own state dict.
+    """
+    if isinstance(state, ToolState):
+        state.assign(key, value)
+    else:
+        state[key] = value
+
+
+class ToolState(dict):
+    """
+    Per-call view of the graph state for tools, recording the keys the tool assigns.
+    """
+
+    def __init__(self, state: Optional[Mapping[str, Any]] = None):
+        state = state or {}
+        super().__init__((key, value) for key, value in state.items() if key != "messages")
+        messages = state.get("messages")
+        super().__setitem__("messages", messages if isinstance(messages, MessagesView) else MessagesView(messages))
+        self.changed: Set[str] = set()
+        self.owned: Set[str] = set()
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.owned:
+            raise ReadOnlyStateError(f"State key {key!r} is assigned without being taken over with own() or assign()")
+        super().__setitem__(key, value)
+        self.changed.add(key)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self.owned:
+            raise ReadOnlyStateError(f"State key {key!r} is deleted without being taken over with own() or assign()")
+        super().__delitem__(key)
+        self.changed.discard(key)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def own(self, key: str, factory: Callable[[], Any] = dict) -> Any:
+        """
+        The value of a key, copied on first use together with the dicts and lists it holds, so the tool can modify it
+        in place and assign it without modifying the graph state. The key is recorded as changed.
+        """
+        if key not in self.owned:
+            value = self.get(key)
+            self.assign(key, _copy_value(value) if value is not None else factory())
+        return self[key]
+
+    def assign(self, key: str, value: Any) -> None:
+        """
+        Replace the value of a key without copying the current one, the key is taken over from then on.
+        """
+        self.owned.add(key)
+        self[key] = value
+
+    def changes(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        The keys assigned since the view was created, optionally limited to the given keys.
+        """
+        keys = self.changed if keys is None else self.changed.intersection(keys)
+        return {key: self[key] for key in keys}
+
+    def __repr__(self) -> str:
+        return f"ToolState(keys={len(self)}, changed={sorted(self.changed)})"
+
+    __str__ = __repr__
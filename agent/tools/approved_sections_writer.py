@@ -0,0 +1,60 @@
+import asyncio
+import os
+from typing import Optional, Annotated
+from langchain_core.tools import InjectedToolArg, tool
+from tool_state import ToolState
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel, ConfigDict, Field
+from emitter import emit_state
+from telemetry import span
+
+from tools.section_writer import write_section, merge_sections
+
+# Maximum number of sections written concurrently by a single approved_sections_writer call
+SECTION_WRITER_CONCURRENCY = int(os.getenv("SECTION_WRITER_CONCURRENCY", "4"))
+
+
+class ApprovedSectionsWriterInput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    research_query: str = Field(description="The research query or topic of the report.")
+    state: Annotated[Optional[ToolState], InjectedToolArg] = Field(default=None, description="State of the research")
+
+
+@tool("approved_sections_writer", args_schema=ApprovedSectionsWriterInput, return_direct=True)
+async def approved_sections_writer(research_query, state):
+    """Writes every section of the approved outline that has not been written yet, all at once."""
+
+    config = RunnableConfig()
+    written_idxs = {sec['idx'] for sec in state.get("sections", [])}
+    pending = [
+        (idx, section['title'])
+        for idx, section in enumerate(state.get("outline", {}).values())
+        if idx not in written_idxs
+    ]
+    if not pending:
+        return state.changes(), "All the sections of the approved outline are already written"
+
+    semaphore = asyncio.Semaphore(SECTION_WRITER_CONCURRENCY)
+
+    async def write(idx, section_title):
+        async with semaphore:
+            with span("write_section", "tool", idx=idx):
+                return await write_section(research_query, section_title, idx, state)
+
+    # Every section streams under its own section_stream.* keys, so the frontend renders them side by side
+    results = await asyncio.gather(*(write(idx, title) for idx, title in pending), return_exceptions=True)
+
+    sections = []
+    tool_msg = ""
+    for (idx, section_title), result in zip(pending, results):
+        if isinstance(result, Exception):
+            tool_msg += f"Error generating the {section_title} Section, idx: {idx}: {result}\n"
+        else:
+            sections.append(result)
+            tool_msg += f"Wrote the {section_title} Section, idx: {idx}\n"
+
+    merge_sections(state, sections)
+    state.assign("logs", [{**log, "done": True} for log in state.get("logs", [])])
+    await emit_state(config, state)
+
+    return state.changes(), tool_msg
@@ -0,0 +1,61 @@
+import asyncio
+import json
+from langchain_core.tools import InjectedToolArg, tool
+from tool_state import ToolState
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, Annotated
+from langchain_core.runnables import RunnableConfig
+from emitter import emit_state
+from source_digest import ingest_sources
+from knowledge import knowledge_store
+from dedup import SIMHASH_KEY, SourceDeduper
+from blob_store import REF_KEY
+from telemetry import record_error
+
+KNOWLEDGE_SEARCH_RESULTS = 10
+
+
+class KnowledgeSearchInput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    query: str = Field(description="Search query, a few keywords describing the information needed")
+    state: Annotated[Optional[ToolState], InjectedToolArg] = Field(default=None, description="State of the research")
+
+
+@tool("knowledge_search", args_schema=KnowledgeSearchInput, return_direct=True)
+async def knowledge_search(query, state):
+    """Search the local knowledge store of sources found in earlier research sessions, before searching the web."""
+
+    config = RunnableConfig()
+    state.own("logs", list)
+    log_index = len(state["logs"])
+    state["logs"].append({
+        "message": f"📚 Searching the knowledge store: '{query}'",
+        "done": False
+    })
+    await emit_state(config, state)
+
+    try:
+        results = await asyncio.to_thread(knowledge_store.search, query, KNOWLEDGE_SEARCH_RESULTS)
+    except Exception as e:
+        record_error(e)
+        results = []
+
+    sources = state.own('sources')
+    deduper = SourceDeduper(sources)
+    new_sources = {}
+    tool_msg = "In the knowledge store, found the following new documents:\n"
+    for source in results:
+        if deduper.add(source['url'], source):
+            new_sources[source['url']] = source
+            tool_msg += json.dumps({k: v for k, v in source.items() if k not in (SIMHASH_KEY, REF_KEY)})
+    state['sources'] = sources
+
+    # Chunk, index and digest the new sources off the event loop so section_writer can retrieve from them
+    await asyncio.to_thread(ingest_sources, new_sources)
+
+    state["logs"][log_index] = {**state["logs"][log_index], "done": True}
+    await emit_state(config, state)
+
+    if not new_sources:
+        return state.changes(), "No new documents found in the knowledge store, use the tavily_search tool to search the web."
+    return state.changes(), tool_msg
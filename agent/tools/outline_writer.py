@@ -1,13 +1,20 @@
-import json5 as json
+import asyncio
+import json
 from datetime import datetime
-from typing import Optional, Dict
+from typing import Optional, Annotated
 
 from langchain_community.adapters.openai import convert_openai_messages
-from langchain_core.tools import tool
-from pydantic import BaseModel, Field
-from langchain_openai import ChatOpenAI
-
-from copilotkit.langchain import copilotkit_emit_state
+from langchain_core.tools import InjectedToolArg, tool
+from tool_state import ToolState
+from pydantic import BaseModel, ConfigDict, Field
+
+from copilotkit.langchain import copilotkit_customize_config
+from emitter import emit_state
+from json_utils import loads, ObjectStreamParser
+from telemetry import record_error
+from router import model_router
+from source_digest import digest_sources, format_source_digests
+from tokens import count_tokens
 from langchain_core.runnables import RunnableConfig
 
 
@@ -26,20 +33,20 @@ PROPOSAL_FORMAT = {
 
 PROPOSAL_KEYS = list(PROPOSAL_FORMAT.keys())
 
+
 class OutlineWriterInput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
     research_query: str = Field(description="Research query")
-    state: Optional[Dict] = Field(description="State of the research")
+    state: Annotated[Optional[ToolState], InjectedToolArg] = Field(default=None, description="State of the research")
 
 @tool("outline_writer", args_schema=OutlineWriterInput, return_direct=True)
 async def outline_writer(research_query, state):
     """Writes a research outline proposal based on the research query"""
-    # Get sources from state
+    # Sources are listed by their digests, within a token budget. Digests are computed when sources are ingested,
+    # only sources that were not digested in this process (e.g. after a resume on another worker) are digested here.
     sources = state.get("sources", {})
-    sources_summary = ""
-    for url, source in sources.items():
-        sources_summary += f"- title: {source['title']}"
-        sources_summary += f" url:  {source['url']}"
-        sources_summary += f" content:  {source['content']}\n"
+    digests = await asyncio.to_thread(digest_sources, sources)
+    sources_summary = format_source_digests(sources, digests)
 
     # Check if a current proposal exists
     current_proposal = state.get('proposal', None)
@@ -86,35 +93,54 @@ async def outline_writer(research_query, state):
                    f"Your Proposal:"
     }]
 
-    config = RunnableConfig()
-    state["logs"] = state.get("logs", [])
+    # The proposal JSON is streamed, it must not be rendered as a chat message
+    config = copilotkit_customize_config(RunnableConfig(), emit_messages=False)
+    state.own("logs", list)
     state["logs"].append({
         "message": "💭 Thinking of a research proposal",
         "done": False
     })
-    await copilotkit_emit_state(config, state)
+    await emit_state(config, state)
 
     state["logs"].append({
         "message": "✨ Generating a research proposal outline",
         "done": False
     })
-    state["logs"][-2]["done"] = True
-    await copilotkit_emit_state(config, state)
+    state["logs"][-2] = {**state["logs"][-2], "done": True}
+    await emit_state(config, state)
 
     try:
 
         lc_messages = convert_openai_messages(prompt)
-        optional_params = {
-            "response_format": {"type": "json_object"}
-        }
-
-        response = ChatOpenAI(model='gpt-4o-mini', max_retries=1, model_kwargs=optional_params).invoke(lc_messages, config).content
-
-        for i, log in enumerate(state["logs"]):
-            state["logs"][i]["done"] = True
-        await copilotkit_emit_state(config, state)
 
-        proposal = json.loads(response)
+        # Stream the proposal and emit the partial proposal every time the JSON object of a section is complete
+        logs_before = list(state["logs"])
+
+        async def call(llm):
+            # A fallback attempt starts over, without the sections proposed by the attempt that failed
+            state["logs"] = list(logs_before)
+            sections = {}
+            parser = ObjectStreamParser(("sections",))
+            async for chunk in llm.astream(lc_messages, config):
+                for key, section in parser.feed(chunk.content or ""):
+                    if isinstance(section, dict) and section.get("title"):
+                        sections[key] = section
+                        state.assign("proposal", {"sections": dict(sections), "approved": False})
+                        state["logs"].append({
+                            "message": f"📑 Proposed the {section['title']} section",
+                            "done": True
+                        })
+                        await emit_state(config, state)
+            return parser.text
+
+        prompt_tokens = sum(count_tokens(message["content"]) for message in prompt)
+        response = await model_router.run("outline", call, prompt_tokens,
+                                          model_kwargs={"response_format": {"type": "json_object"}})
+
+        state["logs"] = [{**log, "done": True} for log in state["logs"]]
+        await emit_state(config, state)
+
+        proposal = loads(response)
 
         # Validate proposal structure using module-level keys
         if not all(key in proposal for key in PROPOSAL_KEYS):
@@ -126,14 +152,15 @@ async def outline_writer(research_query, state):
         proposal["remarks"] = ""   # Reset user remarks if the model included them in the new proposal
 
         tool_msg = f"Generated the following outline proposal:\n{response}"
-        state["proposal"] = proposal
+        state.assign("proposal", proposal)
 
         # Clear logs
         state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
-        return state, tool_msg
+        return state.changes(), tool_msg
     except Exception as e:
+        record_error(e)
         # Create fallback structure using same keys
         fallback = {
             key: [] for key in PROPOSAL_KEYS
@@ -142,10 +169,10 @@ async def outline_writer(research_query, state):
             "timestamp": datetime.now().isoformat(),
             "error": str(e)
         })
-        state["proposal"] = fallback
+        state.assign("proposal", fallback)
 
         # Clear logs
         state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        await emit_state(config, state)
 
-        return state, f"Error generating outline proposal: {e}"
\ No newline at end of file
+        return state.changes(), f"Error generating outline proposal: {e}"
\ No newline at end of file
@@ -1,41 +1,81 @@
+import logging
+import os
 from datetime import datetime
-from typing import Optional, Dict, cast
+from typing import Optional, List, Literal, cast, Annotated
 from langchain_core.messages import AIMessage, ToolMessage
 from langchain_community.adapters.openai import convert_openai_messages
-from langchain_core.tools import tool
+from langchain_core.tools import InjectedToolArg, tool
+from tool_state import ToolState, assign_key
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 import random
 import string
-from copilotkit.langchain import copilotkit_customize_config, copilotkit_emit_state
+from copilotkit.langchain import copilotkit_customize_config
+from emitter import emit_state
+from router import model_router
+from tokens import count_tokens
+from retrieval import retrieve, format_chunks
+from report_digest import update_digest
+from sections import index_sections, merge_section_lists
+from telemetry import record_error
+from patches import PatchError, patch_section, split_blocks, number_blocks
+
+# Edits of existing sections are asked as block patches ("patch") or as a rewrite of the whole section ("rewrite").
+# Sections shorter than SECTION_PATCH_MIN_CHARS are always rewritten, their rewrite is as cheap as a patch. Patches only
+# shrink the model's output: the patched section is merged, emitted to the frontend and checkpointed whole.
+SECTION_EDIT_MODE = os.getenv("SECTION_EDIT_MODE", "patch")
+SECTION_PATCH_MIN_CHARS = int(os.getenv("SECTION_PATCH_MIN_CHARS", "1000"))
+
+logger = logging.getLogger(__name__)
 
 @tool
 def WriteSection(title: str, content: str, section_number: int, footer: str = ""): # pylint: disable=invalid-name,unused-argument
     """Write a section with content and footer containing references"""
 
+class BlockEdit(BaseModel):
+    op: Literal["replace", "insert_after", "delete"] = Field(description="replace the block with text, insert text after the block, or delete the block")
+    block: int = Field(description="Number of the block to edit, -1 with insert_after to insert before the first block")
+    anchor: str = Field(default="", description="The first words of the block, copied exactly")
+    text: str = Field(default="", description="The new markdown of the block, or the markdown to insert")
+
+@tool
+def PatchSection(edits: List[BlockEdit], footer: Optional[str] = None, title: Optional[str] = None): # pylint: disable=invalid-name,unused-argument
+    """Edit a section with targeted edits of its numbered blocks. Only give the footer or title when they change, the footer in full."""
+
 def generate_random_id(length=6):
     return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
 class SectionWriterInput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
     research_query: str = Field(description="The research query or topic for the section.")
     section_title: str = Field(description="The title of the specific section to write.")
     idx: int = Field(description="An index representing the order of this section (starting at 0")
-    state: Optional[Dict] = Field(description="State of the research")
+    state: Annotated[Optional[ToolState], InjectedToolArg] = Field(default=None, description="State of the research")
 
 
-@tool("section_writer", args_schema=SectionWriterInput, return_direct=True)
-async def section_writer(research_query, section_title, idx, state):
-    """Writes a specific section of a research report based on the query, section title, and provided sources."""
+def merge_sections(state, sections):
+    """
+    Merge written sections into state["sections"], replacing sections with the same idx and keeping them ordered by idx.
+    The report digest is updated for the merged sections only.
+    """
+    assign_key(state, "sections", merge_section_lists(state.get("sections"), sections))
+    merged = index_sections(state["sections"])
+    assign_key(state, "digest", update_digest(state.get("digest"), [merged[sec['idx']] for sec in sections]))
 
+
+async def write_section(research_query, section_title, idx, state):
+    """
+    Write or edit a single section and return it without committing it to state. Each call streams its content and
+    footer under its own section_stream.* state keys, so several sections can be written concurrently.
+    """
     config = RunnableConfig()
-    # Log search queries
-    state["logs"] = state.get("logs", [])
-    state["logs"].append({
+    state.own("logs", list)
+    log = {
         "message": f"📝 Writing the {section_title} section...",
         "done": False
-    })
-    await copilotkit_emit_state(config, state)
+    }
+    state["logs"].append(log)
+    await emit_state(config, state)
 
     section_id = generate_random_id()
     section = {
@@ -63,10 +103,28 @@ async def section_writer(research_query, section_title, idx, state):
     )
 
     outline = state.get("outline", {})
-    sources = state.get("sources").values()
-    section_exists = True if section['idx'] in [sec['idx'] for sec in state['sections']] else False
+    written = index_sections(state.get('sections'))
+    section_exists = section['idx'] in written
+
+    request = next((msg['content'] for msg in reversed(state['messages']) if msg['type'] == 'HumanMessage'), 'No specific user request found') if section_exists else ""
+    if section_exists and SECTION_EDIT_MODE == "patch":
+        current_section_state = written[section['idx']]
+        if len(current_section_state.get('content', '')) >= SECTION_PATCH_MIN_CHARS:
+            try:
+                patched, changed = await patch_existing_section(current_section_state, request)
+                log["message"] = f"✏️ Edited {len(changed)} blocks of the {section_title} section"
+                log["done"] = True
+                await emit_state(config, state)
+                return patched
+            except PatchError as e:
+                logger.warning("Patching the %s section failed, rewriting it: %s", section_title, e)
 
     if not section_exists:
+        # Only the source chunks most relevant to this section are sent, within the retrieval token budget
+        description = next((sec.get('description', '') for sec in outline.values() if sec.get('title') == section_title), '')
+        sources = state.get("sources") or {}
+        relevant_chunks = retrieve(sources, f"{section_title} {description}") or retrieve(sources, research_query)
+
         # Define the system and user prompts
         prompt = [{
             "role": "system",
@@ -110,7 +168,8 @@ async def section_writer(research_query, section_title, idx, state):
                 f"Research Query: {research_query}\n\n" 
                 f"Section Title: {section_title}\n\n"
                 f"Section Number: {idx}\n\n"
-                f"Sources:\n{sources}\n\n"
+                f"Section Description: {description}\n\n"
+                f"Sources:\n{format_chunks(relevant_chunks)}\n\n"
                 "Write a section using the write_section tool. The section should be detailed and well-structured in markdown. "
                 "Use appropriate markdown formatting to create a professional academic document. "
                 "Only use footnotes when citing sources or referencing external material. "
@@ -120,7 +179,7 @@ async def section_writer(research_query, section_title, idx, state):
         }]
     else:
         # get the current content of the section we want to update
-        current_section_state = state['sections'][section['idx']]
+        current_section_state = written[section['idx']]
         prompt = [{
             "role": "system",
             "content": (
@@ -132,7 +191,7 @@ async def section_writer(research_query, section_title, idx, state):
                 f"Content : {current_section_state['content']}\n"
                 f"Footer : {current_section_state['footer']}\n\n"
                 "Now use the user's request to alter the given section."
-                f"The user request : {next((msg['content'] for msg in reversed(state['messages']) if msg['type'] == 'HumanMessage'), 'No specific user request found')}"
+                f"The user request : {request}"
             )
         }, {
             "role": "user",
@@ -145,47 +204,96 @@ async def section_writer(research_query, section_title, idx, state):
             )
         }]
 
+    # Convert prompts for OpenAI API
+    lc_messages = convert_openai_messages(prompt)
+
+    # Invoke the model with tool, edits of an existing section are routed to a smaller model than drafts
+    async def call(llm):
+        return await llm.bind_tools([WriteSection]).ainvoke(lc_messages, config)
+
+    prompt_tokens = sum(count_tokens(message["content"]) for message in prompt)
+    response = await model_router.run("edit" if section_exists else "draft", call, prompt_tokens)
+
+    log["done"] = True
+    await emit_state(config, state)
+
+    ai_message = cast(AIMessage, response)
+    if ai_message.tool_calls:
+        if ai_message.tool_calls[0]["name"] == "WriteSection":
+            section["title"] = ai_message.tool_calls[0]["args"].get("title", "")
+            section["content"] = ai_message.tool_calls[0]["args"].get("content", "")
+            section["footer"] = ai_message.tool_calls[0]["args"].get("footer", "")
+
+    # Process each stream state
+    stream_states = {
+        "content": content_state,
+        "footer": footer_state
+    }
+
+    for stream_type, stream_info in stream_states.items():
+        if stream_info["state_key"] in state:
+            state.assign(stream_info["state_key"], None)
+
+    return section
+
+
+async def patch_existing_section(section, request):
+    """
+    Edit a written section with block patches instead of a rewrite, so the output scales with the change rather than
+    with the section. Returns the patched section and the positions of its changed blocks, raises PatchError when the
+    model's edits do not apply.
+    """
+    blocks = split_blocks(section.get('content', ''))
+    prompt = [{
+        "role": "system",
+        "content": (
+            "You are an AI assistant that makes changes to a given section of a research report in markdown format. "
+            "The content of the section is split into numbered blocks. Use the PatchSection tool to make only the changes "
+            "requested by the user, as edits of the blocks that need to change: replace a block, insert a block after "
+            "another one, or delete a block. Every edit must quote the first words of its block as the anchor. "
+            "Keep every other block as it is, and do not change the title unless explicitly requested by the user. "
+            "If references are added or removed, give the complete new footer.\n\n"
+            f"Title : {section['title']}\n\n"
+            f"Content :\n{number_blocks(blocks)}\n\n"
+            f"Footer : {section.get('footer', '')}"
+        )
+    }, {
+        "role": "user",
+        "content": f"The user request : {request}"
+    }]
+    lc_messages = convert_openai_messages(prompt)
+    config = copilotkit_customize_config(RunnableConfig(), emit_messages=False)
+
+    async def call(llm):
+        return await llm.bind_tools([PatchSection], tool_choice="PatchSection").ainvoke(lc_messages, config)
+
+    prompt_tokens = sum(count_tokens(message["content"]) for message in prompt)
+    response = cast(AIMessage, await model_router.run("edit", call, prompt_tokens))
+    if not response.tool_calls or response.tool_calls[0]["name"] != "PatchSection":
+        raise PatchError("The model did not answer with a patch")
+
+    args = response.tool_calls[0]["args"]
+    return patch_section(section, args.get("edits") or [], args.get("footer"), args.get("title"))
+
+
+@tool("section_writer", args_schema=SectionWriterInput, return_direct=True)
+async def section_writer(research_query, section_title, idx, state):
+    """Writes a specific section of a research report based on the query, section title, and provided sources."""
+
+    config = RunnableConfig()
     try:
-        # Convert prompts for OpenAI API
-        lc_messages = convert_openai_messages(prompt)
-
-        # Invoke OpenAI's model with tool
-        model = ChatOpenAI(model="gpt-4o-mini", max_retries=1)
-        response = await model.bind_tools([WriteSection]).ainvoke(lc_messages, config)
-
-        state["logs"][-1]["done"] = True
-        await copilotkit_emit_state(config, state)
-
-        ai_message = cast(AIMessage, response)
-        if ai_message.tool_calls:
-            if ai_message.tool_calls[0]["name"] == "WriteSection":
-                section["title"] = ai_message.tool_calls[0]["args"].get("title", "")
-                section["content"] = ai_message.tool_calls[0]["args"].get("content", "")
-                section["footer"] = ai_message.tool_calls[0]["args"].get("footer", "")
-
-        if section_exists:
-            state["sections"][section['idx']] = section
-        else:
-            state["sections"].append(section)
-
-        # Process each stream state
-        stream_states = {
-            "content": content_state,
-            "footer": footer_state
-        }
-
-        for stream_type, stream_info in stream_states.items():
-            if stream_info["state_key"] in state:
-                state[stream_info["state_key"]] = None
-        await copilotkit_emit_state(config, state)
+        section = await write_section(research_query, section_title, idx, state)
+        merge_sections(state, [section])
+        await emit_state(config, state)
 
         tool_msg = f"Wrote the {section_title} Section, idx: {idx}"
 
-        return state, tool_msg
+        return state.changes(), tool_msg
     except Exception as e:
+        record_error(e)
 
         # Clear logs
-        state["logs"] = []
-        await copilotkit_emit_state(config, state)
+        state.assign("logs", [])
+        await emit_state(config, state)
 
-        return state, f"Error generating section: {e}"
+        return state.changes(), f"Error generating section: {e}"
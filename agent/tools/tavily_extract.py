@@ -1,16 +1,36 @@
-from langchain_core.tools import tool
-from pydantic import BaseModel, Field
-from tavily import AsyncTavilyClient
-from typing import List, Optional, Dict
-from copilotkit.langchain import copilotkit_emit_state
+import asyncio
+from langchain_core.tools import InjectedToolArg, tool
+from tool_state import ToolState
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional, Annotated
+from emitter import emit_state
 from langchain_core.runnables import RunnableConfig
+from source_digest import ingest_sources
+from cache import extract_cache, EXTRACT_TTL
+from urls import canonicalize_url
+from blob_store import blob_store, REF_KEY
+from dedup import SIMHASH_KEY, SourceDeduper, simhash
+from extraction import STATS_KEY, clean_pages
+from knowledge import knowledge_store
+from clients import get_tavily_client
+from scheduler import tavily_scheduler
+from telemetry import record_error
 
-tavily_client = AsyncTavilyClient()
+def _store_page(url: str, content: str, stats: dict) -> dict:
+    """
+    Store a cleaned page in the blob store and the knowledge store. The reference also carries the page's SimHash,
+    so that cached pages can be checked for near duplicates without reading them back, and its size statistics.
+    """
+    ref = blob_store.put(content)
+    knowledge_store.add_page(url, content, ref)
+    signature = simhash(content)
+    return {**ref, SIMHASH_KEY: None if signature is None else f"{signature:016x}", STATS_KEY: stats}
 
 
 class TavilyExtractInput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
     urls: List[str] = Field(description="List of a single or several URLs for extracting raw content to gather additional information")
-    state: Optional[Dict] = Field(description="State of the research")
+    state: Annotated[Optional[ToolState], InjectedToolArg] = Field(default=None, description="State of the research")
 
 
 @tool("tavily_extract", args_schema=TavilyExtractInput, return_direct=True)
@@ -18,29 +38,66 @@ async def tavily_extract(urls, state):
     """Perform full scrape to a provided list of urls."""
 
     try:
-        response = await tavily_client.extract(urls=urls)
-        results = response['results']
-        # Match and add raw_content to urls in state
+        # Pages are cached by canonical URL, only the URLs that were never extracted are sent to Tavily. The cache holds
+        # blob store references, the cleaned page content itself is stored once in the blob store.
+        keys = {url: extract_cache.make_key("page", canonicalize_url(url)) for url in urls}
+
+        async def extract(missing_keys):
+            missing_urls = [url for url, key in keys.items() if key in missing_keys]
+            response = await tavily_scheduler.submit(lambda: get_tavily_client().extract(urls=missing_urls))
+            # Boilerplate is stripped and pages are capped in the extraction worker pool, off the event loop
+            pages = await clean_pages([itm['raw_content'] or "" for itm in response['results']])
+            refs = await asyncio.gather(*(asyncio.to_thread(_store_page, itm['url'], content, stats)
+                                          for itm, (content, stats) in zip(response['results'], pages)))
+            return {
+                extract_cache.make_key("page", canonicalize_url(itm['url'])): ref
+                for itm, ref in zip(response['results'], refs)
+            }
+
+        refs = await extract_cache.get_many_or_fetch(list(keys.values()), extract, EXTRACT_TTL)
+        results = [{'url': url, REF_KEY: refs[key]} for url, key in keys.items() if refs.get(key)]
+        # Match and add the raw_content reference to urls in state
         tool_msg = "Extracted raw content to gather additional information from the following sources:\n"
+        deduper = SourceDeduper(state.own("sources"))
+        extracted = {}
         for itm in results:
             url = itm['url']
-            raw_content = itm['raw_content']
-            if url in state["sources"]:
-                state["sources"][url]['raw_content'] = raw_content
-            else:
-                state["sources"][url] = {'raw_content': raw_content}
+            # A variant of a URL already in state (AMP, mobile, tracking parameters) updates that source
+            key = deduper.find(url) or url
+            if key != url:
+                deduper.alias(key, url)
+            source = state["sources"][key] = {k: v for k, v in state["sources"].get(key, {}).items() if k != 'raw_content'}
+            ref = {k: v for k, v in itm[REF_KEY].items() if k not in (SIMHASH_KEY, STATS_KEY)}
+            source[REF_KEY] = ref
+            source[STATS_KEY] = itm[REF_KEY].get(STATS_KEY)
+
+            # A syndicated copy of a page that was already extracted is folded into the source of that page
+            signature = itm[REF_KEY].get(SIMHASH_KEY)
+            duplicate_of = deduper.update_signature(key, None if signature is None else int(signature, 16))
+            if duplicate_of is not None:
+                state["sources"][duplicate_of] = {REF_KEY: ref, **state["sources"][duplicate_of]}
+                deduper.alias(duplicate_of, key)
+                for alternate in state["sources"].pop(key).get("alternate_urls", []):
+                    deduper.alias(duplicate_of, alternate)
+                extracted.pop(key, None)
+                key = duplicate_of
+            extracted[key] = state["sources"][key]
             tool_msg += f"{url}\n"
 
+        # Re-index and digest the extracted sources off the event loop, their raw_content replaces the search snippet
+        await asyncio.to_thread(ingest_sources, extracted)
+
         config = RunnableConfig()
-        state["logs"] = state.get("logs", [])
+        state.own("logs", list)
         state["logs"].append({
             "message": "🚀 Extracting additional content from valuable sources",
             "done": True
         })
-        await copilotkit_emit_state(config, state)
-        return state, tool_msg
+        await emit_state(config, state)
+        return state.changes(), tool_msg
 
     except Exception as e:
+        record_error(e)
         print(f"Error occurred during extract: {str(e)}")
-        return state, ""
+        return state.changes(), ""
 
@@ -1,15 +1,23 @@
 import asyncio
-from copilotkit.langchain import copilotkit_emit_state
+from emitter import emit_state
 from datetime import datetime
 from dotenv import load_dotenv
 import json
-from langchain_core.tools import tool
-from pydantic import BaseModel, Field
-from tavily import AsyncTavilyClient
-from typing import List, Dict, Optional
+from urllib.parse import urlsplit
+from langchain_core.tools import InjectedToolArg, tool
+from tool_state import ToolState
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional, Annotated
 from langchain_core.runnables import RunnableConfig
+from source_digest import ingest_sources
+from cache import search_cache, SEARCH_TTLS
+from clients import get_tavily_client
+from scheduler import tavily_scheduler
+from dedup import SIMHASH_KEY, SourceDeduper
+from knowledge import KNOWLEDGE_MIN_HITS, knowledge_store
+from blob_store import REF_KEY
+from telemetry import record_error
 load_dotenv('.env')
-tavily_client = AsyncTavilyClient()
 
 # Add Tavily's arguments to enhance the web search tool's capabilities
 class TavilyQuery(BaseModel):
@@ -23,8 +31,9 @@ class TavilyQuery(BaseModel):
 
 # Define the args_schema for the tavily_search tool using a multi-query approach, enabling more precise queries for Tavily.
 class TavilySearchInput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
     sub_queries: List[TavilyQuery] = Field(description="Set of sub-queries that can be answered in isolation")
-    state: Optional[Dict] = Field(description="State of the research, will be provided later")
+    state: Annotated[Optional[ToolState], InjectedToolArg] = Field(default=None, description="State of the research, will be provided later")
 
 
 @tool("tavily_search", args_schema=TavilySearchInput, return_direct=True)
@@ -37,50 +46,78 @@ async def tavily_search(sub_queries: List[TavilyQuery], state):
             query_with_date = f"{itm.query} {datetime.now().strftime('%m-%Y')}"
             # state["logs"][index]["message"] = f"🌐 Searched: '{query.query}'",
             topic = itm.topic if itm.topic in ['general','news'] else "general"
-            tavily_response = await tavily_client.search(query=query_with_date, topic=topic, days=itm.days, max_results=10)
-            state["logs"][index]["done"] = True
-            tavily_response['results'] = [search for search in tavily_response['results'] if search['score'] > 0.45]
-            await copilotkit_emit_state(config, state)
-            return tavily_response['results']
+
+            # Sub-queries with enough fresh hits in the local knowledge store are answered without going to the web
+            results = await asyncio.to_thread(knowledge_store.search, itm.query, 10, SEARCH_TTLS[topic], True)
+            if itm.domains:
+                results = [result for result in results
+                           if any((urlsplit(result['url']).hostname or "").endswith(domain) for domain in itm.domains)]
+
+            # Identical searches are served from the cache, concurrent ones share a single Tavily call
+            async def search():
+                tavily_response = await tavily_scheduler.submit(lambda: get_tavily_client().search(
+                    query=query_with_date, topic=topic, days=itm.days, max_results=10,
+                    include_domains=itm.domains or None))
+                await asyncio.to_thread(knowledge_store.add_sources, {r['url']: r for r in tavily_response['results']})
+                return tavily_response['results']
+
+            if len(results) < KNOWLEDGE_MIN_HITS:
+                cache_key = search_cache.make_key(" ".join(query_with_date.lower().split()), topic,
+                                                  itm.days if topic == "news" else None, sorted(itm.domains or []))
+                results = await search_cache.get_or_fetch(cache_key, search, SEARCH_TTLS[topic])
+            state["logs"][index] = {**state["logs"][index], "done": True}
+            # Copy the cached results, the sources are mutated once they are merged into the state
+            results = [dict(result) for result in results if result['score'] > 0.45]
+            await emit_state(config, state)
+            return results
         except Exception as e:
             # Handle any exceptions, log them, and return an empty list
+            record_error(e)
             print(f"Error occurred during search for query '{itm.query}': {str(e)}")
-            state["logs"][index]["done"] = True
-            await copilotkit_emit_state(config, state)
+            state["logs"][index] = {**state["logs"][index], "done": True}
+            await emit_state(config, state)
             return []
 
     config = RunnableConfig()
-    state["logs"] = state.get("logs", [])
+    state.own("logs", list)
+    first_log = len(state["logs"])
     # Log search queries
     for query in sub_queries:
         state["logs"].append({
             "message": f"🌐 Searching the web: '{query.query}'",
             "done": False
         })
-    await copilotkit_emit_state(config, state)
-
-    # Run all the search tasks in parallel
-    search_tasks = [perform_search(query, i) for i, query in enumerate(sub_queries)]
-    search_responses = await asyncio.gather(*search_tasks)
+    await emit_state(config, state)
 
+    # Run all the search tasks in parallel and merge each one's results as soon as it completes
+    search_tasks = [perform_search(query, first_log + i) for i, query in enumerate(sub_queries)]
 
-    # Combine the results from all the responses
     tool_msg = "In search, found the following new documents:\n"
-    sources = state.get('sources', {})
-    for i, response in enumerate(search_responses):
+    sources = state.own('sources')
+    # URL variants and near identical copies of a source already in state are folded into it
+    deduper = SourceDeduper(sources)
+    index_tasks = []
+    for next_response in asyncio.as_completed(search_tasks):
+        response = await next_response
+        new_sources = {}
         for source in response:
-            if not sources or source['url'] not in sources:
-                sources[source['url']] = source
-                tool_msg += json.dumps(source)
+            if deduper.add(source['url'], source):
+                new_sources[source['url']] = source
+                tool_msg += json.dumps({k: v for k, v in source.items() if k not in (SIMHASH_KEY, REF_KEY)})
 
-        state["logs"][i]["done"] = True
-        await copilotkit_emit_state(config, state)
+        if new_sources:
+            state['sources'] = sources
+            await emit_state(config, state)
+            # Chunk, index and digest the new sources off the event loop while the other searches are still running,
+            # so section_writer can retrieve from them and outline_writer can list them
+            index_tasks.append(asyncio.create_task(asyncio.to_thread(ingest_sources, new_sources)))
 
     for key,val in sources.items():
-        if not sources[key].get('title',None):
-            sources[key]['title'] = 'No Title, Invalid Link'
+        if not val.get('title',None):
+            sources[key] = {**val, 'title': 'No Title, Invalid Link'}
 
 
     state['sources'] = sources
+    await asyncio.gather(*index_tasks)
 
-    return state, tool_msg
+    return state.changes(), tool_msg
@@ -0,0 +1,40 @@
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Description: URL canonicalization, so that the same page fetched through different URLs maps to a single key
+
+TRACKING_PARAMS = frozenset({
+    "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref", "ref_src", "cmpid", "_ga", "yclid",
+})
+TRACKING_PREFIXES = ("utm_",)
+
+# Mobile and AMP variants of a page are the same article as the desktop page
+MOBILE_HOST_PREFIXES = ("www.", "m.", "mobile.", "amp.")
+AMP_PARAMS = frozenset({"amp", "outputtype", "output"})
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonicalize a URL: lowercase scheme and host, https, no default port, no fragment, no tracking parameters,
+    sorted query parameters, no trailing slash, and the desktop page for mobile (m.) and AMP variants.
+    """
+    parts = urlsplit(url.strip())
+    scheme = "https" if parts.scheme.lower() in ("http", "https") else parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    for prefix in MOBILE_HOST_PREFIXES:
+        if host.startswith(prefix) and host.count(".") > 1:
+            host = host[len(prefix):]
+            break
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+        and not (key.lower() in AMP_PARAMS and value.lower() in ("", "1", "amp"))
+    )
+    path = parts.path.rstrip("/") or ""
+    if path.endswith("/amp"):
+        path = path[:-4]
+    elif path.startswith("/amp/"):
+        path = path[4:]
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
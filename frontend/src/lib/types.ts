@@ -1,4 +1,4 @@
-export interface Section { title: string; content: string; idx: number; footer?: string; id: string }
+export interface Section { title: string; content: string; idx: number; footer?: string; id: string; deleted?: boolean }
 // export interface Section { title: string; content: string; idx: number; footnotes?: string; id: string }
 
 